@@ -6,7 +6,7 @@
     );
 
     CREATE TABLE Availabilities (
-        Time date
+        Time date,
         Username varchar(255) REFERENCES Caregivers,
         PRIMARY KEY (Time, Username)
     );
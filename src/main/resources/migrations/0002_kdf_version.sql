@@ -0,0 +1,4 @@
+    -- the KDF version each account's hash was made with; NULL means version 1
+    ALTER TABLE Caregivers ADD KdfVersion int;
+
+    ALTER TABLE Patients ADD KdfVersion int;
@@ -0,0 +1,5 @@
+    -- same access paths as the SQL Server migration; SQLite has no INCLUDE, so the covered
+    -- columns trail the key instead
+    CREATE INDEX IX_Appointments_PUsername ON Appointments (PUsername, appointment_id, vaccine_name, Time, CUsername);
+
+    CREATE INDEX IX_Appointments_CUsername ON Appointments (CUsername, appointment_id, vaccine_name, Time, PUsername);
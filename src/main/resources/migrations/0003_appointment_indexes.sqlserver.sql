@@ -0,0 +1,9 @@
+    -- show_appointments and cancel look appointments up by caregiver or by patient and list
+    -- them by id; each index covers everything those queries read, so neither touches the table.
+    -- Availabilities needs nothing new: its primary key (Time, Username) already serves
+    -- search_caregiver_schedule's "WHERE Time = ? ORDER BY Username" and reserve's claim.
+    CREATE INDEX IX_Appointments_PUsername ON Appointments (PUsername, appointment_id)
+        INCLUDE (vaccine_name, Time, CUsername);
+
+    CREATE INDEX IX_Appointments_CUsername ON Appointments (CUsername, appointment_id)
+        INCLUDE (vaccine_name, Time, PUsername);
@@ -0,0 +1,6 @@
+    -- hi/lo rows for db/IdAllocator.py: the next id not yet handed out in a block
+    CREATE TABLE IdBlocks (
+        Name varchar(255),
+        NextId int,
+        PRIMARY KEY (Name)
+    );
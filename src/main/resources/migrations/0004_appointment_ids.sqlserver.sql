@@ -0,0 +1,4 @@
+    -- appointment ids come from this sequence in blocks (see db/IdAllocator.py); it starts
+    -- past any ids already in use
+    DECLARE @start int = (SELECT ISNULL(MAX(appointment_id), 0) + 1 FROM Appointments);
+    EXEC (N'CREATE SEQUENCE AppointmentIds AS int START WITH ' + CAST(@start AS nvarchar(12)));
@@ -0,0 +1,8 @@
+    -- counter rows for db/DoseCounter.py: with DoseShards set, a vaccine's stock is spread
+    -- over these rows plus what is left on its Vaccines row, so bookings stop all updating one row
+    CREATE TABLE DoseShards (
+        Name varchar(255) REFERENCES Vaccines,
+        Shard int,
+        Doses int,
+        PRIMARY KEY (Name, Shard)
+    );
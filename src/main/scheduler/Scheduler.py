@@ -2,23 +2,47 @@ from model.Vaccine import Vaccine
 from model.Caregiver import Caregiver
 from model.Patient import Patient
 from util.Util import Util
+from util.SessionTokens import SessionTokens
+from util.Session import Session
+from util.OutputCapture import capture_output
+from util.Metrics import metrics
 from db.ConnectionManager import ConnectionManager
-import pymssql
+from db.Backend import DatabaseError
+from db.MigrationRunner import MigrationRunner
+from db.ReservationEngine import ReservationEngine, NO_CAREGIVER, NO_DOSES
+from db.InventoryCache import inventory
+from db.DoseCounter import dose_counter
+from db.AvailabilityIndex import availability_index
+from db.AvailabilityJournal import availability_journal
+from db.ScheduleSearch import ScheduleSearch, decode_token
+from db.StatementTrace import trace
+from db.Statements import run_statement, statement_counters
+from db.UtilizationReport import UtilizationReport
+from db.TableExport import TableExport
+import argparse
+import csv
 import datetime
+import json
+import os
+import sys
 import time
 
 
 '''
-objects to keep track of the currently logged-in user
-Note: it is always true that at most one of currentCaregiver and currentPatient is not null
-        since only one user can be logged-in at a time
+the currently logged-in user is kept in a Session passed to every command, one per CLI,
+batch run or server connection
+Note: it is always true that at most one of session.caregiver and session.patient is not null
+        since only one user can be logged-in per session at a time
 '''
-current_patient = None
 
-current_caregiver = None
+# False in batch mode: no menu reprint and no pause after each command
+interactive = True
 
+# tokens handed out at login so the same user can log back in without re-hashing a password
+session_tokens = SessionTokens()
 
-def create_patient(tokens):
+
+def create_patient(session, tokens):
     # create_patient <username> <password>
     # check 1: the length for tokens need to be exactly 3 to include all information (with the operation name)
     if len(tokens) != 3:
@@ -33,15 +57,16 @@ def create_patient(tokens):
         return
 
     salt = Util.generate_salt()
-    hash = Util.generate_hash(password, salt)
+    kdf_version = Util.current_kdf_version()
+    hash = Util.generate_hash(password, salt, kdf_version)
 
     # create the caregiver
-    patient = Patient(username, salt=salt, hash=hash)
+    patient = Patient(username, salt=salt, hash=hash, kdf_version=kdf_version)
 
     # save to caregiver information to our database
     try:
         patient.save_to_db()
-    except pymssql.Error as e:
+    except DatabaseError as e:
         print("Failed to create user.")
         print("Db-Error:", e)
         quit()
@@ -51,20 +76,19 @@ def create_patient(tokens):
         return
     print("Created user ", username)
     display_command()
+    return True
 
 
 def username_exists_patient(username):
     cm = ConnectionManager()
     conn = cm.create_connection()
 
-    select_username = "SELECT * FROM Patients WHERE Username = %s"
     try:
-        cursor = conn.cursor(as_dict=True)
-        cursor.execute(select_username, username)
+        cursor = run_statement(conn, "patient.exists", username)
         #  returns false if the cursor is not before the first record or if there are no rows in the ResultSet.
         for row in cursor:
             return row['Username'] is not None
-    except pymssql.Error as e:
+    except DatabaseError as e:
         print("Error occurred when checking username")
         print("Db-Error:", e)
         quit()
@@ -76,7 +100,7 @@ def username_exists_patient(username):
     return False
 
 
-def create_caregiver(tokens):
+def create_caregiver(session, tokens):
     # create_caregiver <username> <password>
     # check 1: the length for tokens need to be exactly 3 to include all information (with the operation name)
     if len(tokens) != 3:
@@ -91,15 +115,16 @@ def create_caregiver(tokens):
         return
 
     salt = Util.generate_salt()
-    hash = Util.generate_hash(password, salt)
+    kdf_version = Util.current_kdf_version()
+    hash = Util.generate_hash(password, salt, kdf_version)
 
     # create the caregiver
-    caregiver = Caregiver(username, salt=salt, hash=hash)
+    caregiver = Caregiver(username, salt=salt, hash=hash, kdf_version=kdf_version)
 
     # save to caregiver information to our database
     try:
         caregiver.save_to_db()
-    except pymssql.Error as e:
+    except DatabaseError as e:
         print("Failed to create user.")
         print("Db-Error:", e)
         quit()
@@ -109,20 +134,80 @@ def create_caregiver(tokens):
         return
     print("Created user ", username)
     display_command()
+    return True
+
+
+def read_accounts_csv(path):
+    # rows of username,password; an optional header row is skipped. Both are lowercased
+    # like everything typed at the prompt, so the accounts can log in from the CLI
+    accounts = []
+    with open(path, newline="") as f:
+        for row in csv.reader(f):
+            if not row or row[0].strip().lower() == "username":
+                continue
+            if len(row) != 2:
+                raise ValueError("Expected username,password but got: " + ",".join(row))
+            accounts.append((row[0].strip().lower(), row[1].strip().lower()))
+    return accounts
+
+
+def import_accounts(session, tokens, model):
+    # hash every password across a process pool, then insert the accounts in batches as
+    # the hashes come back; usernames that are already taken are skipped
+    if len(tokens) != 2:
+        print("Please try again!")
+        return
+
+    batch_size = 500
+    created = 0
+    try:
+        accounts = read_accounts_csv(tokens[1])
+        import_start = time.perf_counter()
+        kdf_version = Util.current_kdf_version()
+        hashes = Util.generate_hashes([password for _, password in accounts], kdf_version)
+        batch = []
+        for (username, _), (salt, hash) in zip(accounts, hashes):
+            batch.append(model(username, salt=salt, hash=hash, kdf_version=kdf_version))
+            if len(batch) == batch_size:
+                created += model.save_all(batch)
+                batch = []
+        if batch:
+            created += model.save_all(batch)
+        elapsed = time.perf_counter() - import_start
+    except DatabaseError as e:
+        print("Failed to import users.")
+        print("Db-Error:", e)
+        quit()
+    except Exception as e:
+        print("Failed to import users.")
+        print(e)
+        return
+    print(f"Imported users! created: {created}, skipped: {len(accounts) - created}, "
+          f"{len(accounts) / elapsed if elapsed > 0 else 0:.0f} accounts/s")
+    display_command()
+    return True
+
+
+def import_patients(session, tokens):
+    # import_patients <csv file of username,password rows>
+    return import_accounts(session, tokens, Patient)
+
+
+def import_caregivers(session, tokens):
+    # import_caregivers <csv file of username,password rows>
+    return import_accounts(session, tokens, Caregiver)
 
 
 def username_exists_caregiver(username):
     cm = ConnectionManager()
     conn = cm.create_connection()
 
-    select_username = "SELECT * FROM Caregivers WHERE Username = %s"
     try:
-        cursor = conn.cursor(as_dict=True)
-        cursor.execute(select_username, username)
+        cursor = run_statement(conn, "caregiver.exists", username)
         #  returns false if the cursor is not before the first record or if there are no rows in the ResultSet.
         for row in cursor:
             return row['Username'] is not None
-    except pymssql.Error as e:
+    except DatabaseError as e:
         print("Error occurred when checking username")
         print("Db-Error:", e)
         quit()
@@ -134,12 +219,10 @@ def username_exists_caregiver(username):
     return False
 
 
-def login_patient(tokens):
+def login_patient(session, tokens):
     # login_patient <username> <password>
     # check 1: if someone's already logged-in, they need to log out first
-    global current_patient
-    global current_caregiver
-    if current_caregiver is not None or current_patient is not None:
+    if session.logged_in():
         print("User already logged in.")
         return
 
@@ -154,7 +237,7 @@ def login_patient(tokens):
     patient = None
     try:
         patient = Patient(username, password=password).get()
-    except pymssql.Error as e:
+    except DatabaseError as e:
         print("Login failed.")
         print("Db-Error:", e)
         quit()
@@ -168,15 +251,17 @@ def login_patient(tokens):
         print("Login failed.")
     else:
         print("Logged in as: " + username)
-        current_patient = patient
+        session.patient = patient
+        session.token = session_tokens.issue("patient", username)
+        print("Session token: " + session.token)
     display_command()
+    return patient is not None
 
 
-def login_caregiver(tokens):
+def login_caregiver(session, tokens):
     # login_caregiver <username> <password>
     # check 1: if someone's already logged-in, they need to log out first
-    global current_caregiver
-    if current_caregiver is not None or current_patient is not None:
+    if session.logged_in():
         print("User already logged in.")
         return
 
@@ -191,7 +276,7 @@ def login_caregiver(tokens):
     caregiver = None
     try:
         caregiver = Caregiver(username, password=password).get()
-    except pymssql.Error as e:
+    except DatabaseError as e:
         print("Login failed.")
         print("Db-Error:", e)
         quit()
@@ -205,18 +290,67 @@ def login_caregiver(tokens):
         print("Login failed.")
     else:
         print("Logged in as: " + username)
-        current_caregiver = caregiver
+        session.caregiver = caregiver
+        session.token = session_tokens.issue("caregiver", username)
+        print("Session token: " + session.token)
     display_command()
+    return caregiver is not None
 
 
-def search_caregiver_schedule(tokens):
-    global current_caregiver
-    global current_patient
-    cm = ConnectionManager()
-    conn = cm.create_connection()
-    cursor = conn.cursor()
+def login_token(session, tokens):
+    # login_token <session token>
+    # resumes a session issued by login_patient/login_caregiver without checking the password again
+    if session.logged_in():
+        print("User already logged in.")
+        return
+
+    if len(tokens) != 2:
+        print("Login failed.")
+        return
+
+    resumed = session_tokens.validate(tokens[1])
+    if resumed is None:
+        print("Login failed.")
+        return
+
+    role, username = resumed
+    if role == "patient":
+        session.patient = Patient(username)
+    else:
+        session.caregiver = Caregiver(username)
+    session.token = tokens[1]
+    print("Logged in as: " + username)
+    display_command()
+    return True
+
 
-    if current_caregiver is None and current_patient is None:
+def search_caregiver_schedule(session, tokens):
+    # search_caregiver_schedule <date> [<end date>]
+    if not session.logged_in():
+        print("Please login first!")
+        return
+
+    if len(tokens) not in (2, 3):
+        print("Please try again!")
+        return
+
+    try:
+        # assume input is hyphenated in the format mm-dd-yyyy
+        start_date = parse_date(tokens[1]).date()
+        end_date = parse_date(tokens[2]).date() if len(tokens) == 3 else start_date
+    except ValueError:
+        print("Please enter a valid date!")
+        return
+    if end_date < start_date:
+        print("Please try again!")
+        return
+    return print_schedule_page(session, start_date, end_date, None)
+
+
+def search_next(session, tokens):
+    # search_next <continuation token>
+    # the next page of the search that printed the token
+    if not session.logged_in():
         print("Please login first!")
         return
 
@@ -224,29 +358,71 @@ def search_caregiver_schedule(tokens):
         print("Please try again!")
         return
 
-    date = tokens[1]
-    # assume input is hyphenated in the format mm-dd-yyyy
-    date_tokens = date.split("-")
-    month = int(date_tokens[0])
-    day = int(date_tokens[1])
-    year = int(date_tokens[2])
+    try:
+        start_date, end_date, after = decode_token(tokens[1])
+    except ValueError:
+        print("Please try again!")
+        return
+    return print_schedule_page(session, start_date, end_date, after)
+
+
+def print_schedule_page(session, start_date, end_date, after):
     # Output the username for the caregivers that are available for the date, along 
     # with the number of available doses left for each vaccine.
     # Order by the username of the caregiver. Separate each attribute with a space.
-    query_caregiver = 'SELECT Username FROM Availabilities WHERE Time = %s ORDER BY Username'
-    get_all_vaccines = "SELECT Name, Doses FROM vaccines"
+    # Rows are streamed a page at a time and grouped under their date when the range spans
+    # several days; a token for the next page is printed if there is one.
+    cm = session.cm
+    conn = cm.create_connection()
+    search = ScheduleSearch(ConnectionManager.get_backend())
     try:
-        d = datetime.datetime(year, month, day)
-        cursor.execute(query_caregiver, (d,))  # pass parameters as a tuple
-        for row in cursor.fetchall():
-            print("Available Caregiver: " + str(row[0]))  # Access tuple using integer index
+        current = None
+        for d, username in search.rows(conn, start_date, end_date, after):
+            if start_date != end_date and d != current:
+                print("Date: " + d.strftime("%m-%d-%Y"))
+                current = d
+            print("Available Caregiver: " + str(username))
             print('-------------------------------')
-        cursor.execute(get_all_vaccines)
+        # doses come from the in-process inventory cache rather than another query
         print("***********************************")
-        for row in cursor.fetchall():
+        for row in inventory(ConnectionManager.get_backend()).snapshot(conn):
             print("name: " + str(row[0]) + ", available_doses: " + str(row[1]))  # Access tuple using integer index
             print('-------------------------------')
-    except pymssql.Error as e:
+    except DatabaseError as e:
+        print("Search Failed")
+        print("Db-Error:", e)
+        quit()
+    except Exception as e:
+        print("Error occurred when Searching")
+        print("Error:", e)
+        return
+    finally:
+        cm.close_connection()
+    if search.next_token is not None:
+        print("More results: search_next " + search.next_token)
+    print("Search Complete!")
+    display_command()
+    return True
+
+
+def next_available(session, tokens):
+    # next_available <date> <vaccine>
+    # the earliest date on or after <date> with a free caregiver, if <vaccine> has doses left
+    if not session.logged_in():
+        print("Please login first!")
+        return
+
+    if len(tokens) != 3:
+        print("Please try again!")
+        return
+
+    vaccine = tokens[2]
+    try:
+        d = parse_date(tokens[1])
+        backend = ConnectionManager.get_backend()
+        doses = inventory(backend).doses(vaccine)
+        found = availability_index(backend).next_available(d) if doses else None
+    except DatabaseError as e:
         print("Search Failed")
         print("Db-Error:", e)
         quit()
@@ -257,22 +433,109 @@ def search_caregiver_schedule(tokens):
         print("Error occurred when Searching")
         print("Error:", e)
         return
-    print("Search Complete!")
+    if not doses:
+        print("Not enough available doses!")
+    elif found is None:
+        print("No Caregiver is available!")
+    else:
+        day, caregivers = found
+        print(f"Next available: {day.strftime('%m-%d-%Y')}, caregivers: {caregivers}, {vaccine} doses: {doses}")
     display_command()
+    return found is not None
 
 
-def reserve(tokens):
-    global current_caregiver
-    global current_patient
+def capacity(session, tokens):
+    # capacity <start date> <end date>
+    # free caregiver slots per date over the range, and their total
+    if not session.logged_in():
+        print("Please login first!")
+        return
 
-    cm = ConnectionManager()
-    conn = cm.create_connection()
-    cursor = conn.cursor()
-    if current_caregiver is not None:
+    if len(tokens) != 3:
+        print("Please try again!")
+        return
+
+    try:
+        start_date = parse_date(tokens[1])
+        end_date = parse_date(tokens[2])
+        if end_date < start_date:
+            print("Please try again!")
+            return
+        days = availability_index(ConnectionManager.get_backend()).capacity(start_date, end_date)
+    except DatabaseError as e:
+        print("Search Failed")
+        print("Db-Error:", e)
+        quit()
+    except ValueError:
+        print("Please enter a valid date!")
+        return
+    except Exception as e:
+        print("Error occurred when Searching")
+        print("Error:", e)
+        return
+    for day, caregivers in days:
+        print(f"{day.strftime('%m-%d-%Y')} {caregivers}")
+    print(f"Free slots: {sum(caregivers for _, caregivers in days)} over {(end_date - start_date).days + 1} days")
+    display_command()
+    return True
+
+
+def report(session, tokens):
+    # report <start date> <end date>
+    # for caregivers: doses booked per vaccine per day, caregiver utilization over the range
+    # and when each vaccine runs out at the last four weeks' rate
+    if session.caregiver is None:
+        print("Please login as a caregiver first!")
+        return
+
+    if len(tokens) != 3:
+        print("Please try again!")
+        return
+
+    cm = session.cm
+    try:
+        start_date = parse_date(tokens[1]).date()
+        end_date = parse_date(tokens[2]).date()
+        if end_date < start_date:
+            print("Please try again!")
+            return
+        result = UtilizationReport(ConnectionManager.get_backend()).load(cm.create_connection())
+    except DatabaseError as e:
+        print("Report Failed")
+        print("Db-Error:", e)
+        quit()
+    except ValueError:
+        print("Please enter a valid date!")
+        return
+    except Exception as e:
+        print("Error occurred when building the report")
+        print("Error:", e)
+        return
+    finally:
+        cm.close_connection()
+
+    dates, vaccines, counts = result.doses_per_day(start_date, end_date)
+    print("Doses per day: date " + " ".join(vaccines) + " total")
+    for d, date in enumerate(dates):
+        if counts[:, d].any():
+            print(date.strftime('%m-%d-%Y') + " " + " ".join(str(n) for n in counts[:, d]) + f" {counts[:, d].sum()}")
+    print("Total " + " ".join(str(n) for n in counts.sum(axis=1)) + f" {counts.sum()}")
+    print("Caregiver utilization: caregiver booked offered")
+    for username, booked, offered, ratio in result.utilization(start_date, end_date):
+        print(f"{username} {booked} {offered} {ratio:.0%}")
+    print("Stock-out forecast: vaccine doses per-day date")
+    for name, doses, rate, stock_out in result.stock_out(datetime.date.today()):
+        print(f"{name} {doses} {rate:.1f} {stock_out.strftime('%m-%d-%Y') if stock_out else 'never'}")
+    display_command()
+    return True
+
+
+def reserve(session, tokens):
+    if session.caregiver is not None:
         print("Please login as a patient!")
         return
 
-    if current_patient is None:
+    if session.patient is None:
         print("Please login as a patient first!")
         return
 
@@ -288,62 +551,41 @@ def reserve(tokens):
     day = int(date_tokens[1])
     year = int(date_tokens[2])
 
+    reserved = False
+    cm = session.cm
+    conn = cm.create_connection()
     try:
         d = datetime.datetime(year, month, day)
 
-        # Check if there is an available caregiver for the specified date
-        query_caregiver = 'SELECT TOP 1 Username FROM Availabilities WHERE Time = %s'
-        cursor.execute(query_caregiver, (d,))
-        available_caregivers = cursor.fetchall()
-
-        if len(available_caregivers) > 0:
-            caregiver_username = available_caregivers[0][0]
-            # Check if there are enough vaccine doses available
-            get_vaccine_doses = "SELECT Doses FROM Vaccines WHERE Name = %s"
-            cursor.execute(get_vaccine_doses, (vaccine,))
-            available_doses = cursor.fetchone()[0]
-            if available_doses > 0:
-                # Update caregiver's availability
-                update_availability = "DELETE FROM Availabilities WHERE Username = %s AND Time = %s"
-                cursor.execute(update_availability, (caregiver_username, d))
-                # Update vaccine doses
-                update_vaccine = "UPDATE Vaccines SET Doses = Doses - 1 WHERE Name = %s"
-                cursor.execute(update_vaccine, (vaccine,))
-                # Generate and print appointment ID
-                get_appointment_id = 'SELECT max(appointment_id) FROM Appointments'
-                cursor.execute(get_appointment_id)
-                appointment_id = cursor.fetchall()[0][0]
-                if appointment_id is None:
-                    appointment_id = 1
-                else:
-                    appointment_id += 1
-                    print(appointment_id)
-                insert_appointment = "INSERT INTO Appointments (appointment_id, vaccine_name, Time, CUsername, PUsername) VALUES (%s, %s, %s, %s, %s)"
-                cursor.execute(insert_appointment, (appointment_id, vaccine, d, caregiver_username, current_patient.get_username()))
-                print(f"Appointment ID: {appointment_id}, Caregiver username: {caregiver_username}")
-            else:
-                print("Not enough available doses!")
-        else:
+        # claim a caregiver, take a dose and record the appointment in one atomic step
+        engine = ReservationEngine(ConnectionManager.get_backend())
+        status, appointment_id, caregiver_username = engine.reserve(conn, d, vaccine, session.patient.get_username())
+        if status == NO_CAREGIVER:
             print("No Caregiver is available!")
+        elif status == NO_DOSES:
+            print("Not enough available doses!")
+        else:
+            print(f"Appointment ID: {appointment_id}, Caregiver username: {caregiver_username}")
+            print("Reservation Complete!")
+            reserved = True
 
-    except pymssql.Error as e:
+    except DatabaseError as e:
         print("Search Failed")
         print("Db-Error:", e)
     except Exception as e:
         print("Error occurred when Reserving")
         print("Error:", e)
-    else:
-        conn.commit()
-        print("Reservation Complete!")
+    finally:
+        cm.close_connection()
 
     display_command()
+    return reserved
 
 
-def upload_availability(tokens):
+def upload_availability(session, tokens):
     #  upload_availability <date>
     #  check 1: check if the current logged-in user is a caregiver
-    global current_caregiver
-    if current_caregiver is None:
+    if session.caregiver is None:
         print("Please login as a caregiver first!")
         return
 
@@ -360,8 +602,8 @@ def upload_availability(tokens):
     year = int(date_tokens[2])
     try:
         d = datetime.datetime(year, month, day)
-        current_caregiver.upload_availability(d)
-    except pymssql.Error as e:
+        session.caregiver.upload_availability(d)
+    except DatabaseError as e:
         print("Upload Availability Failed")
         print("Db-Error:", e)
         quit()
@@ -374,87 +616,149 @@ def upload_availability(tokens):
         return
     print("Availability uploaded!")
     display_command()
+    return True
 
 
-def cancel(tokens):
-    global current_caregiver
-    global current_patient
+WEEKDAYS = ["mon", "tue", "wed", "thu", "fri", "sat", "sun"]
 
-    cm = ConnectionManager()
-    conn = cm.create_connection()
-    cursor = conn.cursor()
 
-    if current_caregiver is None and current_patient is None:
+def parse_date(date):
+    # assume input is hyphenated in the format mm-dd-yyyy
+    date_tokens = date.split("-")
+    if len(date_tokens) != 3:
+        raise ValueError("Invalid date: " + date)
+    month = int(date_tokens[0])
+    day = int(date_tokens[1])
+    year = int(date_tokens[2])
+    return datetime.datetime(year, month, day)
+
+
+def read_availability_csv(path, username):
+    # rows of caregiver,date (mm-dd-yyyy); an optional header row is skipped.
+    # returns the dates listed for `username` and how many rows named someone else
+    dates = []
+    rejected = 0
+    with open(path, newline="") as f:
+        for row in csv.reader(f):
+            if not row or row[0].strip().lower() in ("caregiver", "username"):
+                continue
+            if len(row) != 2:
+                raise ValueError("Expected caregiver,date but got: " + ",".join(row))
+            if row[0].strip().lower() != username:
+                rejected += 1
+                continue
+            dates.append(parse_date(row[1].strip()))
+    return dates, rejected
+
+
+def upload_availability_bulk(session, tokens):
+    #  upload_availability_bulk <start date> <end date> [<weekdays, e.g. mon,wed,fri>]
+    #  upload_availability_bulk <csv file of caregiver,date rows>
+    if session.caregiver is None:
+        print("Please login as a caregiver first!")
+        return
+
+    if len(tokens) not in (2, 3, 4):
+        print("Please try again!")
+        return
+
+    rejected = 0
+    try:
+        if len(tokens) == 2:
+            dates, rejected = read_availability_csv(tokens[1], session.caregiver.get_username())
+        else:
+            start_date = parse_date(tokens[1])
+            end_date = parse_date(tokens[2])
+            weekdays = WEEKDAYS if len(tokens) == 3 else tokens[3].split(",")
+            if end_date < start_date or any(w not in WEEKDAYS for w in weekdays):
+                print("Please try again!")
+                return
+            days = {WEEKDAYS.index(w) for w in weekdays}
+            dates = [start_date + datetime.timedelta(days=n) for n in range((end_date - start_date).days + 1)]
+            dates = [d for d in dates if d.weekday() in days]
+
+        upload_start = time.perf_counter()
+        inserted, skipped = session.caregiver.upload_availabilities(dates)
+        elapsed = time.perf_counter() - upload_start
+    except DatabaseError as e:
+        print("Upload Availability Failed")
+        print("Db-Error:", e)
+        quit()
+    except ValueError:
+        print("Please enter a valid date!")
+        return
+    except Exception as e:
+        print("Error occurred when uploading availability")
+        print("Error:", e)
+        return
+    print(f"Availability uploaded! inserted: {inserted}, skipped: {skipped}, rejected: {rejected}, "
+          f"{len(dates) / elapsed if elapsed > 0 else 0:.0f} rows/s")
+    display_command()
+    return True
+
+
+def cancel(session, tokens):
+    if not session.logged_in():
         print("Please login first!")
         return
 
     if len(tokens) != 2:
         print("Please try again!")
         return
-    
+
+    cm = session.cm
+    conn = cm.create_connection()
+    cursor = conn.cursor()
+
     appointment_id = tokens[1]
+    canceled = False
     try:
-        if current_caregiver is not None:
+        if session.caregiver is not None:
             # Cancel appointment for caregiver
-            query_appointment = '''
-                SELECT appointment_id, Time, PUsername, vaccine_name
-                FROM Appointments
-                WHERE CUsername = %s
-                AND appointment_id = %s
-            '''
-            cursor.execute(query_appointment, (current_caregiver.get_username(), appointment_id))
-            caregiver_appointment = cursor.fetchone()
+            caregiver_appointment = run_statement(conn, "appointment.for_caregiver",
+                                                  (session.caregiver.get_username(), appointment_id)).fetchone()
 
             if caregiver_appointment:
                 appointment_id, appointment_time, patient_username, vaccine = caregiver_appointment
+                caregiver_username = session.caregiver.get_username()
 
                 # Update vaccine count
                 print(vaccine)
-                update_vaccine = "UPDATE Vaccines SET Doses = Doses + 1 WHERE Name = %s"
-                cursor.execute(update_vaccine, (vaccine,))
+                dose_counter(ConnectionManager.get_backend()).give(cursor, vaccine)
                 # Roll back availability
-                return_availability = "INSERT INTO Availabilities (Username, Time) VALUES (%s, %s)"
-                cursor.execute(return_availability, (current_caregiver.get_username(), appointment_time))
+                run_statement(conn, "availability.insert", (appointment_time, caregiver_username))
 
                 # Delete appointment
-                delete_appointment = "DELETE FROM Appointments WHERE appointment_id = %s"
-                cursor.execute(delete_appointment, (appointment_id,))
+                run_statement(conn, "appointment.delete", (appointment_id,))
 
                 print(f"Appointment {appointment_id} canceled successfully.")
+                canceled = True
             else:
                 print("Appointment not found for this caregiver.")
 
-        elif current_patient is not None:
+        elif session.patient is not None:
             # Cancel appointment for patient
-            query_appointment = '''
-                SELECT appointment_id, Time, CUsername, vaccine_name
-                FROM Appointments
-                WHERE PUsername = %s
-                AND appointment_id = %s
-            '''
-            cursor.execute(query_appointment, (current_patient.get_username(), appointment_id))
-            patient_appointment = cursor.fetchone()
+            patient_appointment = run_statement(conn, "appointment.for_patient",
+                                                (session.patient.get_username(), appointment_id)).fetchone()
 
             if patient_appointment:
                 appointment_id, appointment_time, caregiver_username, vaccine = patient_appointment
 
 
-                update_vaccine = "UPDATE Vaccines SET Doses = Doses + 1 WHERE Name = %s"
-                cursor.execute(update_vaccine, (vaccine,))
+                dose_counter(ConnectionManager.get_backend()).give(cursor, vaccine)
 
                 # Roll back availability for the caregiver
-                return_availability = "INSERT INTO Availabilities (Username, Time) VALUES (%s, %s)"
-                cursor.execute(return_availability, (caregiver_username, appointment_time))
+                run_statement(conn, "availability.insert", (appointment_time, caregiver_username))
 
                 # Delete appointment
-                delete_appointment = "DELETE FROM Appointments WHERE appointment_id = %s"
-                cursor.execute(delete_appointment, (appointment_id,))
+                run_statement(conn, "appointment.delete", (appointment_id,))
 
                 print(f"Appointment {appointment_id} canceled successfully.")
+                canceled = True
             else:
                 print("Appointment not found for this patient.")
 
-    except pymssql.Error as e:
+    except DatabaseError as e:
         print("Please try again!")
         print("Db-Error:", e)
     except Exception as e:
@@ -462,15 +766,19 @@ def cancel(tokens):
         print("Error:", e)
     finally:
         conn.commit()
-        conn.close()
+        cm.close_connection()
+    if canceled:
+        # the dose and the slot are free again now that the cancellation is committed
+        inventory(ConnectionManager.get_backend()).apply(vaccine, 1)
+        availability_index(ConnectionManager.get_backend()).add(caregiver_username, appointment_time)
     display_command()
+    return canceled
 
 
-def add_doses(tokens):
+def add_doses(session, tokens):
     #  add_doses <vaccine> <number>
     #  check 1: check if the current logged-in user is a caregiver
-    global current_caregiver
-    if current_caregiver is None:
+    if session.caregiver is None:
         print("Please login as a caregiver first!")
         return
 
@@ -481,10 +789,10 @@ def add_doses(tokens):
 
     vaccine_name = tokens[1]
     doses = int(tokens[2])
-    vaccine = None
+    # one upsert adds to an existing entry or creates a new (vaccine, doses) entry
     try:
-        vaccine = Vaccine(vaccine_name, doses).get()
-    except pymssql.Error as e:
+        Vaccine.add_doses_bulk([(vaccine_name, doses)])
+    except DatabaseError as e:
         print("Error occurred when adding doses")
         print("Db-Error:", e)
         quit()
@@ -492,64 +800,69 @@ def add_doses(tokens):
         print("Error occurred when adding doses")
         print("Error:", e)
         return
-
-    # if the vaccine is not found in the database, add a new (vaccine, doses) entry.
-    # else, update the existing entry by adding the new doses
-    if vaccine is None:
-        vaccine = Vaccine(vaccine_name, doses)
-        try:
-            vaccine.save_to_db()
-        except pymssql.Error as e:
-            print("Error occurred when adding doses")
-            print("Db-Error:", e)
-            quit()
-        except Exception as e:
-            print("Error occurred when adding doses")
-            print("Error:", e)
-            return
-    else:
-        # if the vaccine is not null, meaning that the vaccine already exists in our table
-        try:
-            vaccine.increase_available_doses(doses)
-        except pymssql.Error as e:
-            print("Error occurred when adding doses")
-            print("Db-Error:", e)
-            quit()
-        except Exception as e:
-            print("Error occurred when adding doses")
-            print("Error:", e)
-            return
     print("Doses updated!")
     display_command()
+    return True
 
 
-def show_appointments(tokens):
-    global current_caregiver
-    global current_patient
+def read_dose_manifest(path):
+    # rows of vaccine,doses; an optional header row is skipped
+    manifest = []
+    with open(path, newline="") as f:
+        for row in csv.reader(f):
+            if not row or row[0].strip().lower() in ("vaccine", "name"):
+                continue
+            if len(row) != 2:
+                raise ValueError("Expected vaccine,doses but got: " + ",".join(row))
+            manifest.append((row[0].strip().lower(), int(row[1])))
+    return manifest
+
+
+def add_doses_manifest(session, tokens):
+    #  add_doses_manifest <csv file of vaccine,doses rows>
+    if session.caregiver is None:
+        print("Please login as a caregiver first!")
+        return
+
+    if len(tokens) != 2:
+        print("Please try again!")
+        return
+
+    try:
+        manifest = read_dose_manifest(tokens[1])
+        ingest_start = time.perf_counter()
+        vaccines = Vaccine.add_doses_bulk(manifest)
+        elapsed = time.perf_counter() - ingest_start
+    except DatabaseError as e:
+        print("Error occurred when adding doses")
+        print("Db-Error:", e)
+        quit()
+    except Exception as e:
+        print("Error occurred when adding doses")
+        print("Error:", e)
+        return
+    print(f"Doses updated! lots: {len(manifest)}, vaccines: {vaccines}, {elapsed * 1000:.1f} ms")
+    display_command()
+    return True
 
-    cm = ConnectionManager()
-    conn = cm.create_connection()
-    cursor = conn.cursor()
 
+def show_appointments(session, tokens):
     if len(tokens) != 1:
         print("Please try again!")
         return
-    
-    if current_caregiver is None and current_patient is None:
+
+    if not session.logged_in():
         print("Please login first!")
         return
 
+    cm = session.cm
+    conn = cm.create_connection()
+
     try:
-        if current_caregiver is not None:
+        if session.caregiver is not None:
             # Show appointments for caregivers
-            query_appointments = '''
-                SELECT appointment_id, vaccine_name, Time, PUsername
-                FROM Appointments
-                WHERE CUsername = %s
-                ORDER BY appointment_id
-            '''
-            cursor.execute(query_appointments, (current_caregiver.get_username(),))
-            caregiver_appointments = cursor.fetchall()
+            caregiver_appointments = run_statement(conn, "appointments.of_caregiver",
+                                                   (session.caregiver.get_username(),)).fetchall()
 
             if caregiver_appointments:
                 for appointment in caregiver_appointments:
@@ -558,16 +871,10 @@ def show_appointments(tokens):
             else:
                 print("No scheduled appointments for this caregiver.")
 
-        elif current_patient is not None:
+        elif session.patient is not None:
             # Show appointments for patients
-            query_appointments = '''
-                SELECT appointment_id, vaccine_name, Time, CUsername
-                FROM Appointments
-                WHERE PUsername = %s
-                ORDER BY appointment_id
-            '''
-            cursor.execute(query_appointments, (current_patient.get_username(),))
-            patient_appointments = cursor.fetchall()
+            patient_appointments = run_statement(conn, "appointments.of_patient",
+                                                 (session.patient.get_username(),)).fetchall()
 
             if patient_appointments:
                 for appointment in patient_appointments:
@@ -576,70 +883,277 @@ def show_appointments(tokens):
             else:
                 print("No scheduled appointments for this patient.")
 
-    except pymssql.Error as e:
+    except DatabaseError as e:
         print("Please try again!")
         print("Db-Error:", e)
     except Exception as e:
         print("Please try again!")
         print("Error:", e)
+    else:
+        return True
     finally:
-        conn.close()
+        cm.close_connection()
         display_command()
 
 
-def logout(tokens):
-    global current_caregiver
-    global current_patient
+def export(session, tokens):
+    # export <appointments | availabilities> <file> [csv | jsonl]
+    # streams the table to the file, gzipped if it ends in .gz; an interrupted export of the
+    # same table to the same file picks up where it stopped
+    if session.caregiver is None:
+        print("Please login as a caregiver first!")
+        return
+
+    if len(tokens) not in (3, 4):
+        print("Please try again!")
+        return
 
-    if current_caregiver is None and current_patient is None:
+    cm = session.cm
+    try:
+        exporter = TableExport(ConnectionManager.get_backend(), tokens[1], tokens[2],
+                               tokens[3] if len(tokens) == 4 else None)
+        export_start = time.perf_counter()
+        rows = exporter.run(cm.create_connection())
+        elapsed = time.perf_counter() - export_start
+    except DatabaseError as e:
+        print("Export failed, run it again to resume.")
+        print("Db-Error:", e)
+        quit()
+    except Exception as e:
+        print("Export failed")
+        print("Error:", e)
+        return
+    finally:
+        cm.close_connection()
+    resumed = " (resumed)" if exporter.resumed else ""
+    print(f"Exported {rows} {tokens[1]} to {tokens[2]}{resumed}, {elapsed:.1f} s")
+    display_command()
+    return True
+
+
+def logout(session, tokens):
+    if not session.logged_in():
         print("Please login first!")
         return
     
     if len(tokens) != 1:
         print('Please try again!')
 
-    current_caregiver = None
-    current_patient = None
+    # logging out ends the session for good, its token no longer logs anyone in
+    if session.token is not None:
+        session_tokens.revoke(session.token)
+    session.clear()
     print('Successfully logged out!')
     display_command()
+    return True
+
+
+def dump_metrics(session, tokens):
+    # metrics [json | prometheus]: everything recorded since startup, with the pool's gauges
+    # and how often each registered statement ran
+    if len(tokens) > 2 or (len(tokens) == 2 and tokens[1] not in ("json", "prometheus")):
+        print("Please try again!")
+        return False
+    gauges = {"pool": ConnectionManager.get_pool().stats()}
+    statements = statement_counters()
+    if len(tokens) == 2 and tokens[1] == "prometheus":
+        print(metrics.prometheus(gauges, {"statement_executions": {name: c["executions"] for name, c in statements.items()},
+                                          "statement_errors": {name: c["errors"] for name, c in statements.items()}}),
+              end="")
+    else:
+        gauges["statements"] = statements
+        print(json.dumps(metrics.snapshot(gauges), indent=2))
+    return True
+
+
+def top_statements(session, tokens):
+    # top_statements [<n>]: the statements with the most total time since startup
+    if len(tokens) > 2:
+        print("Please try again!")
+        return False
+    if not trace.enabled:
+        print("Statement tracing is off, set SlowQueryMs to turn it on.")
+        return False
+    try:
+        n = int(tokens[1]) if len(tokens) == 2 else None
+    except ValueError:
+        print("Please try again!")
+        return False
+    top = trace.top(n)
+    if not top:
+        print("No statements recorded yet.")
+    for entry in top:
+        print("{total_ms:>10.1f} ms {calls:>7} calls {mean_ms:>8.3f} ms avg {max_ms:>8.3f} ms max "
+              "{rows:>8} rows {slow:>5} slow  {statement}".format(**entry))
+    return True
 
 
 def display_command():
-    time.sleep(1)
+    if not interactive:
+        return
+    with metrics.phase("pause"):
+        time.sleep(1)
     print()
     print(" *** Please enter one of the following commands *** ")
     print("> create_patient <username> <password>")  # //TODO: implement create_patient (Part 1)
     print("> create_caregiver <username> <password>")
+    print("> import_patients <csv file>")
+    print("> import_caregivers <csv file>")
     print("> login_patient <username> <password>")  # // TODO: implement login_patient (Part 1)
     print("> login_caregiver <username> <password>")
-    print("> search_caregiver_schedule <date>")  # // TODO: implement search_caregiver_schedule (Part 2)
+    print("> login_token <session token>")
+    print("> search_caregiver_schedule <date> [<end date>]")  # // TODO: implement search_caregiver_schedule (Part 2)
+    print("> search_next <continuation token>")
+    print("> next_available <date> <vaccine>")
+    print("> capacity <start date> <end date>")
+    print("> report <start date> <end date>")
     print("> reserve <date> <vaccine>")  # // TODO: implement reserve (Part 2)
     print("> upload_availability <date>")
+    print("> upload_availability_bulk <start date> <end date> [<weekdays>] | <csv file>")
     print("> cancel <appointment_id>")  # // TODO: implement cancel (extra credit)
     print("> add_doses <vaccine> <number>")
+    print("> add_doses_manifest <csv file>")
     print("> show_appointments")  # // TODO: implement show_appointments (Part 2)
+    print("> export <appointments | availabilities> <file> [csv | jsonl]")
     print("> logout")  # // TODO: implement logout (Part 2)
+    print("> metrics [json | prometheus]")
+    print("> top_statements [<n>]")
     print("> Quit")
     print()
 
 
+COMMANDS = {
+    "create_patient": create_patient,
+    "create_caregiver": create_caregiver,
+    "import_patients": import_patients,
+    "import_caregivers": import_caregivers,
+    "login_patient": login_patient,
+    "login_caregiver": login_caregiver,
+    "login_token": login_token,
+    "search_caregiver_schedule": search_caregiver_schedule,
+    "search_next": search_next,
+    "next_available": next_available,
+    "capacity": capacity,
+    "report": report,
+    "reserve": reserve,
+    "upload_availability": upload_availability,
+    "upload_availability_bulk": upload_availability_bulk,
+    "cancel": cancel,
+    "add_doses": add_doses,
+    "add_doses_manifest": add_doses_manifest,
+    "show_appointments": show_appointments,
+    "export": export,
+    "logout": logout,
+    "metrics": dump_metrics,
+    "top_statements": top_statements,
+}
+
+# which token of these commands is a file path, a path keeps its case
+PATH_ARGUMENTS = {
+    "upload_availability_bulk": 1,
+    "add_doses_manifest": 1,
+    "import_patients": 1,
+    "import_caregivers": 1,
+    "export": 2,
+}
+
+
+def split_command(line):
+    # the tokens of a command line, lowercased like the rest of the input except for a path
+    tokens = line.split(" ")
+    lowered = [token.lower() for token in tokens]
+    path = PATH_ARGUMENTS.get(lowered[0])
+    if path is not None and path < len(tokens):
+        lowered[path] = tokens[path]
+    return lowered
+
+
+def run_command(session, tokens):
+    # Runs one command for `session` with its printed output captured instead of shown, and
+    # returns (status, output) with status "ok", "failed" or "error". Errors never escape, not
+    # even the quit() that commands call on database errors. Output is captured per thread,
+    # so commands for different sessions can run concurrently.
+    operation = tokens[0] if tokens[0] in COMMANDS else "invalid"
+    with capture_output() as captured, metrics.command(operation) as timer:
+        try:
+            if tokens[0] in COMMANDS:
+                ok = COMMANDS[tokens[0]](session, tokens)
+            else:
+                print("Invalid operation name!")
+                ok = False
+            status = "ok" if ok else "failed"
+        except SystemExit:
+            status = "error"
+        except Exception as e:
+            print("Error: " + str(e))
+            status = "error"
+        timer.status = status
+    return status, captured.getvalue().strip()
+
+
+def run_batch(lines, out=sys.stdout):
+    # Runs one command per line without the menu or the pause between commands, and writes
+    # one JSON object per command (line, command, status, elapsed_ms, output) to `out`.
+    # Blank lines and lines starting with # are skipped, `quit` stops early. Failures are
+    # reported and the batch carries on; a JSON summary is written last and returned.
+    global interactive
+    interactive = False
+    session = Session()
+    summary = {"commands": 0, "ok": 0, "failed": 0, "errors": 0}
+    batch_start = time.perf_counter()
+    for line_number, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        tokens = split_command(line)
+        operation = tokens[0]
+        if operation == "quit":
+            break
+
+        command_start = time.perf_counter()
+        status, output = run_command(session, tokens)
+        elapsed_ms = (time.perf_counter() - command_start) * 1000
+
+        summary["commands"] += 1
+        summary[status if status != "error" else "errors"] += 1
+        record = {"line": line_number, "command": operation, "status": status,
+                  "elapsed_ms": round(elapsed_ms, 3), "output": output}
+        out.write(json.dumps(record) + "\n")
+
+    summary["elapsed_s"] = round(time.perf_counter() - batch_start, 3)
+    out.write(json.dumps({"summary": summary}) + "\n")
+    out.flush()
+    return summary
+
+
 def start():
-    global current_caregiver
-    global current_patient
+    session = Session()
     stop = False
     print()
     print(" *** Please enter one of the following commands *** ")
     print("> create_patient <username> <password>")  # //TODO: implement create_patient (Part 1)
     print("> create_caregiver <username> <password>")
+    print("> import_patients <csv file>")
+    print("> import_caregivers <csv file>")
     print("> login_patient <username> <password>")  # // TODO: implement login_patient (Part 1)
     print("> login_caregiver <username> <password>")
-    print("> search_caregiver_schedule <date>")  # // TODO: implement search_caregiver_schedule (Part 2)
+    print("> login_token <session token>")
+    print("> search_caregiver_schedule <date> [<end date>]")  # // TODO: implement search_caregiver_schedule (Part 2)
+    print("> search_next <continuation token>")
+    print("> next_available <date> <vaccine>")
+    print("> capacity <start date> <end date>")
+    print("> report <start date> <end date>")
     print("> reserve <date> <vaccine>")  # // TODO: implement reserve (Part 2)
     print("> upload_availability <date>")
+    print("> upload_availability_bulk <start date> <end date> [<weekdays>] | <csv file>")
     print("> cancel <appointment_id>")  # // TODO: implement cancel (extra credit)
     print("> add_doses <vaccine> <number>")
+    print("> add_doses_manifest <csv file>")
     print("> show_appointments")  # // TODO: implement show_appointments (Part 2)
+    print("> export <appointments | availabilities> <file> [csv | jsonl]")
     print("> logout")  # // TODO: implement logout (Part 2)
+    print("> metrics [json | prometheus]")
+    print("> top_statements [<n>]")
     print("> Quit")
     print()
     while not stop:
@@ -652,37 +1166,16 @@ def start():
             print("Please try again!")
             break
 
-        response = response.lower()
-        tokens = response.split(" ")
+        tokens = split_command(response)
         if len(tokens) == 0:
             ValueError("Please try again!")
             continue
         operation = tokens[0]
-        if operation == "create_patient":
-            create_patient(tokens)
-        elif operation == "create_caregiver":
-            create_caregiver(tokens)
-        elif operation == "login_patient":
-            login_patient(tokens)
-        elif operation == "login_caregiver":
-            login_caregiver(tokens)
-        elif operation == "search_caregiver_schedule":
-            search_caregiver_schedule(tokens)
-        elif operation == "reserve":
-            reserve(tokens)
-        elif operation == "upload_availability":
-            upload_availability(tokens)
-        elif operation == 'cancel':
-            cancel(tokens)
-        elif operation == "add_doses":
-            add_doses(tokens)
-        elif operation == "show_appointments":
-            show_appointments(tokens)
-        elif operation == "logout":
-            logout(tokens)
+        if operation in COMMANDS:
+            with metrics.command(operation) as timer:
+                timer.status = "ok" if COMMANDS[operation](session, tokens) else "failed"
         elif operation == "quit":
-            current_patient = None
-            current_caregiver = None
+            session.clear()
             print("Bye!")
             stop = True
         else:
@@ -697,6 +1190,34 @@ if __name__ == "__main__":
     // and then construct a map of vaccineName -> vaccineObject
     '''
 
+    parser = argparse.ArgumentParser(description="COVID-19 Vaccine Reservation Scheduling Application")
+    parser.add_argument("--batch", metavar="FILE",
+                        help="run the commands in FILE ('-' for stdin) and report each one as a JSON line")
+    parser.add_argument("--migrate", action="store_true", help="apply pending schema migrations and exit")
+    args = parser.parse_args()
+
+    if args.migrate:
+        cm = ConnectionManager()
+        conn = cm.create_connection()
+        try:
+            applied = MigrationRunner(ConnectionManager.get_backend()).migrate(conn)
+        finally:
+            cm.close_connection()
+        for name in applied:
+            print("Applied migration " + name)
+        print("Schema is up to date.")
+        sys.exit(0)
+
+    if os.getenv("AvailabilityJournal"):
+        # replay availability a previous run journaled but did not get to commit
+        availability_journal(ConnectionManager.get_backend())
+
+    if args.batch is not None:
+        # read stdin through a separate file object: quit() closes sys.stdin itself
+        with open(sys.stdin.fileno() if args.batch == "-" else args.batch, closefd=args.batch != "-") as commands:
+            summary = run_batch(commands)
+        sys.exit(0 if summary["ok"] == summary["commands"] else 1)
+
     # start command line
     print()
     print("Welcome to the COVID-19 Vaccine Reservation Scheduling Application!")
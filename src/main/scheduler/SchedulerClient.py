@@ -0,0 +1,120 @@
+import json
+import os
+import socket
+import sys
+
+'''
+Thin client for the scheduler daemon (Server.py --unix): runs one command in the warm daemon
+and prints its output, so a scripted call costs an interpreter start and a socket round trip
+instead of loading the scheduler, connecting to the database and hashing a password.
+
+    python Server.py --unix &
+    python SchedulerClient.py login_patient alice secret
+    python SchedulerClient.py reserve 05-01-2027 pfizer
+
+The daemon keeps a session per connection only, so the session token from a login is saved
+(SchedulerTokenFile, ~/.scheduler_session by default) and sent with login_token ahead of each
+later command; logout removes it. The exit status is 0 if the command succeeded, 1 if it
+failed and 2 on an error or when the daemon cannot be reached. Keep this module free of
+scheduler imports, its start-up time is the point.
+'''
+
+LOGINS = ("login_patient", "login_caregiver", "login_token")
+
+
+def default_socket():
+    # SchedulerSocket, or a socket per user in /tmp
+    return os.getenv("SchedulerSocket", "/tmp/scheduler-%d.sock" % os.getuid())
+
+
+def token_file():
+    return os.getenv("SchedulerTokenFile", os.path.expanduser("~/.scheduler_session"))
+
+
+def read_token():
+    try:
+        with open(token_file()) as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def save_token(token):
+    path = token_file()
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "w") as f:
+        f.write(token + "\n")
+
+
+def forget_token():
+    try:
+        os.remove(token_file())
+    except FileNotFoundError:
+        pass
+
+
+class ConnectionClosed(Exception):
+    pass
+
+
+def read_response(stream):
+    line = stream.readline()
+    if not line:
+        raise ConnectionClosed()
+    return json.loads(line)
+
+
+def call(path, line):
+    # the daemon's response to `line`, after logging in with the saved token when there is one
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(path)
+        stream = sock.makefile("rwb")
+        command = line.split(" ")[0].lower()
+        token = read_token() if command not in LOGINS else None
+        if token is not None:
+            stream.write(("login_token " + token + "\n").encode("utf-8"))
+        stream.write((line + "\nquit\n").encode("utf-8"))
+        stream.flush()
+        if token is not None and read_response(stream)["status"] != "ok":
+            # expired, revoked or issued by a daemon that has since restarted
+            forget_token()
+        return read_response(stream)
+
+
+def main(argv):
+    if not argv:
+        print("usage: SchedulerClient.py <command> [<argument> ...]", file=sys.stderr)
+        return 2
+    if argv[0].lower() == "quit":
+        # every call is a connection of its own, there is no session to quit
+        print("quit is not a command here, each call ends on its own", file=sys.stderr)
+        return 2
+    path = default_socket()
+    try:
+        response = call(path, " ".join(argv))
+    except (FileNotFoundError, ConnectionRefusedError):
+        print("The scheduler daemon is not running, start it with: python Server.py --unix " + path,
+              file=sys.stderr)
+        return 2
+    except (ConnectionClosed, ConnectionResetError):
+        print("The scheduler daemon closed the connection without answering", file=sys.stderr)
+        return 2
+    if response["output"]:
+        print(response["output"])
+
+    command = response["command"]
+    if response["status"] == "ok":
+        if command == "login_token":
+            save_token(argv[1])
+        elif command in LOGINS:
+            for output_line in response["output"].splitlines():
+                if output_line.startswith("Session token: "):
+                    save_token(output_line[len("Session token: "):])
+        elif command == "logout":
+            forget_token()
+        return 0
+    return 1 if response["status"] == "failed" else 2
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
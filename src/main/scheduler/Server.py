@@ -0,0 +1,155 @@
+import argparse
+import asyncio
+import json
+import os
+import socket
+import time
+from concurrent.futures import ThreadPoolExecutor
+import Scheduler
+from db.AvailabilityJournal import availability_journal
+from db.ConnectionManager import ConnectionManager
+from SchedulerClient import default_socket
+from util.Session import Session
+
+'''
+Serves the scheduler commands to many clients at once over TCP with a line protocol:
+each request is one command line, exactly as typed at the CLI prompt, and each response is
+one JSON line {"command", "status", "elapsed_ms", "output"}. Status is "ok", "failed" or
+"error" as in batch mode, "busy" when the server is saturated and "timeout" when a command
+runs past the per-request limit. `quit` closes the connection.
+
+    python Server.py --host 127.0.0.1 --port 8765
+
+With --unix it listens on a Unix socket instead, as a warm daemon for SchedulerClient.py,
+which sends it one command per invocation:
+
+    python Server.py --unix &
+    python SchedulerClient.py reserve 05-01-2027 pfizer
+'''
+
+
+def socket_in_use(path):
+    # whether a live process accepts connections on the Unix socket at `path`
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        try:
+            sock.connect(path)
+        except ConnectionRefusedError:
+            return False
+    return True
+
+
+class SchedulerServer:
+    # Commands block on the database and on password hashing, so they run on a thread pool
+    # while the event loop keeps serving connections. At most `max_pending` commands are
+    # queued or running; a request that cannot get a slot within `timeout` seconds is answered
+    # "busy", and one that does not finish within `timeout` seconds is answered "timeout".
+    def __init__(self, workers=8, max_pending=256, timeout=10.0):
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self.pending = None
+        self.clients = 0
+        self.served = 0
+
+    async def dispatch(self, session, tokens):
+        loop = asyncio.get_running_loop()
+        start = time.perf_counter()
+        try:
+            await asyncio.wait_for(self.pending.acquire(), self.timeout)
+        except asyncio.TimeoutError:
+            return "busy", "Server busy, try again!", start, None
+
+        # each connection has its own Session, so its commands run alongside everyone else's
+        future = loop.run_in_executor(self.executor, Scheduler.run_command, session, tokens)
+        # the slot is only free once the command has really finished, even after a timeout
+        future.add_done_callback(lambda _: self.pending.release())
+        try:
+            status, output = await asyncio.wait_for(asyncio.shield(future), self.timeout)
+        except asyncio.TimeoutError:
+            return "timeout", "Request timed out!", start, future
+        return status, output, start, future
+
+    async def handle_client(self, reader, writer):
+        session = Session()
+        self.clients += 1
+        running = None
+        try:
+            while True:
+                try:
+                    line = await reader.readline()
+                except ValueError:
+                    # longer than the stream's 64 KiB limit; where the next line starts is lost
+                    response = {"command": None, "status": "error", "elapsed_ms": 0.0, "output": "Request too long!"}
+                    writer.write((json.dumps(response) + "\n").encode("utf-8"))
+                    await writer.drain()
+                    break
+                if not line:
+                    break
+                line = line.decode("utf-8", "replace").strip()
+                if not line:
+                    continue
+                tokens = Scheduler.split_command(line)
+                if tokens[0] == "quit":
+                    break
+
+                if running is not None and not running.done():
+                    # a command that timed out still holds the session, the next one waits for it
+                    await asyncio.wait([running])
+                status, output, start, running = await self.dispatch(session, tokens)
+                self.served += 1
+                response = {"command": tokens[0], "status": status,
+                            "elapsed_ms": round((time.perf_counter() - start) * 1000, 3), "output": output}
+                writer.write((json.dumps(response) + "\n").encode("utf-8"))
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self.clients -= 1
+            writer.close()
+
+    async def start(self, host, port, path=None):
+        Scheduler.interactive = False
+        if os.getenv("AvailabilityJournal"):
+            # replay availability a previous run journaled but did not get to commit
+            availability_journal(ConnectionManager.get_backend())
+        self.pending = asyncio.Semaphore(self.max_pending)
+        if path is not None:
+            if os.path.exists(path):
+                if socket_in_use(path):
+                    raise RuntimeError("A scheduler daemon is already listening on " + path)
+                # left behind by a daemon that did not shut down cleanly
+                os.remove(path)
+            # only this user may talk to the daemon, it runs commands for whoever connects;
+            # the socket is created with those permissions rather than changed to them after
+            umask = os.umask(0o177)
+            try:
+                return await asyncio.start_unix_server(self.handle_client, path, backlog=1024)
+            finally:
+                os.umask(umask)
+        return await asyncio.start_server(self.handle_client, host, port, backlog=1024)
+
+    async def serve_forever(self, host, port, path=None):
+        server = await self.start(host, port, path)
+        print("Serving on " + ", ".join(str(sock.getsockname()) for sock in server.sockets))
+        async with server:
+            await server.serve_forever()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve the scheduler commands over TCP or a Unix socket")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--unix", metavar="PATH", nargs="?", const=default_socket(),
+                        help="listen on a Unix socket instead of TCP, by default the one SchedulerClient.py uses")
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--max-pending", type=int, default=256)
+    parser.add_argument("--timeout", type=float, default=10.0, help="seconds per request")
+    args = parser.parse_args()
+
+    try:
+        asyncio.run(SchedulerServer(args.workers, args.max_pending, args.timeout).serve_forever(
+            args.host, args.port, args.unix))
+    except KeyboardInterrupt:
+        pass
+    except RuntimeError as e:
+        raise SystemExit(str(e))
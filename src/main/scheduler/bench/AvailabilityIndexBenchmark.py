@@ -0,0 +1,80 @@
+# "Earliest open date" and "capacity over a range" from the in-process availability index
+# versus asking the database, on a sparse calendar:
+#   cd src/main/scheduler && python -m bench.AvailabilityIndexBenchmark --caregivers 500 --days 365
+import argparse
+import datetime
+import random
+import time
+from bench import Fixtures
+from bench.Fixtures import START, names
+from db.AvailabilityIndex import availability_index
+from db.ConnectionManager import ConnectionManager
+from db.SqliteBackend import SqliteBackend
+
+
+def seed(conn, caregivers, days, density):
+    caregivers = names("idx_cg", caregivers)
+    rows = Fixtures.slots(caregivers, days, START, density)
+    Fixtures.seed(conn, caregivers=caregivers, availabilities=rows)
+    return len(rows)
+
+
+def timed(fn, queries):
+    start = time.perf_counter()
+    for _ in range(queries):
+        fn()
+    return (time.perf_counter() - start) / queries
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--caregivers", type=int, default=500)
+    parser.add_argument("--days", type=int, default=365)
+    parser.add_argument("--density", type=float, default=0.0003, help="chance a caregiver is free on a day")
+    parser.add_argument("--queries", type=int, default=200)
+    args = parser.parse_args()
+
+    backend = SqliteBackend()
+    ConnectionManager.set_backend(backend)
+    cm = ConnectionManager()
+    conn = cm.create_connection()
+    slots = seed(conn, args.caregivers, args.days, args.density)
+    cursor = conn.cursor()
+    index = availability_index(backend)
+    end = START + datetime.timedelta(days=args.days - 1)
+
+    def probe_dates():
+        # what a patient does today: search_caregiver_schedule one date at a time
+        d = START
+        while d <= end:
+            cursor.execute("SELECT Username FROM Availabilities WHERE Time = %s ORDER BY Username", (d,))
+            if cursor.fetchall():
+                return d
+            d += datetime.timedelta(days=1)
+
+    def earliest_sql():
+        cursor.execute("SELECT min(Time) FROM Availabilities WHERE Time >= %s", (START,))
+        return cursor.fetchone()[0]
+
+    def capacity_sql():
+        cursor.execute("SELECT Time, count(*) FROM Availabilities WHERE Time BETWEEN %s AND %s GROUP BY Time",
+                       (START, end))
+        return cursor.fetchall()
+
+    assert index.next_available(START, conn)[0] == probe_dates()
+    results = [
+        ("next date, probing date by date", timed(probe_dates, args.queries)),
+        ("next date, one SQL query", timed(earliest_sql, args.queries)),
+        ("next date, index", timed(lambda: index.next_available(START), args.queries)),
+        ("capacity, SQL GROUP BY", timed(capacity_sql, args.queries)),
+        ("capacity, index", timed(lambda: index.capacity(START, end), args.queries)),
+    ]
+    cm.close_connection()
+    print(f"{args.caregivers} caregivers, {args.days} days, {slots} open slots")
+    for label, seconds in results:
+        print(f"{label:>32}: {seconds * 1e6:10.1f} us")
+    print(index.stats())
+
+
+if __name__ == "__main__":
+    main()
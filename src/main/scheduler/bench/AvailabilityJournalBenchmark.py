@@ -0,0 +1,157 @@
+# Availability uploads per second with a commit per upload against write-behind through the
+# availability journal, from --threads caregivers uploading --uploads dates between them,
+# then how long the journal takes to drain and how many commits it took. Then three checks:
+# a lone upload is committed within about JournalFlushMs without anything else prompting a
+# flush, uploads journaled while the database is unreachable are committed once it is back,
+# and rows journaled by a journal that never flushes are committed by the next one opened on
+# the same path. Runs on embedded SQLite files:
+#   cd src/main/scheduler && python -m bench.AvailabilityJournalBenchmark --uploads 4000 --threads 4
+import argparse
+import datetime
+import os
+import tempfile
+import threading
+import time
+from bench import Fixtures
+from bench.Fixtures import START, check, names
+from db.AvailabilityJournal import AvailabilityJournal, availability_journal
+from db.Backend import DatabaseError
+from db.ConnectionManager import ConnectionManager
+from db.ConnectionPool import ConnectionPool
+from db.SqliteBackend import SqliteBackend
+from model.Caregiver import Caregiver
+
+def seed(backend, caregivers):
+    Fixtures.seed(backend, caregivers=names("bench_cg", caregivers))
+
+
+def count_rows(backend):
+    return Fixtures.count(backend, "Availabilities")
+
+
+def upload(threads, uploads):
+    # each caregiver thread uploads its share of consecutive dates; returns the elapsed seconds
+    def worker(i):
+        caregiver = Caregiver("bench_cg%d" % i)
+        for n in range(i, uploads, threads):
+            caregiver.upload_availability(START + datetime.timedelta(days=n // threads))
+
+    workers = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    start = time.perf_counter()
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    return time.perf_counter() - start
+
+
+def run(directory, mode, threads, uploads):
+    backend = SqliteBackend(os.path.join(directory, mode + ".db"))
+    seed(backend, threads)
+    ConnectionManager.set_backend(backend)
+    if mode == "write-behind":
+        os.environ["AvailabilityJournal"] = os.path.join(directory, "availability.journal")
+    else:
+        os.environ.pop("AvailabilityJournal", None)
+
+    elapsed = upload(threads, uploads)
+    journal = availability_journal(backend)
+    drain = 0.0
+    commits = uploads
+    if journal is not None:
+        start = time.perf_counter()
+        journal.flush()
+        drain = time.perf_counter() - start
+        commits = journal.stats()["flushes"]
+        journal.close()
+    committed = count_rows(backend)
+    check(committed == uploads, "{}: {} of {} uploads committed".format(mode, committed, uploads))
+    return uploads / elapsed, drain, commits
+
+
+def wait_for_rows(backend, rows, timeout):
+    # seconds until the table holds `rows` rows, None if it did not within `timeout`
+    start = time.perf_counter()
+    while count_rows(backend) < rows:
+        if time.perf_counter() - start > timeout:
+            return None
+        time.sleep(0.001)
+    return time.perf_counter() - start
+
+
+def single_upload_check(directory):
+    backend = SqliteBackend(os.path.join(directory, "single.db"))
+    seed(backend, 1)
+    ConnectionManager.set_backend(backend)
+    journal = AvailabilityJournal(backend, os.path.join(directory, "single.journal"))
+    journal.append([(START, "bench_cg0")])
+    committed = wait_for_rows(backend, 1, 2.0)
+    journal.close()
+    return journal.flush_ms, committed
+
+
+def unreachable(*args):
+    raise DatabaseError("unable to open database file")
+
+
+def outage_check(directory, rows):
+    backend = SqliteBackend(os.path.join(directory, "outage.db"))
+    seed(backend, 1)
+    ConnectionManager.set_backend(backend)
+    journal = AvailabilityJournal(backend, os.path.join(directory, "outage.journal"))
+    ConnectionManager.set_pool(ConnectionPool(unreachable))
+    journal.append([(START + datetime.timedelta(days=n), "bench_cg0") for n in range(rows)])
+    time.sleep(0.5)
+    failures, alive = journal.stats()["failures"], journal.flusher.is_alive()
+    # the database comes back
+    ConnectionManager.set_pool(None)
+    committed = wait_for_rows(backend, rows, 10.0)
+    journal.close()
+    return failures, alive, committed
+
+
+def crash_check(directory, rows):
+    backend = SqliteBackend(os.path.join(directory, "crash.db"))
+    seed(backend, 1)
+    ConnectionManager.set_backend(backend)
+    path = os.path.join(directory, "crash.journal")
+    # a flusher that never gets round to it stands in for a process killed before the flush
+    lost = AvailabilityJournal(backend, path, flush_ms=3600 * 1000, flush_rows=rows + 1)
+    lost.append([(START + datetime.timedelta(days=n), "bench_cg0") for n in range(rows)])
+    before = count_rows(backend)
+    recovered = AvailabilityJournal(backend, path)
+    after = count_rows(backend)
+    recovered.close()
+    return before, recovered.replayed, after
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark write-behind availability uploads")
+    parser.add_argument("--uploads", type=int, default=4000)
+    parser.add_argument("--threads", type=int, default=4)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        results = {mode: run(directory, mode, args.threads, args.uploads) for mode in ("per-row", "write-behind")}
+        flush_ms, single = single_upload_check(directory)
+        failures, alive, recovered = outage_check(directory, 100)
+        before, replayed, after = crash_check(directory, 1000)
+    ConnectionManager.set_backend(None)
+
+    print(f"{'mode':14} {'acks/s':>10} {'drain ms':>10} {'commits':>8}")
+    for mode, (rate, drain, commits) in results.items():
+        print(f"{mode:14} {rate:10.0f} {drain * 1000:10.1f} {commits:8}")
+    print(f"write-behind acknowledges {results['write-behind'][0] / results['per-row'][0]:.1f}x faster")
+    print("single upload: " + (f"committed after {single * 1000:.1f} ms" if single is not None else "not committed")
+          + f" (JournalFlushMs {flush_ms:.0f})")
+    print(f"outage check: {failures} failed flushes, flusher alive: {alive}, "
+          + (f"committed {recovered * 1000:.0f} ms after the database came back" if recovered is not None
+             else "not committed after the database came back"))
+    print(f"crash check: {before} rows committed before recovery, {replayed} replayed, {after} after")
+    check(single is not None, "a lone upload was never committed")
+    check(alive and recovered is not None, "uploads journaled during the outage were not committed")
+    check(after == replayed == 1000, "journaled rows were lost")
+
+
+if __name__ == "__main__":
+    main()
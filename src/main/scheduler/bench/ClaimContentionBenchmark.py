@@ -0,0 +1,95 @@
+# Concurrent reservers all booking the same popular date, for each claim strategy and a range
+# of thread counts. Reports bookings/s, how often a claimer lost its candidate slot to another
+# one, and checks that no slot was handed out twice:
+#   cd src/main/scheduler && python -m bench.ClaimContentionBenchmark --caregivers 400 --threads 1,4,16
+# Pass --env to run against the backend configured by DBBackend (e.g. SQL Server, where the
+# strategies decide how many locked rows READPAST has to skip).
+import argparse
+import datetime
+import os
+import tempfile
+import threading
+import time
+from bench import Fixtures
+from bench.Fixtures import check, names
+from db.ConnectionManager import ConnectionManager
+from db.ConnectionPool import ConnectionPool
+from db.ReservationEngine import ReservationEngine, RESERVED, STRATEGIES
+from db.SqliteBackend import SqliteBackend
+
+DAY = datetime.datetime(2027, 6, 1)
+
+
+def seed(backend, caregivers, patients):
+    caregivers = names("claim_cg", caregivers, width=4)
+    Fixtures.seed(backend, caregivers=caregivers, patients=names("claim_p", patients),
+                  availabilities=Fixtures.slots(caregivers, 1, DAY), vaccines={"pfizer": patients}, clear=True)
+
+
+def run(backend, strategy, threads, patients):
+    ConnectionManager.set_pool(ConnectionPool(backend.open, max_size=threads))
+    engine = ReservationEngine(backend, strategy)
+    # the cache would otherwise still hold the doses of the previous round
+    engine.inventory.invalidate()
+    engine.availability.invalidate()
+    booked = []
+    lock = threading.Lock()
+    next_patient = iter(range(patients))
+
+    def worker():
+        while True:
+            with lock:
+                patient = next(next_patient, None)
+            if patient is None:
+                return
+            cm = ConnectionManager()
+            conn = cm.create_connection()
+            try:
+                status, _, caregiver = engine.reserve(conn, DAY, "pfizer", "claim_p%d" % patient)
+            finally:
+                cm.close_connection()
+            if status == RESERVED:
+                with lock:
+                    booked.append(caregiver)
+
+    pool = [threading.Thread(target=worker) for _ in range(threads)]
+    start = time.perf_counter()
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+    elapsed = time.perf_counter() - start
+    return len(booked), len(set(booked)), engine.conflicts, patients / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--caregivers", type=int, default=400)
+    parser.add_argument("--patients", type=int, default=None, help="reservers per round, defaults to --caregivers")
+    parser.add_argument("--threads", default="1,4,16")
+    parser.add_argument("--strategies", default=",".join(STRATEGIES))
+    parser.add_argument("--env", action="store_true", help="use the backend configured by DBBackend")
+    args = parser.parse_args()
+    patients = args.patients or args.caregivers
+
+    with tempfile.TemporaryDirectory() as tmp:
+        if args.env:
+            ConnectionManager.set_backend(None)
+            backend = ConnectionManager.get_backend()
+        else:
+            backend = SqliteBackend(os.path.join(tmp, "claims.db"))
+            ConnectionManager.set_backend(backend)
+        print(f"{args.caregivers} caregivers free on one date, {patients} reservers per round, {backend.name}")
+        for strategy in args.strategies.split(","):
+            for threads in (int(t) for t in args.threads.split(",")):
+                seed(backend, args.caregivers, patients)
+                booked, distinct, conflicts, rate = run(backend, strategy, threads, patients)
+                print(f"{strategy:>12} threads={threads:<3} booked={booked} distinct={distinct} "
+                      f"conflicts={conflicts} {rate:.0f} reservations/s")
+                check(booked == distinct, "{} slots handed out twice".format(booked - distinct))
+                check(booked == min(args.caregivers, patients), "free slots left unbooked")
+        ConnectionManager.set_backend(None)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+# Bookings per second for one vaccine with its stock on a single Vaccines row against spread
+# over DoseShards rows with the rebalancer running, and a check that no dose was lost or made
+# up along the way:
+#   cd src/main/scheduler && python -m bench.DoseShardBenchmark --threads 16 --shards 8
+# SQLite takes one writer at a time whatever rows it touches, so locally this mostly shows
+# what sharding costs; pass --env to measure against SQL Server, where the hot row is the
+# bottleneck the shards remove.
+import argparse
+import datetime
+import os
+import tempfile
+import threading
+import time
+from bench import Fixtures
+from bench.Fixtures import check, names
+from db.ConnectionManager import ConnectionManager
+from db.ConnectionPool import ConnectionPool
+from db.DoseCounter import dose_counter
+from db.ReservationEngine import ReservationEngine, RESERVED
+from db.SqliteBackend import SqliteBackend
+from db.Statements import TOTALS
+
+DAY = datetime.datetime(2027, 7, 1)
+
+
+def seed(backend, caregivers, bookings, doses):
+    caregivers = names("shard_cg", caregivers)
+    days = (bookings + len(caregivers) - 1) // len(caregivers)
+    Fixtures.seed(backend, caregivers=caregivers, patients=names("shard_p", bookings),
+                  availabilities=Fixtures.slots(caregivers, days, DAY), vaccines={"pfizer": doses}, clear=True)
+    return days
+
+
+def total_doses(backend):
+    conn = backend.open()
+    cursor = conn.cursor()
+    cursor.execute(TOTALS + " WHERE v.Name = %s", ("pfizer",))
+    total = cursor.fetchone()[1]
+    cursor.execute("SELECT COUNT(*) FROM Appointments")
+    booked = cursor.fetchone()[0]
+    conn.close()
+    return total, booked
+
+
+def run(backend, threads, bookings, days):
+    ConnectionManager.set_pool(ConnectionPool(backend.open, max_size=threads + 1))
+    counter = dose_counter(backend)
+    if counter.shards:
+        # spread the stock before the clock starts, the background rebalancer keeps it even
+        cm = ConnectionManager()
+        counter.rebalance(cm.create_connection())
+        cm.close_connection()
+    engine = ReservationEngine(backend, "random")
+    lock = threading.Lock()
+    next_patient = iter(range(bookings))
+    booked = []
+
+    def worker():
+        while True:
+            with lock:
+                patient = next(next_patient, None)
+            if patient is None:
+                return
+            cm = ConnectionManager()
+            conn = cm.create_connection()
+            try:
+                d = DAY + datetime.timedelta(days=patient % days)
+                status, _, _ = engine.reserve(conn, d, "pfizer", "shard_p%d" % patient)
+            finally:
+                cm.close_connection()
+            if status == RESERVED:
+                with lock:
+                    booked.append(patient)
+
+    pool = [threading.Thread(target=worker) for _ in range(threads)]
+    start = time.perf_counter()
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+    elapsed = time.perf_counter() - start
+    if counter.rebalancer is not None:
+        counter.rebalancer.stop()
+    return len(booked), bookings / elapsed, counter
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--shards", type=int, default=8)
+    parser.add_argument("--caregivers", type=int, default=50)
+    parser.add_argument("--bookings", type=int, default=2000)
+    parser.add_argument("--doses", type=int, default=None, help="starting stock, defaults to --bookings")
+    parser.add_argument("--rebalance-interval", type=float, default=0.05)
+    parser.add_argument("--env", action="store_true", help="use the backend configured by DBBackend")
+    args = parser.parse_args()
+    doses = args.doses if args.doses is not None else args.bookings
+    os.environ["RebalanceInterval"] = str(args.rebalance_interval)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for shards in (0, args.shards):
+            # the counter is made once per backend, with DoseShards as it is at that moment
+            os.environ["DoseShards"] = str(shards)
+            if args.env:
+                ConnectionManager.set_backend(None)
+                backend = ConnectionManager.get_backend()
+            else:
+                backend = SqliteBackend(os.path.join(tmp, "shards%d.db" % shards))
+                ConnectionManager.set_backend(backend)
+            days = seed(backend, args.caregivers, args.bookings, doses)
+            booked, rate, counter = run(backend, args.threads, args.bookings, days)
+            total, appointments = total_doses(backend)
+            label = "single row" if not shards else "%d shards" % shards
+            print(f"{label:>10}: threads={args.threads} booked={booked} {rate:.0f} bookings/s "
+                  f"left={total} fallbacks={counter.fallbacks} rebalanced={counter.moved}")
+            check(appointments == booked, "{} appointments written for {} bookings".format(appointments, booked))
+            check(total + appointments == doses,
+                  "{} doses left and {} booked out of {}".format(total, appointments, doses))
+        ConnectionManager.set_backend(None)
+    print("stock conserved")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+# Rows per second and peak memory of TableExport at two table sizes, to show memory stays
+# flat, then an export cut off part way and resumed, checked against an uninterrupted one,
+# and an export of an empty table.
+# Runs on embedded SQLite files:
+#   cd src/main/scheduler && python -m bench.ExportBenchmark --rows 100000 1000000 --gzip
+import argparse
+import datetime
+import gzip
+import os
+import random
+import tempfile
+import time
+import tracemalloc
+from bench import Fixtures
+from bench.Fixtures import START, check, names
+from db.SqliteBackend import SqliteBackend
+from db.TableExport import TableExport
+
+def seed(backend, rows):
+    caregivers = names("bench_cg", 100)
+    patients = names("bench_p", 1000)
+    appointments = ((i, "pfizer", START + datetime.timedelta(days=i % 365),
+                     random.choice(caregivers), random.choice(patients)) for i in range(rows))
+    Fixtures.seed(backend, caregivers=caregivers, patients=patients, vaccines={"pfizer": 0},
+                  appointments=appointments)
+
+
+class FailingConnection:
+    # hands out cursors that fail once `executes` statements have run, like a dropped connection
+    def __init__(self, conn, executes):
+        self.conn = conn
+        self.executes = executes
+
+    def cursor(self):
+        conn = self
+        cursor = self.conn.cursor()
+        execute = cursor.execute
+
+        def failing_execute(*args):
+            conn.executes -= 1
+            if conn.executes < 0:
+                raise ConnectionError("connection lost")
+            return execute(*args)
+        cursor.execute = failing_execute
+        return cursor
+
+
+def read(path):
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "rb") as f:
+        return f.read()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark streaming table exports")
+    parser.add_argument("--rows", type=int, nargs="+", default=[100000, 1000000])
+    parser.add_argument("--format", choices=["csv", "jsonl"], default="csv")
+    parser.add_argument("--gzip", action="store_true")
+    parser.add_argument("--chunk-size", type=int, default=10000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for rows in args.rows:
+            backend = SqliteBackend(os.path.join(tmp, "export%d.db" % rows))
+            seed(backend, rows)
+            conn = backend.open()
+            path = os.path.join(tmp, "appointments%d.%s%s" % (rows, args.format, ".gz" if args.gzip else ""))
+            tracemalloc.start()
+            start = time.perf_counter()
+            TableExport(backend, "appointments", path, chunk_size=args.chunk_size).run(conn)
+            elapsed = time.perf_counter() - start
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            print(f"{rows:>10} rows: {rows / elapsed:>9.0f} rows/s (traced), peak {peak / 2**20:6.2f} MiB, "
+                  f"file {os.path.getsize(path) / 2**20:.1f} MiB")
+
+            resumed_path = path.replace("appointments", "resumed")
+            try:
+                TableExport(backend, "appointments", resumed_path, chunk_size=args.chunk_size).run(
+                    FailingConnection(conn, rows // args.chunk_size // 2))
+            except ConnectionError:
+                pass
+            exporter = TableExport(backend, "appointments", resumed_path, chunk_size=args.chunk_size)
+            exporter.run(conn)
+            same = read(resumed_path) == read(path)
+            print(f"{'':>10}  resumed: {exporter.resumed}, identical to the uninterrupted export: {same}")
+            check(same, "the resumed export differs from the uninterrupted one")
+            conn.close()
+
+        # a table with nothing in it still gives a complete file, a CSV header and no rows
+        backend = SqliteBackend(os.path.join(tmp, "empty.db"))
+        conn = backend.open()
+        path = os.path.join(tmp, "empty.%s%s" % (args.format, ".gz" if args.gzip else ""))
+        exported = TableExport(backend, "appointments", path, chunk_size=args.chunk_size).run(conn)
+        conn.close()
+        print(f"{'empty':>10} table: {exported} rows exported, checkpoint left behind: "
+              f"{os.path.exists(path + '.resume')}")
+        check(exported == 0, "{} rows exported from an empty table".format(exported))
+        check(not os.path.exists(path + ".resume"), "the empty export left its checkpoint behind")
+
+
+if __name__ == "__main__":
+    main()
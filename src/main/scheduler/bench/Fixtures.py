@@ -0,0 +1,71 @@
+# Shared set-up for the benchmarks: accounts, availability, stock and appointments written
+# straight to the tables, and check() for the correctness checks the benchmarks finish with.
+import datetime
+import random
+from db.Backend import Backend
+
+START = datetime.date(2027, 1, 1)
+# accounts nobody logs in to need no real credentials
+NO_CREDENTIALS = (b"\0" * 16, b"\0" * 16, None)
+TABLES = ("Appointments", "Availabilities", "DoseShards", "Vaccines", "Patients", "Caregivers")
+
+
+def names(prefix, count, width=0):
+    # prefix0, prefix1, ... zero-padded to `width` digits so they also sort by number
+    return ["%s%0*d" % (prefix, width, i) for i in range(count)]
+
+
+def slots(caregivers, days, first_day=START, density=1.0):
+    # (date, caregiver) for every caregiver on each of `days` days, or a `density` share of them
+    return [(first_day + datetime.timedelta(days=d), caregiver)
+            for d in range(days) for caregiver in caregivers if density >= 1.0 or random.random() < density]
+
+
+def seed(target, caregivers=(), patients=(), availabilities=(), vaccines=None, appointments=(),
+         credentials=NO_CREDENTIALS, clear=False, chunk_size=100000):
+    # Writes the given rows in one transaction on `target`, a Backend or an open connection.
+    # `credentials` is the (salt, hash, kdf version) every account gets, `vaccines` maps names
+    # to doses and `appointments` are Appointments rows in column order. With `clear`, every
+    # table is emptied first.
+    conn = target.open() if isinstance(target, Backend) else target
+    cursor = conn.cursor()
+    salt, hash, kdf_version = credentials
+    if clear:
+        for table in TABLES:
+            cursor.execute("DELETE FROM " + table)
+    for table, usernames in (("Caregivers", caregivers), ("Patients", patients)):
+        if usernames:
+            cursor.executemany("INSERT INTO " + table + " (Username, Salt, Hash, KdfVersion) VALUES (%s, %s, %s, %d)",
+                               [(username, salt, hash, kdf_version) for username in usernames])
+    if availabilities:
+        cursor.executemany("INSERT INTO Availabilities VALUES (%s, %s)", list(availabilities))
+    if vaccines:
+        cursor.executemany("INSERT INTO Vaccines VALUES (%s, %d)", list(vaccines.items()))
+    # generated lazily by the caller when there are millions of them
+    batch = []
+    for row in appointments:
+        batch.append(row)
+        if len(batch) == chunk_size:
+            cursor.executemany("INSERT INTO Appointments VALUES (%d, %s, %s, %s, %s)", batch)
+            batch = []
+    if batch:
+        cursor.executemany("INSERT INTO Appointments VALUES (%d, %s, %s, %s, %s)", batch)
+    conn.commit()
+    if conn is not target:
+        conn.close()
+
+
+def count(target, table):
+    conn = target.open() if isinstance(target, Backend) else target
+    cursor = conn.cursor()
+    cursor.execute("SELECT COUNT(*) FROM " + table)
+    rows = cursor.fetchone()[0]
+    if conn is not target:
+        conn.close()
+    return rows
+
+
+def check(ok, message):
+    # a correctness check that fails the run, and still does under python -O, unlike assert
+    if not ok:
+        raise AssertionError(message)
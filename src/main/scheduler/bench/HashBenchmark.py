@@ -0,0 +1,39 @@
+# Bulk account provisioning throughput (hash in a process pool, insert in batches) for
+# 1, 2, 4, ... workers up to the machine's CPU count, into an in-memory SQLite database:
+#   cd src/main/scheduler && python -m bench.HashBenchmark --accounts 400
+import argparse
+import os
+import time
+from db.ConnectionManager import ConnectionManager
+from db.SqliteBackend import SqliteBackend
+from model.Patient import Patient
+from util.Util import Util
+
+
+def provision(accounts, workers, version):
+    hashes = Util.generate_hashes(["password%d" % i for i in range(accounts)], version, workers)
+    patients = [Patient("bench_p%d_%d" % (workers, i), salt=salt, hash=hash, kdf_version=version)
+                for i, (salt, hash) in enumerate(hashes)]
+    return Patient.save_all(patients)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--accounts", type=int, default=400)
+    parser.add_argument("--kdf-version", type=int, default=Util.current_kdf_version())
+    args = parser.parse_args()
+
+    ConnectionManager.set_backend(SqliteBackend())
+    workers = 1
+    while True:
+        start = time.perf_counter()
+        created = provision(args.accounts, workers, args.kdf_version)
+        elapsed = time.perf_counter() - start
+        print(f"workers={workers} accounts={created} {created / elapsed:.0f} accounts/s")
+        if workers >= os.cpu_count():
+            break
+        workers = min(workers * 2, os.cpu_count())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+# Hammers the appointment id allocator from several processes, each with several threads,
+# all sharing one SQLite file, then checks that no id was handed out twice:
+#   cd src/main/scheduler && python -m bench.IdAllocatorBenchmark --processes 4 --threads 8
+import argparse
+import multiprocessing
+import os
+import tempfile
+import threading
+import time
+from bench.Fixtures import check
+from db.IdAllocator import HiLoIdAllocator
+from db.SqliteBackend import SqliteBackend
+
+
+def allocate(path, threads, per_thread, block_size):
+    backend = SqliteBackend(path)
+    allocator = HiLoIdAllocator(backend, "AppointmentIds", "Appointments", "appointment_id", block_size)
+    ids = []
+    lock = threading.Lock()
+
+    def worker():
+        conn = backend.open()
+        mine = [allocator.next_id(conn) for _ in range(per_thread)]
+        conn.close()
+        with lock:
+            ids.extend(mine)
+
+    pool = [threading.Thread(target=worker) for _ in range(threads)]
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+    return ids, allocator.blocks
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--processes", type=int, default=4)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--ids", type=int, default=5000, help="ids per thread")
+    parser.add_argument("--block-size", type=int, default=50)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "ids.db")
+        SqliteBackend(path)
+        start = time.perf_counter()
+        with multiprocessing.Pool(args.processes) as pool:
+            results = pool.starmap(allocate, [(path, args.threads, args.ids, args.block_size)] * args.processes)
+        elapsed = time.perf_counter() - start
+
+    ids = [i for allocated, _ in results for i in allocated]
+    blocks = sum(b for _, b in results)
+    duplicates = len(ids) - len(set(ids))
+    print(f"processes={args.processes} threads={args.threads} block_size={args.block_size} "
+          f"ids={len(ids)} blocks={blocks} duplicates={duplicates} {len(ids) / elapsed:.0f} ids/s")
+    check(not duplicates, "{} duplicate ids handed out".format(duplicates))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+# Query plans and latency of the Appointments access paths (show_appointments and cancel,
+# per patient and per caregiver) before and after the index migration, over seeded SQLite
+# databases of increasing size. With the indexes, latency should stay flat as the table grows:
+#   cd src/main/scheduler && python -m bench.IndexBenchmark --sizes 10000,100000,1000000
+import argparse
+import datetime
+import os
+import random
+import tempfile
+import time
+from bench import Fixtures
+from bench.Fixtures import START, names
+from db.MigrationRunner import MigrationRunner
+from db.SqliteBackend import SqliteBackend
+
+INDEX_MIGRATION = 3
+
+QUERIES = {
+    "show_appointments (patient)": ("SELECT appointment_id, vaccine_name, Time, CUsername FROM Appointments "
+                                    "WHERE PUsername = %s ORDER BY appointment_id", "patient"),
+    "show_appointments (caregiver)": ("SELECT appointment_id, vaccine_name, Time, PUsername FROM Appointments "
+                                      "WHERE CUsername = %s ORDER BY appointment_id", "caregiver"),
+    "cancel lookup (patient)": ("SELECT appointment_id, Time, CUsername, vaccine_name FROM Appointments "
+                                "WHERE PUsername = %s AND appointment_id = %s", "patient_appointment"),
+    "cancel lookup (caregiver)": ("SELECT appointment_id, Time, PUsername, vaccine_name FROM Appointments "
+                                  "WHERE CUsername = %s AND appointment_id = %s", "caregiver_appointment"),
+}
+
+
+def seed(conn, appointments):
+    # about 4 appointments per patient and 50 per caregiver, so result sizes stay the same at every scale
+    patients = max(1, appointments // 4)
+    caregivers = max(1, appointments // 50)
+    vaccines = ("pfizer", "moderna", "jj")
+    rows = ((i + 1, vaccines[i % 3], START + datetime.timedelta(days=i % 365), "cg%d" % (i % caregivers),
+             "p%d" % (i % patients)) for i in range(appointments))
+    Fixtures.seed(conn, caregivers=names("cg", caregivers), patients=names("p", patients),
+                  vaccines=dict.fromkeys(vaccines, 0), appointments=rows, chunk_size=50000)
+    return patients, caregivers
+
+
+def params(kind, appointments, patients, caregivers):
+    appointment = random.randrange(appointments)
+    if kind == "patient":
+        return ("p%d" % random.randrange(patients),)
+    if kind == "caregiver":
+        return ("cg%d" % random.randrange(caregivers),)
+    if kind == "patient_appointment":
+        return ("p%d" % (appointment % patients), appointment + 1)
+    return ("cg%d" % (appointment % caregivers), appointment + 1)
+
+
+def measure(backend, conn, appointments, patients, caregivers, samples):
+    cursor = conn.cursor()
+    results = {}
+    for label, (sql, kind) in QUERIES.items():
+        cursor.execute("EXPLAIN QUERY PLAN " + sql, params(kind, appointments, patients, caregivers))
+        plan = "; ".join(row[-1] for row in cursor.fetchall())
+        timings = []
+        for _ in range(samples):
+            start = time.perf_counter()
+            cursor.execute(sql, params(kind, appointments, patients, caregivers))
+            cursor.fetchall()
+            timings.append(time.perf_counter() - start)
+        timings.sort()
+        results[label] = (timings[len(timings) // 2], plan)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", default="10000,100000", help="comma separated appointment counts")
+    parser.add_argument("--samples", type=int, default=200)
+    args = parser.parse_args()
+
+    for size in (int(s) for s in args.sizes.split(",")):
+        with tempfile.TemporaryDirectory() as tmp:
+            backend = SqliteBackend(os.path.join(tmp, "index.db"), migrate=False)
+            runner = MigrationRunner(backend)
+            conn = backend.open()
+            runner.migrate(conn, target=INDEX_MIGRATION - 1)
+            patients, caregivers = seed(conn, size)
+            before = measure(backend, conn, size, patients, caregivers, args.samples)
+            runner.migrate(conn)
+            after = measure(backend, conn, size, patients, caregivers, args.samples)
+            conn.close()
+
+        print(f"appointments={size}")
+        for label in QUERIES:
+            print(f"  {label:<30} before {before[label][0] * 1e6:>9.0f} us   after {after[label][0] * 1e6:>6.0f} us")
+            print(f"  {'':<30} plan: {after[label][1]}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+# Concurrent reserve / cancel / add_doses sessions against a file-backed SQLite database,
+# with the inventory cache checked against the Vaccines table afterwards, plus search latency
+# with the cache against a per-search SELECT:
+#   cd src/main/scheduler && python -m bench.InventoryConsistencyTest --sessions 200 --threads 16
+import argparse
+import datetime
+import os
+import random
+import re
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+import Scheduler
+from bench import Fixtures
+from bench.Fixtures import check, names
+from db.ConnectionManager import ConnectionManager
+from db.InventoryCache import inventory
+from db.SqliteBackend import SqliteBackend
+from util.Session import Session
+
+VACCINES = ["pfizer", "moderna", "novavax"]
+DAYS = 20
+
+
+def seed(sessions, caregivers, doses):
+    caregivers = names("inv_cg", caregivers)
+    Fixtures.seed(ConnectionManager.get_backend(), caregivers=caregivers, patients=names("inv_p", sessions),
+                  availabilities=Fixtures.slots(caregivers, DAYS, datetime.date(2027, 5, 1)),
+                  vaccines={name: doses for name in VACCINES})
+
+
+def patient_session(index, operations):
+    session = Session()
+    Scheduler.run_command(session, ["login_token", Scheduler.session_tokens.issue("patient", "inv_p%d" % index)])
+    booked = []
+    for _ in range(operations):
+        if booked and random.random() < 0.3:
+            Scheduler.run_command(session, ["cancel", booked.pop()])
+        else:
+            day = "05-%02d-2027" % random.randint(1, DAYS)
+            status, output = Scheduler.run_command(session, ["reserve", day, random.choice(VACCINES)])
+            match = re.search(r"Appointment ID: (\d+)", output)
+            if match:
+                booked.append(match.group(1))
+        Scheduler.run_command(session, ["search_caregiver_schedule", "05-01-2027"])
+
+
+def caregiver_session(index, operations):
+    session = Session()
+    Scheduler.run_command(session, ["login_token", Scheduler.session_tokens.issue("caregiver", "inv_cg%d" % index)])
+    for _ in range(operations):
+        Scheduler.run_command(session, ["add_doses", random.choice(VACCINES), str(random.randint(1, 3))])
+
+
+def table_doses():
+    conn = ConnectionManager.get_backend().open()
+    cursor = conn.cursor()
+    cursor.execute("SELECT Name, Doses FROM Vaccines ORDER BY Name")
+    rows = [tuple(row) for row in cursor.fetchall()]
+    conn.close()
+    return rows
+
+
+def search_latency(searches):
+    # one search per session, the doses part served from the cache and from a fresh SELECT
+    session = Session()
+    Scheduler.run_command(session, ["login_token", Scheduler.session_tokens.issue("patient", "inv_p0")])
+    tokens = ["search_caregiver_schedule", "05-01-2027"]
+    cache = inventory(ConnectionManager.get_backend())
+    results = {}
+    for label, ttl in (("cached", 60.0), ("uncached", -1.0)):
+        cache.ttl = ttl
+        start = time.perf_counter()
+        for _ in range(searches):
+            Scheduler.run_command(session, tokens)
+        results[label] = (time.perf_counter() - start) / searches
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sessions", type=int, default=200)
+    parser.add_argument("--caregivers", type=int, default=20)
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--operations", type=int, default=10, help="commands per session")
+    parser.add_argument("--doses", type=int, default=300, help="starting doses per vaccine")
+    parser.add_argument("--searches", type=int, default=2000)
+    args = parser.parse_args()
+
+    Scheduler.interactive = False
+    with tempfile.TemporaryDirectory() as directory:
+        ConnectionManager.set_backend(SqliteBackend(os.path.join(directory, "inventory.db")))
+        seed(args.sessions, args.caregivers, args.doses)
+        cache = inventory(ConnectionManager.get_backend())
+        # no refreshes during the run: every change has to arrive write-through
+        cache.ttl = 3600.0
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.threads) as pool:
+            futures = [pool.submit(patient_session, i, args.operations) for i in range(args.sessions)]
+            futures += [pool.submit(caregiver_session, i, args.operations) for i in range(args.caregivers)]
+            for future in futures:
+                future.result()
+        elapsed = time.perf_counter() - start
+
+        cached = cache.snapshot()
+        actual = table_doses()
+        stats = cache.stats()
+        latency = search_latency(args.searches)
+        ConnectionManager.set_backend(None)
+
+    print(f"{len(futures)} sessions, {elapsed:.2f}s; cache hits={stats['hits']} misses={stats['misses']} "
+          f"loads={stats['loads']} discarded={stats['discarded']}")
+    print("cache: " + ", ".join(f"{name}={doses}" for name, doses in cached))
+    print("table: " + ", ".join(f"{name}={doses}" for name, doses in actual))
+    print(f"search: {latency['cached'] * 1e6:.0f} us cached, {latency['uncached'] * 1e6:.0f} us uncached")
+    check(cached == actual, "the inventory cache does not match the Vaccines table")
+    print("consistent")
+
+
+if __name__ == "__main__":
+    main()
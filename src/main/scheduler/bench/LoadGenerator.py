@@ -0,0 +1,250 @@
+# Synthetic load for the scheduler: seeds caregivers, patients, availability and vaccines at
+# a chosen scale, then has N simulated users (one Session and thread each) log in and run a
+# weighted mix of commands through Scheduler.run_command. Reports throughput, p50/p95/p99
+# latency and failure/conflict/error rates per command as JSON, so runs can be compared
+# across releases. Runs offline on embedded SQLite by default:
+#   cd src/main/scheduler && python -m bench.LoadGenerator --users 32 --duration 10 --out load.json
+# --env runs against the backend configured by DBBackend instead; it must be empty.
+import argparse
+import datetime
+import json
+import os
+import platform
+import random
+import re
+import sys
+import tempfile
+import threading
+import time
+import Scheduler
+from bench import Fixtures
+from bench.Fixtures import names
+from db.ConnectionManager import ConnectionManager
+from db.SqliteBackend import SqliteBackend
+from util.Session import Session
+from util.Util import Util
+
+START = datetime.date(2027, 5, 1)
+PASSWORD = "loadtest"
+
+# (weight, command) per role; each command is a function (user) -> tokens
+PATIENT_MIX = [
+    (40, lambda user: ["search_caregiver_schedule", user.random_day()]),
+    (10, lambda user: ["search_caregiver_schedule"] + user.random_range(7)),
+    (10, lambda user: ["next_available", user.random_day(), user.random_vaccine()]),
+    (20, lambda user: ["reserve", user.random_day(), user.random_vaccine()]),
+    (10, lambda user: ["show_appointments"]),
+    (10, lambda user: ["cancel", user.booked_appointment()]),
+]
+CAREGIVER_MIX = [
+    (40, lambda user: ["upload_availability", user.random_day()]),
+    (20, lambda user: ["add_doses", user.random_vaccine(), str(random.randint(1, 5))]),
+    (20, lambda user: ["show_appointments"]),
+    (20, lambda user: ["capacity"] + user.random_range(14)),
+]
+
+# outputs of a failed command that mean another user got there first, not a broken command;
+# the last two are a duplicate availability upload on SQLite and on SQL Server
+CONFLICTS = ("No Caregiver is available!", "Not enough available doses!", "Appointment not found",
+             "UNIQUE constraint failed", "Violation of PRIMARY KEY")
+
+
+class Stats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = {}
+        self.outcomes = {}
+
+    def record(self, command, seconds, outcome):
+        with self.lock:
+            self.latencies.setdefault(command, []).append(seconds)
+            counts = self.outcomes.setdefault(command, {"ok": 0, "failed": 0, "conflict": 0, "error": 0})
+            counts[outcome] += 1
+
+    def report(self, elapsed):
+        commands = {}
+        with self.lock:
+            for command, samples in sorted(self.latencies.items()):
+                samples.sort()
+                counts = self.outcomes[command]
+                commands[command] = dict(
+                    count=len(samples), **counts,
+                    throughput=round(len(samples) / elapsed, 1),
+                    mean_ms=round(sum(samples) / len(samples) * 1000, 3),
+                    p50_ms=round(percentile(samples, 0.50) * 1000, 3),
+                    p95_ms=round(percentile(samples, 0.95) * 1000, 3),
+                    p99_ms=round(percentile(samples, 0.99) * 1000, 3),
+                    error_rate=round(counts["error"] / len(samples), 4),
+                    conflict_rate=round(counts["conflict"] / len(samples), 4))
+        total = sum(c["count"] for c in commands.values())
+        return commands, {"commands": total, "throughput": round(total / elapsed, 1),
+                          "errors": sum(c["error"] for c in commands.values()),
+                          "conflicts": sum(c["conflict"] for c in commands.values())}
+
+
+def percentile(samples, p):
+    return samples[min(len(samples) - 1, int(len(samples) * p))]
+
+
+class SimulatedUser:
+    def __init__(self, role, username, args, vaccines):
+        self.role = role
+        self.username = username
+        self.args = args
+        self.vaccines = vaccines
+        self.session = Session()
+        self.booked = []
+        mix = PATIENT_MIX if role == "patient" else CAREGIVER_MIX
+        self.weights = [weight for weight, _ in mix]
+        self.commands = [command for _, command in mix]
+
+    def random_day(self):
+        return (START + datetime.timedelta(days=random.randrange(self.args.days))).strftime("%m-%d-%Y")
+
+    def random_range(self, longest):
+        first = START + datetime.timedelta(days=random.randrange(self.args.days))
+        last = first + datetime.timedelta(days=random.randrange(longest))
+        return [first.strftime("%m-%d-%Y"), last.strftime("%m-%d-%Y")]
+
+    def random_vaccine(self):
+        return random.choice(self.vaccines)
+
+    def booked_appointment(self):
+        # one of this user's own bookings, or an id that probably belongs to someone else
+        if self.booked:
+            return self.booked.pop(random.randrange(len(self.booked)))
+        return str(random.randint(1, 1000000))
+
+    def login(self, stats):
+        self.call(stats, ["login_" + self.role, self.username, PASSWORD])
+
+    def run(self, stats, deadline, operations):
+        done = 0
+        while time.perf_counter() < deadline and (operations is None or done < operations):
+            tokens = random.choices(self.commands, self.weights)[0](self)
+            output = self.call(stats, tokens)
+            match = re.search(r"Appointment ID: (\d+)", output)
+            if match:
+                self.booked.append(match.group(1))
+            done += 1
+            if self.args.think_ms:
+                time.sleep(random.expovariate(1000.0 / self.args.think_ms))
+        self.call(stats, ["logout"])
+
+    def call(self, stats, tokens):
+        start = time.perf_counter()
+        status, output = Scheduler.run_command(self.session, tokens)
+        elapsed = time.perf_counter() - start
+        if status == "ok":
+            outcome = "ok"
+        elif any(conflict in output for conflict in CONFLICTS):
+            outcome = "conflict"
+        elif status == "error" or "Error" in output:
+            outcome = "error"
+        else:
+            outcome = "failed"
+        stats.record(tokens[0], elapsed, outcome)
+        return output
+
+
+def seed(args):
+    # every account shares one salt and hash, so seeding costs a single PBKDF2 run
+    kdf_version = Util.current_kdf_version()
+    salt = Util.generate_salt()
+    credentials = (salt, Util.generate_hash(PASSWORD, salt, kdf_version), kdf_version)
+    caregivers = names("load_cg", args.caregivers)
+    vaccines = names("vaccine", args.vaccines)
+    Fixtures.seed(ConnectionManager.get_backend(), caregivers=caregivers, patients=names("load_p", args.patients),
+                  availabilities=Fixtures.slots(caregivers, args.days, START, args.density),
+                  vaccines=dict.fromkeys(vaccines, args.doses), credentials=credentials)
+    return vaccines
+
+
+def run_all(threads):
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Drive a mixed scheduler workload and report per-command latency")
+    parser.add_argument("--users", type=int, default=16, help="concurrent simulated users")
+    parser.add_argument("--caregiver-share", type=float, default=0.2, help="fraction of users who are caregivers")
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds to run")
+    parser.add_argument("--operations", type=int, default=None, help="stop each user after this many commands")
+    parser.add_argument("--think-ms", type=float, default=0.0, help="mean pause between a user's commands")
+    parser.add_argument("--caregivers", type=int, default=200)
+    parser.add_argument("--patients", type=int, default=2000)
+    parser.add_argument("--days", type=int, default=60)
+    parser.add_argument("--density", type=float, default=0.3, help="chance a caregiver is free on a day")
+    parser.add_argument("--vaccines", type=int, default=3)
+    parser.add_argument("--doses", type=int, default=1000, help="starting doses per vaccine")
+    parser.add_argument("--seed", type=int, default=None, help="random seed, for repeatable runs")
+    parser.add_argument("--env", action="store_true", help="use the backend configured by DBBackend")
+    parser.add_argument("--out", help="write the JSON report here instead of stdout")
+    args = parser.parse_args()
+    if args.seed is not None:
+        random.seed(args.seed)
+    caregiver_users = min(args.caregivers, round(args.users * args.caregiver_share))
+    if args.users - caregiver_users > args.patients:
+        parser.error("more patient users than patients")
+
+    Scheduler.interactive = False
+    with tempfile.TemporaryDirectory() as tmp:
+        if args.env:
+            ConnectionManager.set_backend(None)
+        else:
+            ConnectionManager.set_backend(SqliteBackend(os.path.join(tmp, "load.db")))
+        seed_start = time.perf_counter()
+        vaccines = seed(args)
+        seed_seconds = time.perf_counter() - seed_start
+
+        users = [SimulatedUser("caregiver", "load_cg%d" % i, args, vaccines) for i in range(caregiver_users)]
+        users += [SimulatedUser("patient", "load_p%d" % i, args, vaccines)
+                  for i in random.sample(range(args.patients), args.users - caregiver_users)]
+        # password logins are PBKDF2-bound, so they get their own phase before the clock starts
+        logins = Stats()
+        login_start = time.perf_counter()
+        run_all([threading.Thread(target=user.login, args=(logins,)) for user in users])
+        login_elapsed = time.perf_counter() - login_start
+        # a fresh pool, so its wait figures cover the measured phase only
+        ConnectionManager.set_pool(None)
+
+        stats = Stats()
+        start = time.perf_counter()
+        deadline = start + args.duration
+        run_all([threading.Thread(target=user.run, args=(stats, deadline, args.operations)) for user in users])
+        elapsed = time.perf_counter() - start
+        pool = ConnectionManager.get_pool().stats()
+        backend = ConnectionManager.get_backend().name
+        ConnectionManager.set_backend(None)
+
+    commands, totals = stats.report(elapsed)
+    report = {
+        "benchmark": "scheduler-load",
+        "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+        "environment": {"python": platform.python_version(), "platform": platform.platform(),
+                        "cpus": os.cpu_count(), "backend": backend},
+        "config": {key: value for key, value in vars(args).items() if key != "out"},
+        "seed_seconds": round(seed_seconds, 3),
+        "elapsed_seconds": round(elapsed, 3),
+        "login": dict(logins.report(login_elapsed)[0], elapsed_seconds=round(login_elapsed, 3)),
+        "totals": totals,
+        "commands": commands,
+        "pool": {key: pool[key] for key in ("opened", "checkouts", "waits", "max_wait")},
+    }
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(report, f, indent=2)
+            f.write("\n")
+        print(f"{totals['commands']} commands, {totals['throughput']} commands/s, "
+              f"{totals['errors']} errors, {totals['conflicts']} conflicts -> {args.out}")
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        sys.stdout.write("\n")
+    return 1 if totals["errors"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
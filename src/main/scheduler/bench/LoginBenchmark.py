@@ -0,0 +1,48 @@
+# Login latency: a full password login (PBKDF2) versus resuming the session with its token.
+#   cd src/main/scheduler && python -m bench.LoginBenchmark --logins 20
+import argparse
+import contextlib
+import io
+import time
+import Scheduler
+from db.ConnectionManager import ConnectionManager
+from db.SqliteBackend import SqliteBackend
+from util.Session import Session
+
+
+def timed(command, tokens, logins):
+    samples = []
+    for _ in range(logins):
+        session = Session()
+        start = time.perf_counter()
+        ok = command(session, tokens)
+        samples.append(time.perf_counter() - start)
+        if not ok:
+            raise SystemExit("login failed: " + " ".join(tokens[:2]))
+    samples.sort()
+    return samples[len(samples) // 2], samples[int(len(samples) * 0.99)]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--logins", type=int, default=20)
+    args = parser.parse_args()
+
+    ConnectionManager.set_backend(SqliteBackend())
+    Scheduler.interactive = False
+    session = Session()
+    with contextlib.redirect_stdout(io.StringIO()):
+        Scheduler.create_caregiver(session, ["create_caregiver", "bench_cg", "secret"])
+        Scheduler.login_caregiver(session, ["login_caregiver", "bench_cg", "secret"])
+    token = session.token
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        password = timed(Scheduler.login_caregiver, ["login_caregiver", "bench_cg", "secret"], args.logins)
+        resumed = timed(Scheduler.login_token, ["login_token", token], args.logins)
+    for label, (p50, p99) in (("password", password), ("token", resumed)):
+        print(f"{label:>8}: p50 {p50 * 1e6:.0f} us, p99 {p99 * 1e6:.0f} us")
+    print(f"speedup: {password[0] / resumed[0]:.0f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+# Cost of the metrics hooks: the same read-heavy command mix through Scheduler.run_command
+# with metrics on and off, on embedded in-memory SQLite, then the phase breakdown of the
+# instrumented run:
+#   cd src/main/scheduler && python -m bench.MetricsOverheadBenchmark --commands 5000
+import argparse
+import datetime
+import time
+import Scheduler
+from bench import Fixtures
+from bench.Fixtures import check, names
+from db.ConnectionManager import ConnectionManager
+from db.SqliteBackend import SqliteBackend
+from util.Metrics import metrics
+from util.Session import Session
+from util.Util import Util
+
+DAY = datetime.date(2027, 5, 1)
+
+
+def seed(backend, caregivers, days):
+    # the one patient logs in for real, the caregivers are only names on the schedule
+    salt = Util.generate_salt()
+    caregivers = names("bench_cg", caregivers)
+    Fixtures.seed(backend, patients=["bench_p"], credentials=(salt, Util.generate_hash("bench", salt, 1), 1))
+    Fixtures.seed(backend, caregivers=caregivers, availabilities=Fixtures.slots(caregivers, days, DAY),
+                  vaccines={"pfizer": 100})
+
+
+def run(session, commands, days):
+    mix = [["search_caregiver_schedule", None], ["show_appointments"], ["capacity", None, None]]
+    start = time.perf_counter()
+    for i in range(commands):
+        tokens = list(mix[i % len(mix)])
+        day = (DAY + datetime.timedelta(days=i % days)).strftime("%m-%d-%Y")
+        tokens[1:] = [day] * (len(tokens) - 1)
+        Scheduler.run_command(session, tokens)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure the overhead of the metrics hooks")
+    parser.add_argument("--commands", type=int, default=5000)
+    parser.add_argument("--caregivers", type=int, default=20)
+    parser.add_argument("--days", type=int, default=30)
+    parser.add_argument("--rounds", type=int, default=3, help="best of this many runs each way")
+    args = parser.parse_args()
+
+    Scheduler.interactive = False
+    backend = SqliteBackend(":memory:")
+    ConnectionManager.set_backend(backend)
+    seed(backend, args.caregivers, args.days)
+    session = Session()
+    status, output = Scheduler.run_command(session, ["login_patient", "bench_p", "bench"])
+    check(status == "ok", "login failed: " + output)
+
+    best = {}
+    for _ in range(args.rounds):
+        for enabled in (False, True):
+            metrics.enabled = enabled
+            metrics.reset()
+            elapsed = run(session, args.commands, args.days)
+            best[enabled] = min(best.get(enabled, elapsed), elapsed)
+    per_off = best[False] / args.commands * 1e6
+    per_on = best[True] / args.commands * 1e6
+    print(f"metrics off: {per_off:8.1f} us/command")
+    print(f"metrics on:  {per_on:8.1f} us/command  (+{per_on - per_off:.1f} us, "
+          f"{(per_on / per_off - 1) * 100:+.1f}%)")
+
+    for command, recorded in metrics.snapshot()["commands"].items():
+        phases = ", ".join(f"{phase} {p['sum'] / p['count'] * 1e6:.0f}us x{p['entered'] / p['count']:g}"
+                           for phase, p in recorded["phases"].items())
+        count = recorded["seconds"]["count"]
+        print(f"  {command:27} {recorded['seconds']['sum'] / count * 1e6:7.0f} us, "
+              f"{recorded['statements'] / count:g} statements: {phases or 'no database work'}")
+    ConnectionManager.set_backend(None)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+# Counts how many driver connections a scripted CLI session opens with and without pooling.
+# Runs against a stand-in driver, so no database is needed:
+#   cd src/main/scheduler && python -m bench.PoolBenchmark
+import contextlib
+import io
+import time
+import Scheduler
+from db.ConnectionManager import ConnectionManager
+from db.ConnectionPool import ConnectionPool
+from db.SqliteBackend import SqliteBackend
+from model.Caregiver import Caregiver
+from model.Patient import Patient
+from util.Session import Session
+
+
+class StandInCursor:
+    # accepts every statement and answers with an empty result set
+    def __init__(self, as_dict=False):
+        self.as_dict = as_dict
+
+    def execute(self, operation, params=None):
+        pass
+
+    def fetchone(self):
+        return None
+
+    def fetchall(self):
+        return []
+
+    def close(self):
+        pass
+
+    def __iter__(self):
+        return iter([])
+
+
+class StandInConnection:
+    def __init__(self, connect_latency):
+        # sleep once per connection to stand in for the TCP + TLS + login handshake
+        time.sleep(connect_latency)
+
+    def cursor(self, as_dict=False):
+        return StandInCursor(as_dict)
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        pass
+
+
+SCRIPT = [
+    ("caregiver", "upload_availability 05-01-2027"),
+    ("caregiver", "upload_availability 05-02-2027"),
+    ("caregiver", "add_doses pfizer 10"),
+    ("caregiver", "add_doses moderna 5"),
+    ("caregiver", "search_caregiver_schedule 05-01-2027"),
+    ("caregiver", "show_appointments"),
+    ("patient", "search_caregiver_schedule 05-01-2027"),
+    ("patient", "reserve 05-01-2027 pfizer"),
+    ("patient", "show_appointments"),
+    ("patient", "cancel 1"),
+]
+
+COMMANDS = {
+    "upload_availability": Scheduler.upload_availability,
+    "add_doses": Scheduler.add_doses,
+    "search_caregiver_schedule": Scheduler.search_caregiver_schedule,
+    "reserve": Scheduler.reserve,
+    "show_appointments": Scheduler.show_appointments,
+    "cancel": Scheduler.cancel,
+}
+
+
+def run_session(pool, repeat):
+    ConnectionManager.set_pool(pool)
+    start = time.perf_counter()
+    caregiver = Session()
+    caregiver.caregiver = Caregiver("bench_caregiver")
+    patient = Session()
+    patient.patient = Patient("bench_patient")
+    with contextlib.redirect_stdout(io.StringIO()):
+        for _ in range(repeat):
+            for role, line in SCRIPT:
+                tokens = line.split(" ")
+                COMMANDS[tokens[0]](caregiver if role == "caregiver" else patient, tokens)
+    elapsed = time.perf_counter() - start
+    return pool.stats(), elapsed
+
+
+def main(repeat=20, connect_latency=0.02):
+    # the menu reprint sleeps for a second per command, which would drown out the numbers
+    Scheduler.interactive = False
+    # only the SQL dialect is taken from here, statements go to the stand-in driver
+    ConnectionManager.set_backend(SqliteBackend())
+    commands = repeat * len(SCRIPT)
+
+    def connect():
+        return StandInConnection(connect_latency)
+
+    # max_idle=0 closes every connection on return, which is what the code did before pooling
+    for label, pool in (("unpooled", ConnectionPool(connect, max_idle=0)),
+                        ("pooled", ConnectionPool(connect))):
+        stats, elapsed = run_session(pool, repeat)
+        print(f"{label:>8}: {commands} commands, {stats['checkouts']} checkouts, "
+              f"{stats['opened']} connections opened, {elapsed:.2f}s")
+    ConnectionManager.set_pool(None)
+
+
+if __name__ == "__main__":
+    main()
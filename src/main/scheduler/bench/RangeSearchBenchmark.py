@@ -0,0 +1,73 @@
+# Peak memory and time to read every free caregiver over a date range: one fetchall()
+# against walking the keyset pages of ScheduleSearch with fetchmany():
+#   cd src/main/scheduler && python -m bench.RangeSearchBenchmark --caregivers 1000 --days 180
+import argparse
+import datetime
+import time
+import tracemalloc
+from bench import Fixtures
+from bench.Fixtures import names
+from db.ConnectionManager import ConnectionManager
+from db.ScheduleSearch import ScheduleSearch, decode_token
+from db.SqliteBackend import SqliteBackend
+
+START = datetime.date(2027, 5, 1)
+
+
+def seed(conn, caregivers, days):
+    caregivers = names("range_cg", caregivers, width=5)
+    Fixtures.seed(conn, caregivers=caregivers, availabilities=Fixtures.slots(caregivers, days, START))
+
+
+def measure(fn):
+    tracemalloc.start()
+    start = time.perf_counter()
+    rows = fn()
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return rows, elapsed, peak
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--caregivers", type=int, default=1000)
+    parser.add_argument("--days", type=int, default=180)
+    parser.add_argument("--page-size", type=int, default=200)
+    args = parser.parse_args()
+
+    backend = SqliteBackend()
+    ConnectionManager.set_backend(backend)
+    cm = ConnectionManager()
+    conn = cm.create_connection()
+    seed(conn, args.caregivers, args.days)
+    end = START + datetime.timedelta(days=args.days - 1)
+
+    def fetch_all():
+        cursor = conn.cursor()
+        cursor.execute("SELECT Time, Username FROM Availabilities WHERE Time BETWEEN %s AND %s "
+                       "ORDER BY Time, Username", (START, end))
+        rows = 0
+        for _ in cursor.fetchall():
+            rows += 1
+        return rows
+
+    def paged():
+        search = ScheduleSearch(backend, page_size=args.page_size)
+        rows = 0
+        after = None
+        while True:
+            for _ in search.rows(conn, START, end, after):
+                rows += 1
+            if search.next_token is None:
+                return rows
+            _, _, after = decode_token(search.next_token)
+
+    for label, fn in (("fetchall", fetch_all), ("keyset pages", paged)):
+        rows, elapsed, peak = measure(fn)
+        print(f"{label:>12}: {rows} rows, {elapsed:.2f}s, peak {peak / 1024:.0f} KiB")
+    cm.close_connection()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+# Time and peak memory of the operations report over a large schedule, on an embedded SQLite
+# file: loading the columns, then each aggregate. Needs NumPy.
+#   cd src/main/scheduler && python -m bench.ReportBenchmark --appointments 1000000
+import argparse
+import datetime
+import os
+import random
+import tempfile
+import time
+import tracemalloc
+from bench import Fixtures
+from bench.Fixtures import START, names
+from db.SqliteBackend import SqliteBackend
+from db.UtilizationReport import UtilizationReport
+
+def seed(backend, args):
+    caregivers = names("bench_caregiver_", args.caregivers)
+    patients = names("bench_patient_", args.patients)
+    vaccines = names("vaccine", args.vaccines)
+    appointments = ((i, random.choice(vaccines), START + datetime.timedelta(days=random.randrange(args.days)),
+                     random.choice(caregivers), random.choice(patients)) for i in range(args.appointments))
+    Fixtures.seed(backend, caregivers=caregivers, patients=patients,
+                  availabilities=Fixtures.slots(caregivers, args.days, density=0.3),
+                  vaccines={vaccine: 1000000 for vaccine in vaccines}, appointments=appointments)
+
+
+def timed(label, call):
+    start = time.perf_counter()
+    result = call()
+    print(f"  {label:15} {time.perf_counter() - start:8.3f}s")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the NumPy operations report")
+    parser.add_argument("--appointments", type=int, default=1000000)
+    parser.add_argument("--caregivers", type=int, default=500)
+    parser.add_argument("--patients", type=int, default=20000)
+    parser.add_argument("--vaccines", type=int, default=5)
+    parser.add_argument("--days", type=int, default=365)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        backend = SqliteBackend(os.path.join(tmp, "report.db"))
+        start = time.perf_counter()
+        seed(backend, args)
+        print(f"seeded {args.appointments} appointments in {time.perf_counter() - start:.1f}s")
+
+        end = START + datetime.timedelta(days=args.days - 1)
+        conn = backend.open()
+        report = UtilizationReport(backend)
+        timed("load", lambda: report.load(conn))
+        timed("doses_per_day", lambda: report.doses_per_day(START, end))
+        timed("utilization", lambda: report.utilization(START, end))
+        timed("stock_out", lambda: report.stock_out(end))
+        # again under tracemalloc, which would slow the timed run down several times
+        tracemalloc.start()
+        report = UtilizationReport(backend).load(conn)
+        report.doses_per_day(START, end)
+        report.utilization(START, end)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        conn.close()
+        print(f"peak memory {peak / 2**20:.1f} MiB, columns {report.appointments.nbytes / 2**20:.1f} MiB "
+              f"+ {report.availabilities.nbytes / 2**20:.1f} MiB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+# Bookings per second through ReservationEngine with concurrent reservers, against an
+# embedded SQLite file (or the configured backend with --env):
+#   cd src/main/scheduler && python -m bench.ReserveBenchmark --threads 8 --slots 2000
+import argparse
+import datetime
+import os
+import tempfile
+import threading
+import time
+from bench import Fixtures
+from bench.Fixtures import check, names
+from db.ConnectionManager import ConnectionManager
+from db.ConnectionPool import ConnectionPool
+from db.ReservationEngine import ReservationEngine, RESERVED
+from db.SqliteBackend import SqliteBackend
+
+DAY = datetime.datetime(2027, 5, 1)
+
+
+def seed(backend, caregivers, slots):
+    caregivers = names("bench_cg", caregivers)
+    days = (slots + len(caregivers) - 1) // len(caregivers)
+    Fixtures.seed(backend, caregivers=caregivers, patients=names("bench_p", slots),
+                  availabilities=Fixtures.slots(caregivers, days, DAY), vaccines={"pfizer": slots})
+    return days
+
+
+def run(backend, threads, slots, days):
+    ConnectionManager.set_backend(backend)
+    ConnectionManager.set_pool(ConnectionPool(backend.open, max_size=threads))
+    engine = ReservationEngine(backend)
+    outcomes = []
+    lock = threading.Lock()
+    next_patient = iter(range(slots))
+
+    def worker():
+        while True:
+            with lock:
+                patient = next(next_patient, None)
+            if patient is None:
+                return
+            cm = ConnectionManager()
+            conn = cm.create_connection()
+            try:
+                d = DAY + datetime.timedelta(days=patient % days)
+                status, appointment_id, _ = engine.reserve(conn, d, "pfizer", "bench_p%d" % patient)
+            finally:
+                cm.close_connection()
+            with lock:
+                outcomes.append((status, appointment_id))
+
+    pool = [threading.Thread(target=worker) for _ in range(threads)]
+    start = time.perf_counter()
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+    elapsed = time.perf_counter() - start
+
+    booked = [appointment_id for status, appointment_id in outcomes if status == RESERVED]
+    print(f"threads={threads} attempts={len(outcomes)} booked={len(booked)} "
+          f"unique_ids={len(set(booked))} {len(outcomes) / elapsed:.0f} bookings/s")
+    check(len(booked) == slots, "{} of {} slots booked".format(len(booked), slots))
+    check(len(set(booked)) == len(booked), "appointment ids handed out twice")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--caregivers", type=int, default=20)
+    parser.add_argument("--slots", type=int, default=2000)
+    parser.add_argument("--env", action="store_true", help="use the backend configured by DBBackend")
+    args = parser.parse_args()
+
+    if args.env:
+        ConnectionManager.set_backend(None)
+        backend = ConnectionManager.get_backend()
+        days = seed(backend, args.caregivers, args.slots)
+        run(backend, args.threads, args.slots, days)
+        return
+    with tempfile.TemporaryDirectory() as tmp:
+        backend = SqliteBackend(os.path.join(tmp, "bench.db"))
+        days = seed(backend, args.caregivers, args.slots)
+        run(backend, args.threads, args.slots, days)
+        ConnectionManager.set_pool(None)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+# Load test for Server.py: N concurrent clients each log in with a session token and then
+# issue a mix of search_caregiver_schedule and show_appointments, against an in-process
+# server on an in-memory SQLite database. Reports requests per second and tail latency:
+#   cd src/main/scheduler && python -m bench.ServerLoadTest --clients 1000 --requests 10
+import argparse
+import asyncio
+import datetime
+import json
+import threading
+import time
+import Scheduler
+from Server import SchedulerServer
+from bench import Fixtures
+from bench.Fixtures import names
+from db.ConnectionManager import ConnectionManager
+from db.SqliteBackend import SqliteBackend
+
+
+def seed(clients):
+    caregivers = names("load_cg", 20)
+    patients = names("load_p", clients)
+    Fixtures.seed(ConnectionManager.get_backend(), caregivers=caregivers, patients=patients,
+                  availabilities=Fixtures.slots(caregivers, 30, datetime.date(2027, 5, 1)), vaccines={"pfizer": 1000})
+    # logging in with tokens keeps the test about the server rather than about PBKDF2
+    return [Scheduler.session_tokens.issue("patient", username) for username in patients]
+
+
+def start_server(server):
+    loop = asyncio.new_event_loop()
+    started = threading.Event()
+    holder = {}
+
+    def run():
+        asyncio.set_event_loop(loop)
+        holder["server"] = loop.run_until_complete(server.start("127.0.0.1", 0))
+        started.set()
+        loop.run_forever()
+
+    threading.Thread(target=run, daemon=True).start()
+    started.wait()
+    return holder["server"].sockets[0].getsockname()[1]
+
+
+async def client(port, token, requests, latencies, statuses):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    commands = ["login_token " + token]
+    for i in range(requests):
+        commands.append("search_caregiver_schedule 05-%02d-2027" % (1 + i % 28) if i % 2 == 0 else "show_appointments")
+    for command in commands:
+        start = time.perf_counter()
+        writer.write((command + "\n").encode())
+        await writer.drain()
+        response = json.loads(await reader.readline())
+        latencies.append(time.perf_counter() - start)
+        statuses[response["status"]] = statuses.get(response["status"], 0) + 1
+    writer.write(b"quit\n")
+    await writer.drain()
+    writer.close()
+
+
+async def drive(port, tokens, requests):
+    latencies = []
+    statuses = {}
+    start = time.perf_counter()
+    await asyncio.gather(*(client(port, token, requests, latencies, statuses) for token in tokens))
+    return latencies, statuses, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--clients", type=int, default=1000)
+    parser.add_argument("--requests", type=int, default=10, help="requests per client after logging in")
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--max-pending", type=int, default=256)
+    parser.add_argument("--timeout", type=float, default=30.0)
+    args = parser.parse_args()
+
+    ConnectionManager.set_backend(SqliteBackend())
+    tokens = seed(args.clients)
+    port = start_server(SchedulerServer(args.workers, args.max_pending, args.timeout))
+    latencies, statuses, elapsed = asyncio.run(drive(port, tokens, args.requests))
+
+    latencies.sort()
+
+    def percentile(p):
+        return latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000
+
+    print(f"clients={args.clients} requests={len(latencies)} {len(latencies) / elapsed:.0f} req/s "
+          f"p50={percentile(0.50):.1f}ms p95={percentile(0.95):.1f}ms p99={percentile(0.99):.1f}ms "
+          f"statuses={statuses}")
+
+
+if __name__ == "__main__":
+    main()
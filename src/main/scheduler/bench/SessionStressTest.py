@@ -0,0 +1,108 @@
+# Many sessions served by one thread pool in one process: each worker logs in as its own
+# patient, reserves appointments and lists them, and every response is checked against the
+# session that issued it. Any output or login state leaking between sessions is reported.
+#   cd src/main/scheduler && python -m bench.SessionStressTest --sessions 2000 --threads 16
+import argparse
+import datetime
+import os
+import random
+import re
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+import Scheduler
+from bench import Fixtures
+from bench.Fixtures import names
+from db.ConnectionManager import ConnectionManager
+from db.SqliteBackend import SqliteBackend
+from util.Session import Session
+
+DAYS = 30
+
+
+def seed(sessions, caregivers):
+    caregivers = names("stress_cg", caregivers)
+    Fixtures.seed(ConnectionManager.get_backend(), caregivers=caregivers, patients=names("stress_p", sessions),
+                  availabilities=Fixtures.slots(caregivers, DAYS, datetime.date(2027, 5, 1)),
+                  vaccines={"pfizer": 10 * sessions})
+
+
+def check(session, username, tokens, expect_ok=True):
+    # runs one command and returns its output, or raises if it leaked into another session
+    status, output = Scheduler.run_command(session, tokens)
+    if session.username() != username:
+        raise AssertionError("%s's session now belongs to %s" % (username, session.username()))
+    if expect_ok and status != "ok":
+        raise AssertionError("%s: %s -> %s %r" % (username, tokens[0], status, output))
+    for other in re.findall(r"stress_p\d+", output):
+        if other != username:
+            raise AssertionError("%s saw %s's output" % (username, other))
+    return output
+
+
+def run_session(session, index, reservations):
+    username = "stress_p%d" % index
+    token = Scheduler.session_tokens.issue("patient", username)
+    status, output = Scheduler.run_command(session, ["login_token", token])
+    if status != "ok" or output != "Logged in as: " + username or session.username() != username:
+        raise AssertionError("%s: login_token -> %s %r" % (username, status, output))
+
+    reserved = set()
+    for _ in range(reservations):
+        day = "05-%02d-2027" % random.randint(1, DAYS)
+        output = check(session, username, ["reserve", day, "pfizer"], expect_ok=False)
+        match = re.search(r"Appointment ID: (\d+)", output)
+        if match:
+            reserved.add(match.group(1))
+    listed = check(session, username, ["show_appointments"])
+    shown = {line.split(" ")[0] for line in listed.splitlines() if line[:1].isdigit()}
+    if shown != reserved:
+        raise AssertionError("%s reserved %s but was shown %s" % (username, sorted(reserved), sorted(shown)))
+    return len(reserved)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sessions", type=int, default=2000)
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--reservations", type=int, default=2, help="reserve attempts per session")
+    parser.add_argument("--caregivers", type=int, default=50)
+    args = parser.parse_args()
+
+    Scheduler.interactive = False
+    with tempfile.TemporaryDirectory() as directory:
+        # a file database, so the pool can hand out more than one connection at a time
+        ConnectionManager.set_backend(SqliteBackend(os.path.join(directory, "stress.db")))
+        seed(args.sessions, args.caregivers)
+
+        tracemalloc.start()
+        before = tracemalloc.take_snapshot()
+        sessions = [Session() for _ in range(args.sessions)]
+        grown = sum(stat.size_diff for stat in tracemalloc.take_snapshot().compare_to(before, "filename"))
+        per_session = grown / max(1, args.sessions)
+        tracemalloc.stop()
+
+        start = time.perf_counter()
+        failures = []
+        booked = 0
+        with ThreadPoolExecutor(max_workers=args.threads) as pool:
+            futures = [pool.submit(run_session, session, i, args.reservations) for i, session in enumerate(sessions)]
+            for future in futures:
+                try:
+                    booked += future.result()
+                except AssertionError as e:
+                    failures.append(str(e))
+        elapsed = time.perf_counter() - start
+        ConnectionManager.set_backend(None)
+
+    print(f"sessions={args.sessions} threads={args.threads} appointments={booked} "
+          f"{args.sessions / elapsed:.0f} sessions/s, ~{per_session:.0f} bytes per idle session")
+    for failure in failures[:10]:
+        print("LEAK: " + failure)
+    print("leaks: %d" % len(failures))
+    Fixtures.check(not failures, "%d sessions leaked into others" % len(failures))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+# What a scripted, one-shot scheduler command costs: interpreter start, importing Scheduler,
+# a cold `Scheduler.py --batch` run (log in with a password, then search) and the same
+# search through SchedulerClient.py to a warm daemon. Median wall time of each over --runs
+# fresh processes, against an embedded SQLite file:
+#   cd src/main/scheduler && python -m bench.StartupBenchmark --runs 20
+import argparse
+import datetime
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from bench import Fixtures
+from bench.Fixtures import names
+from db.SqliteBackend import SqliteBackend
+from util.Util import Util
+
+HERE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DAY = datetime.date(2027, 5, 1)
+
+
+def seed(path):
+    backend = SqliteBackend(path)
+    salt = Util.generate_salt()
+    caregivers = names("bench_cg", 50)
+    Fixtures.seed(backend, patients=["bench_p"], credentials=(salt, Util.generate_hash("bench", salt, 1), 1))
+    Fixtures.seed(backend, caregivers=caregivers, availabilities=Fixtures.slots(caregivers, 1, DAY))
+
+
+def timed(runs, argv, env, stdin=None):
+    samples = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        result = subprocess.run(argv, input=stdin, env=env, cwd=HERE, capture_output=True, text=True)
+        samples.append(time.perf_counter() - start)
+        if result.returncode != 0:
+            raise RuntimeError("{} failed: {}{}".format(" ".join(argv), result.stdout, result.stderr))
+    return statistics.median(samples) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark cold and warm one-shot command latency")
+    parser.add_argument("--runs", type=int, default=20)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(os.environ, DBBackend="sqlite", DBPath=os.path.join(tmp, "startup.db"),
+                   SchedulerSocket=os.path.join(tmp, "scheduler.sock"),
+                   SchedulerTokenFile=os.path.join(tmp, "session"))
+        seed(env["DBPath"])
+        search = "search_caregiver_schedule " + DAY.strftime("%m-%d-%Y")
+        python = sys.executable
+
+        results = {
+            "interpreter": timed(args.runs, [python, "-c", "pass"], env),
+            "import Scheduler": timed(args.runs, [python, "-c", "import Scheduler"], env),
+            "cold batch": timed(args.runs, [python, "Scheduler.py", "--batch", "-"], env,
+                                "login_patient bench_p bench\n" + search + "\n"),
+        }
+
+        daemon = subprocess.Popen([python, "Server.py", "--unix", env["SchedulerSocket"]], env=env, cwd=HERE,
+                                  stdout=subprocess.PIPE, text=True)
+        try:
+            daemon.stdout.readline()
+            timed(1, [python, "SchedulerClient.py", "login_patient", "bench_p", "bench"], env)
+            results["warm client"] = timed(args.runs, [python, "SchedulerClient.py"] + search.split(" "), env)
+        finally:
+            daemon.terminate()
+            daemon.wait()
+
+    for label, ms in results.items():
+        print(f"{label:18} {ms:8.1f} ms")
+    print(f"warm client is {results['cold batch'] / results['warm client']:.1f}x faster than a cold run")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,204 @@
+import datetime
+import os
+import threading
+import time
+import weakref
+from array import array
+from contextlib import contextmanager
+from db.ConnectionManager import ConnectionManager
+from db.Statements import run_statement
+
+
+def day_number(d):
+    # dates come back from the drivers as date or datetime
+    if isinstance(d, datetime.datetime):
+        d = d.date()
+    return d.toordinal()
+
+
+class AvailabilityIndex:
+    # An in-process calendar of the Availabilities table. Each caregiver's open dates are a
+    # bitset (a Python int, bit n = `base` + n days), `counts` holds the number of free
+    # caregivers per date and `open_days` has a bit for every date with at least one. It is
+    # loaded once and kept in step with add() and remove() after uploads, reservations and
+    # cancellations commit; changes from other processes are picked up after `ttl` seconds.
+    # As with InventoryCache, a reload that overlaps a write is discarded.
+    def __init__(self, ttl=None):
+        self.ttl = ttl if ttl is not None else float(os.getenv("AvailabilityTTL", "30"))
+        self._loaded = False
+        self._loaded_at = 0.0
+        self._version = 0
+        self._lock = threading.Lock()
+        self._reset()
+        self.hits = 0
+        self.misses = 0
+        self.loads = 0
+        self.discarded = 0
+
+    def add(self, username, d):
+        with self._lock:
+            self._version += 1
+            if self._loaded:
+                self._set(username, day_number(d))
+
+    def remove(self, username, d):
+        with self._lock:
+            self._version += 1
+            if self._loaded:
+                self._clear(username, day_number(d))
+
+    def invalidate(self):
+        with self._lock:
+            self._version += 1
+            self._loaded = False
+
+    def next_available(self, d, conn=None):
+        # (date, free caregivers) for the earliest date on or after d with a free caregiver,
+        # or None
+        with self._current(conn):
+            if self.base is None:
+                return None
+            offset = max(0, day_number(d) - self.base)
+            later = self.open_days >> offset
+            if not later:
+                return None
+            offset += (later & -later).bit_length() - 1
+            return datetime.date.fromordinal(self.base + offset), self.counts[offset]
+
+    def capacity(self, start, end, conn=None):
+        # [(date, free caregivers)] for the dates from start to end inclusive that have any,
+        # found by walking the set bits of open_days over the range
+        with self._current(conn):
+            if self.base is None:
+                return []
+            first = max(0, day_number(start) - self.base)
+            last = day_number(end) - self.base
+            if last < first:
+                return []
+            days = []
+            open_days = (self.open_days >> first) & ((1 << (last - first + 1)) - 1)
+            while open_days:
+                low = open_days & -open_days
+                offset = first + low.bit_length() - 1
+                days.append((datetime.date.fromordinal(self.base + offset), self.counts[offset]))
+                open_days ^= low
+            return days
+
+    def caregivers(self, d, conn=None):
+        # usernames free on d, in order
+        with self._current(conn):
+            if self.base is None:
+                return []
+            offset = day_number(d) - self.base
+            if offset < 0:
+                return []
+            return sorted(username for username, days in self.days.items() if days >> offset & 1)
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "loads": self.loads,
+                    "discarded": self.discarded, "caregivers": len(self.days),
+                    "open_dates": bin(self.open_days).count("1"), "slots": sum(self.counts)}
+
+    @contextmanager
+    def _current(self, conn):
+        # holds the lock over a copy no older than ttl
+        with self._lock:
+            self._refresh(conn)
+            yield
+
+    def _refresh(self, conn):
+        # called with the lock held, which is let go while the table is read
+        if self._loaded and time.monotonic() - self._loaded_at <= self.ttl:
+            self.hits += 1
+            return
+        self.misses += 1
+        for attempt in range(3):
+            version = self._version
+            self._lock.release()
+            try:
+                rows = self._load(conn)
+            finally:
+                self._lock.acquire()
+            self.loads += 1
+            # still racing writers after three reads: use the last one, it is at least as new
+            # as the copy, but load again on the next query
+            if version == self._version or attempt == 2:
+                self._reset()
+                for username, d in rows:
+                    self._set(username, day_number(d))
+                self._loaded = True
+                self._loaded_at = time.monotonic() if version == self._version else 0.0
+                return
+            self.discarded += 1
+
+    def _load(self, conn):
+        cm = None
+        if conn is None:
+            cm = ConnectionManager()
+            conn = cm.create_connection()
+        try:
+            return run_statement(conn, "availability.all").fetchall()
+        finally:
+            if cm is not None:
+                cm.close_connection()
+
+    # the rest is called with the lock held
+
+    def _reset(self):
+        self.base = None
+        self.days = {}
+        self.counts = array("I")
+        self.open_days = 0
+
+    def _offset(self, n):
+        if self.base is None:
+            self.base = n
+        elif n < self.base:
+            # a date before anything seen so far: move every bitset up to make room
+            shift = self.base - n
+            self.days = {username: days << shift for username, days in self.days.items()}
+            self.counts = array("I", bytes(shift * self.counts.itemsize)) + self.counts
+            self.open_days <<= shift
+            self.base = n
+        offset = n - self.base
+        if offset >= len(self.counts):
+            self.counts.extend([0] * (offset + 1 - len(self.counts)))
+        return offset
+
+    def _set(self, username, n):
+        offset = self._offset(n)
+        days = self.days.get(username, 0)
+        if not days >> offset & 1:
+            self.days[username] = days | 1 << offset
+            self.counts[offset] += 1
+            self.open_days |= 1 << offset
+
+    def _clear(self, username, n):
+        if self.base is None or n < self.base:
+            return
+        offset = n - self.base
+        days = self.days.get(username, 0)
+        if days >> offset & 1:
+            days &= ~(1 << offset)
+            if days:
+                self.days[username] = days
+            else:
+                del self.days[username]
+            self.counts[offset] -= 1
+            if not self.counts[offset]:
+                self.open_days &= ~(1 << offset)
+
+
+indexes = weakref.WeakKeyDictionary()
+indexes_lock = threading.Lock()
+
+
+def availability_index(backend):
+    # the process-wide availability index for `backend`
+    with indexes_lock:
+        index = indexes.get(backend)
+        if index is None:
+            index = AvailabilityIndex()
+            indexes[backend] = index
+        return index
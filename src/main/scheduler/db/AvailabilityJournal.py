@@ -0,0 +1,240 @@
+import atexit
+import datetime
+import glob
+import os
+import threading
+import time
+import weakref
+from db.AvailabilityIndex import availability_index
+from db.ConnectionManager import ConnectionManager
+
+
+class AvailabilityJournal:
+    # Write-behind for availability uploads. append() writes the rows to a local journal and
+    # fsyncs it before returning, so an upload is acknowledged once it is durable on disk
+    # rather than once it is committed. A flusher thread then inserts what has built up in
+    # one transaction of multi-row inserts, every `flush_ms` milliseconds or as soon as
+    # `flush_rows` rows are waiting, whichever comes first. Rows already in the table are
+    # skipped, so replaying rows that were flushed before is harmless.
+    #
+    # The journal is a series of segment files, <path>.<n>. The flusher starts a new segment
+    # before each flush and deletes the older ones once the flush has committed; whatever
+    # segments are found when a journal is opened did not make it, and are replayed first.
+    def __init__(self, backend, path, flush_ms=None, flush_rows=None, chunk_size=500):
+        self.backend = backend
+        self.path = path
+        self.flush_ms = flush_ms if flush_ms is not None else float(os.getenv("JournalFlushMs", "50"))
+        self.flush_rows = flush_rows if flush_rows is not None else int(os.getenv("JournalFlushRows", "500"))
+        self.chunk_size = chunk_size
+        self._lock = threading.Lock()
+        self._wake = threading.Condition(self._lock)
+        self._flushed = threading.Condition(self._lock)
+        # rows appended but not yet committed, and when the oldest of them was appended
+        self._pending = []
+        self._pending_since = None
+        self._stopped = False
+        self._flush_now = False
+        self.appended = 0
+        self.flushes = 0
+        self.flushed_rows = 0
+        self.failures = 0
+        self._segment = self._last_segment() + 1
+        self._file = self._open_segment(self._segment)
+        self.replayed = self._replay()
+        self.flusher = threading.Thread(target=self._run, name="availability-journal", daemon=True)
+        self.flusher.start()
+
+    def append(self, rows):
+        # journal (date, username) rows; returns once they are on disk
+        rows = list(rows)
+        data = "".join("%s\t%s\n" % (to_day(d).isoformat(), username) for d, username in rows)
+        with self._lock:
+            if self._stopped:
+                raise RuntimeError("Availability journal is closed")
+            self._file.write(data)
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            if not self._pending:
+                # the flusher sleeps while there is nothing to flush, wake it to start the clock
+                self._pending_since = time.monotonic()
+                self._wake.notify()
+            self._pending.extend(rows)
+            self.appended += len(rows)
+            if len(self._pending) >= self.flush_rows:
+                self._wake.notify()
+
+    def flush(self, timeout=None):
+        # wait until everything appended so far is committed; False if that took too long
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._lock:
+            target = self.appended
+            self._flush_now = True
+            self._wake.notify()
+            while self.flushed_rows < target:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if self._stopped or (remaining is not None and remaining <= 0):
+                    return False
+                self._flushed.wait(remaining)
+        return True
+
+    def close(self):
+        # flush what is left and stop the flusher
+        with self._lock:
+            if self._stopped:
+                return
+            self._stopped = True
+            self._wake.notify()
+        self.flusher.join()
+        self._file.close()
+        if not self._pending:
+            # everything is committed, leave no empty segment behind
+            self._remove_segments(before=self._segment + 1)
+
+    def stats(self):
+        with self._lock:
+            return {"appended": self.appended, "pending": len(self._pending), "flushes": self.flushes,
+                    "flushed_rows": self.flushed_rows, "failures": self.failures, "replayed": self.replayed}
+
+    def _run(self):
+        # flushes that failed in a row, each one waits twice as long before the next try
+        retries = 0
+        while True:
+            with self._lock:
+                while not self._stopped and not self._due():
+                    timeout = None
+                    if self._pending:
+                        timeout = max(0.0, self._pending_since + self.flush_ms / 1000 - time.monotonic())
+                    self._wake.wait(timeout)
+                if self._stopped and not self._pending:
+                    return
+                rows, self._pending = self._pending, []
+                self._pending_since = None
+                self._flush_now = False
+                # new appends go to a fresh segment, the ones being flushed can be dropped
+                # together once this batch commits
+                self._file.close()
+                self._segment += 1
+                self._file = self._open_segment(self._segment)
+                segment = self._segment
+            try:
+                self._write(rows)
+            except (Exception, SystemExit):
+                # the database is down or refused the batch: keep the rows and their segments,
+                # try again on the next round
+                with self._lock:
+                    self.failures += 1
+                    self._pending[:0] = rows
+                    if self._pending_since is None:
+                        self._pending_since = time.monotonic()
+                    stopped = self._stopped
+                if stopped:
+                    # closing with the database down: the segments are replayed on next start
+                    return
+                time.sleep(min(self.flush_ms / 1000 * 2 ** retries, 5.0))
+                retries = min(retries + 1, 16)
+                continue
+            retries = 0
+            self._remove_segments(before=segment)
+            with self._lock:
+                self.flushes += 1
+                self.flushed_rows += len(rows)
+                self._flushed.notify_all()
+
+    def _due(self):
+        # called with the lock held
+        if not self._pending:
+            return False
+        return (self._flush_now or len(self._pending) >= self.flush_rows
+                or time.monotonic() - self._pending_since >= self.flush_ms / 1000)
+
+    def _write(self, rows):
+        rows = list(dict.fromkeys((to_day(d), username) for d, username in rows))
+        # borrowed from the pool directly: create_connection() quits the process on an error,
+        # and the flusher has to outlive a database that is down
+        conn = ConnectionManager.get_pool().acquire(timeout=float(os.getenv("PoolTimeout", "30")))
+        try:
+            cursor = conn.cursor()
+            for start in range(0, len(rows), self.chunk_size):
+                chunk = rows[start:start + self.chunk_size]
+                insert = self.backend.insert_missing("Availabilities", ("Time", "Username"), len(chunk))
+                cursor.execute(insert, tuple(value for row in chunk for value in row))
+            conn.commit()
+        finally:
+            conn.close()
+        index = availability_index(self.backend)
+        for d, username in rows:
+            index.add(username, d)
+
+    def _replay(self):
+        # insert the rows of segments left over from a previous run, then delete them; if the
+        # database cannot take them now they are left to the flusher like any appended rows
+        segments = [(number, name) for number, name in self._segments() if number < self._segment]
+        rows = []
+        for _, name in segments:
+            with open(name, encoding="utf-8") as f:
+                for line in f:
+                    # a torn last line from a crash mid-append was never acknowledged
+                    if line.endswith("\n") and "\t" in line:
+                        d, username = line.rstrip("\n").split("\t", 1)
+                        rows.append((datetime.date.fromisoformat(d), username))
+        if rows:
+            try:
+                self._write(rows)
+            except (Exception, SystemExit):
+                self.failures += 1
+                self._pending = rows
+                self._pending_since = time.monotonic()
+                # counted as appended so that flush() waits for them too
+                self.appended = len(rows)
+                return len(rows)
+        for _, name in segments:
+            os.remove(name)
+        return len(rows)
+
+    def _segments(self):
+        # [(number, file name)] of the journal's segments, oldest first
+        segments = []
+        for name in glob.glob(glob.escape(self.path) + ".*"):
+            suffix = name[len(self.path) + 1:]
+            if suffix.isdigit():
+                segments.append((int(suffix), name))
+        return sorted(segments)
+
+    def _last_segment(self):
+        segments = self._segments()
+        return segments[-1][0] if segments else 0
+
+    def _open_segment(self, number):
+        return open("%s.%d" % (self.path, number), "a", encoding="utf-8")
+
+    def _remove_segments(self, before):
+        for number, name in self._segments():
+            if number < before:
+                os.remove(name)
+
+
+def to_day(d):
+    if isinstance(d, datetime.datetime):
+        return d.date()
+    return d
+
+
+journals = weakref.WeakKeyDictionary()
+journals_lock = threading.Lock()
+
+
+def availability_journal(backend):
+    # the process-wide availability journal for `backend`, or None when write-behind is off;
+    # it is on when AvailabilityJournal names the journal file. Opening it replays whatever a
+    # previous run left in the journal.
+    path = os.getenv("AvailabilityJournal")
+    if not path:
+        return None
+    with journals_lock:
+        journal = journals.get(backend)
+        if journal is None:
+            journal = AvailabilityJournal(backend, path)
+            journals[backend] = journal
+            # commit what is still waiting when the process exits normally
+            atexit.register(journal.close)
+        return journal
@@ -0,0 +1,290 @@
+import os
+import sys
+import time
+from db.StatementTrace import trace
+from util.Metrics import metrics
+
+
+class DatabaseError(Exception):
+    # raised in place of the driver's own exceptions, whichever backend is in use
+    pass
+
+
+class IntegrityError(DatabaseError):
+    # duplicate keys, broken foreign keys and other constraint violations
+    pass
+
+
+class Cursor:
+    # Wraps a driver cursor. Statements are written once in pymssql's %s / %d style and
+    # rewritten for the backend, and driver errors surface as DatabaseError.
+    def __init__(self, backend, cursor, as_dict=False):
+        self.backend = backend
+        self.as_dict = as_dict
+        self._cursor = cursor
+
+    def execute(self, operation, params=None):
+        try:
+            with metrics.phase("query"):
+                if params is None:
+                    self._cursor.execute(self.backend.sql(operation))
+                else:
+                    self._cursor.execute(self.backend.sql(operation), self.backend.params(params))
+        except self.backend.Error as e:
+            raise self.backend.translate_error(e) from e
+        return self
+
+    def executemany(self, operation, seq_of_params):
+        try:
+            with metrics.phase("query"):
+                self._cursor.executemany(self.backend.sql(operation),
+                                         [self.backend.params(params) for params in seq_of_params])
+        except self.backend.Error as e:
+            raise self.backend.translate_error(e) from e
+        return self
+
+    def fetchone(self):
+        return self._row(self._fetch(self._cursor.fetchone))
+
+    def fetchmany(self, size=1):
+        return [self._row(row) for row in self._fetch(self._cursor.fetchmany, size)]
+
+    def fetchall(self):
+        return [self._row(row) for row in self._fetch(self._cursor.fetchall)]
+
+    def __iter__(self):
+        while True:
+            row = self.fetchone()
+            if row is None:
+                return
+            yield row
+
+    @property
+    def rowcount(self):
+        return self._cursor.rowcount
+
+    @property
+    def description(self):
+        return self._cursor.description
+
+    def close(self):
+        self._cursor.close()
+
+    def _fetch(self, fetch, *args):
+        try:
+            with metrics.phase("fetch"):
+                return fetch(*args)
+        except self.backend.Error as e:
+            raise self.backend.translate_error(e) from e
+
+    def _row(self, row):
+        if row is None or not self.as_dict or isinstance(row, dict):
+            return row
+        return {column[0]: value for column, value in zip(self._cursor.description, row)}
+
+
+class TracingCursor(Cursor):
+    # A Cursor that hands each statement to the statement trace once it is done with: when
+    # its results have all been read, the next statement starts or the cursor is closed.
+    # Its time is the time spent in execute() and the fetches, not between them.
+    def __init__(self, backend, cursor, as_dict=False):
+        super().__init__(backend, cursor, as_dict)
+        self._operation = None
+
+    def execute(self, operation, params=None):
+        self._finish()
+        start = time.perf_counter()
+        try:
+            return super().execute(operation, params)
+        finally:
+            self._begin(operation, count_params(params), start, statement_caller())
+
+    def executemany(self, operation, seq_of_params):
+        self._finish()
+        seq_of_params = list(seq_of_params)
+        start = time.perf_counter()
+        try:
+            return super().executemany(operation, seq_of_params)
+        finally:
+            self._begin(operation, sum(count_params(params) for params in seq_of_params), start,
+                        statement_caller())
+
+    def close(self):
+        self._finish()
+        super().close()
+
+    def __del__(self):
+        # a cursor dropped half-read still counts; never raise from a finalizer
+        try:
+            self._finish()
+        except Exception:
+            pass
+
+    def _begin(self, operation, params, start, caller):
+        self._operation = operation
+        self._params = params
+        self._seconds = time.perf_counter() - start
+        self._rows = 0
+        self._fetched = False
+        self._site = (caller.f_code, caller.f_lineno)
+        self._command = metrics.current_command()
+
+    def _fetch(self, fetch, *args):
+        start = time.perf_counter()
+        result = super()._fetch(fetch, *args)
+        if self._operation is not None:
+            self._seconds += time.perf_counter() - start
+            self._fetched = True
+            if isinstance(result, list):
+                self._rows += len(result)
+                if not args or len(result) < args[0]:
+                    self._finish()
+            elif result is not None:
+                self._rows += 1
+            else:
+                self._finish()
+        return result
+
+    def _finish(self):
+        operation, self._operation = self._operation, None
+        if operation is None:
+            return
+        rows = self._rows
+        if not self._fetched:
+            # statements without a result set report the rows they changed
+            rows = max(self._cursor.rowcount or 0, 0)
+        code, line = self._site
+        site = "%s:%s:%d" % (os.path.basename(code.co_filename), code.co_name, line)
+        trace.record(operation, self._params, rows, self._seconds, self._command, site)
+
+
+def statement_caller():
+    # the frame that issued the statement being traced: the caller of execute(), or of
+    # db.Statements when the statement went through the registry on its behalf
+    frame = sys._getframe(2)
+    while frame.f_back is not None and os.path.basename(frame.f_code.co_filename) == "Statements.py":
+        frame = frame.f_back
+    return frame
+
+
+def count_params(params):
+    if params is None:
+        return 0
+    if isinstance(params, (tuple, list, dict)):
+        return len(params)
+    return 1
+
+
+class Connection:
+    def __init__(self, backend, conn):
+        self.backend = backend
+        self._conn = conn
+        # statement name -> the cursor kept for it, see db.Statements
+        self._statement_cursors = {}
+
+    def cursor(self, as_dict=False):
+        cursor_class = TracingCursor if trace.enabled else Cursor
+        return cursor_class(self.backend, self.backend.raw_cursor(self._conn, as_dict), as_dict)
+
+    def statement_cursor(self, name, as_dict=False):
+        # the cursor this connection keeps for the named statement, opened on first use
+        cursor = self._statement_cursors.get(name)
+        if cursor is None:
+            cursor = self._statement_cursors[name] = self.cursor(as_dict)
+        return cursor
+
+    def commit(self):
+        with metrics.phase("commit"):
+            self._call(self._conn.commit)
+
+    def rollback(self):
+        self._call(self._conn.rollback)
+
+    def close(self):
+        self._statement_cursors.clear()
+        self._call(self._conn.close)
+
+    def _call(self, method):
+        try:
+            method()
+        except self.backend.Error as e:
+            raise self.backend.translate_error(e) from e
+
+
+class Backend:
+    # A storage engine: how to open connections to it and how its SQL dialect differs
+    # from the T-SQL the scheduler's statements are written in.
+    name = None
+    # most connections worth opening at once, None for no limit beyond the pool size
+    max_connections = None
+    # engines that take one writer at a time give a lock for this process's writers to queue on
+    write_lock = None
+
+    # the driver's exception classes, filled in by each backend
+    Error = ()
+    DriverIntegrityError = ()
+
+    def connect(self):
+        raise NotImplementedError
+
+    def open(self):
+        try:
+            conn = self.connect()
+        except self.Error as e:
+            raise self.translate_error(e) from e
+        return Connection(self, conn)
+
+    def raw_cursor(self, conn, as_dict):
+        return conn.cursor()
+
+    def sql(self, operation):
+        return operation
+
+    def params(self, params):
+        return params
+
+    def begin(self, cursor):
+        # start a transaction explicitly where the driver does not do it implicitly
+        pass
+
+    def has_table(self, cursor, name):
+        raise NotImplementedError
+
+    def split_script(self, script):
+        # the statements or batches of a migration script, in the order they must run
+        raise NotImplementedError
+
+    def first_rows(self, select, n):
+        # `select` is a plain "SELECT ..." statement, return it limited to its first n rows
+        raise NotImplementedError
+
+    def random_order(self):
+        # an ORDER BY expression that shuffles the rows
+        raise NotImplementedError
+
+    def insert_missing(self, table, columns, rows, key=None):
+        # an INSERT of `rows` rows into `columns` that skips rows whose `key` columns (all of
+        # `columns` by default) are already present instead of failing on the duplicate key
+        raise NotImplementedError
+
+    def upsert_increment(self, table, key, column, rows):
+        # a single statement that adds each row's amount to `column` for an existing `key`,
+        # or inserts the row; parameters are (key, amount) pairs, keys must be distinct
+        raise NotImplementedError
+
+    def translate_error(self, e):
+        if isinstance(e, self.DriverIntegrityError):
+            return IntegrityError(e)
+        return DatabaseError(e)
+
+
+def backend_from_env():
+    # DBBackend picks the engine: "sqlserver" (the default) or "sqlite"
+    name = os.getenv("DBBackend", "sqlserver").lower()
+    if name in ("sqlserver", "mssql"):
+        from db.SqlServerBackend import SqlServerBackend
+        return SqlServerBackend()
+    if name == "sqlite":
+        from db.SqliteBackend import SqliteBackend
+        return SqliteBackend(os.getenv("DBPath", ":memory:"))
+    raise ValueError("Unknown database backend: " + name)
@@ -1,29 +1,74 @@
-import pymssql
 import os
+import threading
+from db.Backend import DatabaseError, backend_from_env
+from db.ConnectionPool import ConnectionPool
+from util.Metrics import metrics
 
 
 class ConnectionManager:
+    # every ConnectionManager borrows from one process-wide pool, so repeated
+    # create_connection() calls reuse connections instead of opening new ones
+    backend = None
+    pool = None
+    pool_lock = threading.Lock()
+    # one is kept per session, so instances carry nothing but the borrowed connection
+    __slots__ = ("conn",)
 
     def __init__(self):
-        self.server_name = os.getenv("Server") + ".database.windows.net"
-        self.db_name = os.getenv("DBName")
-        self.user = os.getenv("UserID")
-        self.password = os.getenv("Password")
         self.conn = None
 
+    @classmethod
+    def get_backend(cls):
+        with cls.pool_lock:
+            if cls.backend is None:
+                cls.backend = backend_from_env()
+            return cls.backend
+
+    @classmethod
+    def get_pool(cls):
+        backend = cls.get_backend()
+        with cls.pool_lock:
+            if cls.pool is None:
+                size = int(os.getenv("PoolSize", "5"))
+                if backend.max_connections is not None:
+                    size = min(size, backend.max_connections)
+                cls.pool = ConnectionPool(backend.open, max_size=size,
+                                          idle_timeout=float(os.getenv("PoolIdleTimeout", "300")))
+            return cls.pool
+
+    @classmethod
+    def set_pool(cls, pool):
+        # swap in another pool, e.g. one built on a stand-in driver; the old one is drained
+        with cls.pool_lock:
+            old, cls.pool = cls.pool, pool
+        if old is not None:
+            old.close_all()
+
+    @classmethod
+    def set_backend(cls, backend):
+        # switch storage engines; connections to the previous one are closed
+        with cls.pool_lock:
+            cls.backend = backend
+        cls.set_pool(None)
+
     def create_connection(self):
         try:
-            self.conn = pymssql.connect(server=self.server_name, user=self.user, password=self.password, database=self.db_name)
-        except pymssql.Error as db_err:
+            with metrics.phase("connect"):
+                self.conn = ConnectionManager.get_pool().acquire(timeout=float(os.getenv("PoolTimeout", "30")))
+        except DatabaseError as db_err:
             print("Database Programming Error in SQL connection processing! ")
             print(db_err)
             quit()
         return self.conn
 
     def close_connection(self):
+        if self.conn is None:
+            return
         try:
             self.conn.close()
-        except pymssql.Error as db_err:
+        except DatabaseError as db_err:
             print("Database Programming Error in SQL connection processing! ")
             print(db_err)
             quit()
+        finally:
+            self.conn = None
@@ -0,0 +1,206 @@
+import threading
+import time
+from collections import deque
+from db.Backend import DatabaseError
+
+
+class PoolTimeoutError(DatabaseError):
+    # an exhausted or closed pool is handled like any other failure to reach the database
+    pass
+
+
+class PooledConnection:
+    # Handed out by ConnectionPool.acquire(). close() gives the connection back to the
+    # pool instead of disconnecting, so existing `conn.close()` call sites keep working.
+    def __init__(self, pool, conn):
+        self._pool = pool
+        self._conn = conn
+
+    def cursor(self, *args, **kwargs):
+        return self._conn.cursor(*args, **kwargs)
+
+    def commit(self):
+        self._conn.commit()
+
+    def rollback(self):
+        self._conn.rollback()
+
+    def close(self):
+        # closing twice is a no-op, the second call has nothing left to return
+        if self._conn is not None:
+            conn, self._conn = self._conn, None
+            self._pool.release(conn)
+
+    def __getattr__(self, name):
+        if self._conn is None:
+            raise AttributeError("connection has already been returned to the pool")
+        return getattr(self._conn, name)
+
+
+def ping_connection(conn):
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT 1")
+        cursor.fetchall()
+    finally:
+        cursor.close()
+
+
+class ConnectionPool:
+    # A bounded pool of driver connections.
+    #   connect      -- zero-argument callable that opens a new driver connection
+    #   max_size     -- most connections open at once (idle + checked out)
+    #   max_idle     -- most connections kept around once returned, the rest are closed
+    #   idle_timeout -- seconds an idle connection may sit before it is evicted
+    #   ping_after   -- idle connections older than this are checked with `ping` before reuse
+    def __init__(self, connect, max_size=5, max_idle=None, idle_timeout=300.0, ping_after=30.0,
+                 ping=ping_connection):
+        if max_size <= 0:
+            raise ValueError("Pool size must be positive!")
+        self.connect = connect
+        self.max_size = max_size
+        self.max_idle = max_size if max_idle is None else max_idle
+        self.idle_timeout = idle_timeout
+        self.ping_after = ping_after
+        self.ping = ping
+
+        self._cond = threading.Condition()
+        # (connection, idle since); reuse from the right so the left end holds the stalest ones
+        self._idle = deque()
+        self._size = 0
+        self._closed = False
+
+        self.opened = 0
+        self.closed = 0
+        self.checkouts = 0
+        self.evicted = 0
+        self.broken = 0
+        self.waits = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def acquire(self, timeout=None):
+        start = time.monotonic()
+        waited = False
+        while True:
+            conn = None
+            idle_since = None
+            with self._cond:
+                while True:
+                    if self._closed:
+                        raise PoolTimeoutError("Connection pool is closed")
+                    self._evict_idle(time.monotonic())
+                    if self._idle:
+                        conn, idle_since = self._idle.pop()
+                        break
+                    if self._size < self.max_size:
+                        # reserve the slot now, the connection is opened outside the lock
+                        self._size += 1
+                        break
+                    remaining = None
+                    if timeout is not None:
+                        remaining = timeout - (time.monotonic() - start)
+                        if remaining <= 0:
+                            self._record_wait(start, waited)
+                            raise PoolTimeoutError("Timed out waiting for a database connection")
+                    waited = True
+                    self._cond.wait(remaining)
+
+            if conn is None:
+                try:
+                    conn = self.connect()
+                except BaseException:
+                    with self._cond:
+                        self._size -= 1
+                        self._cond.notify()
+                    raise
+                with self._cond:
+                    self.opened += 1
+            elif time.monotonic() - idle_since > self.ping_after and not self._alive(conn):
+                # the server dropped it while it sat idle, try the next one
+                continue
+
+            with self._cond:
+                self.checkouts += 1
+                self._record_wait(start, waited)
+            return PooledConnection(self, conn)
+
+    def release(self, conn):
+        discard = False
+        try:
+            # never hand the next borrower someone else's half-finished transaction
+            conn.rollback()
+        except Exception:
+            discard = True
+        with self._cond:
+            if discard:
+                self.broken += 1
+            if discard or self._closed or len(self._idle) >= self.max_idle:
+                self._size -= 1
+                self._close(conn)
+            else:
+                self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+
+    def close_all(self):
+        with self._cond:
+            self._closed = True
+            while self._idle:
+                conn, _ = self._idle.popleft()
+                self._size -= 1
+                self._close(conn)
+            self._cond.notify_all()
+
+    def stats(self):
+        with self._cond:
+            idle = len(self._idle)
+            return {
+                "size": self._size,
+                "idle": idle,
+                "in_use": self._size - idle,
+                "max_size": self.max_size,
+                "opened": self.opened,
+                "closed": self.closed,
+                "checkouts": self.checkouts,
+                "evicted": self.evicted,
+                "broken": self.broken,
+                "waits": self.waits,
+                "total_wait": self.total_wait,
+                "max_wait": self.max_wait,
+            }
+
+    def _alive(self, conn):
+        try:
+            self.ping(conn)
+            return True
+        except Exception:
+            with self._cond:
+                self.broken += 1
+                self._size -= 1
+                self._close(conn)
+                self._cond.notify()
+            return False
+
+    def _evict_idle(self, now):
+        # caller holds the lock
+        while self._idle and now - self._idle[0][1] > self.idle_timeout:
+            conn, _ = self._idle.popleft()
+            self._size -= 1
+            self.evicted += 1
+            self._close(conn)
+
+    def _close(self, conn):
+        # caller holds the lock
+        self.closed += 1
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def _record_wait(self, start, waited):
+        # caller holds the lock
+        if waited:
+            elapsed = time.monotonic() - start
+            self.waits += 1
+            self.total_wait += elapsed
+            self.max_wait = max(self.max_wait, elapsed)
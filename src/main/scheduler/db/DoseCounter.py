@@ -0,0 +1,179 @@
+import os
+import random
+import threading
+import weakref
+from contextlib import nullcontext
+from db.Backend import DatabaseError
+from db.ConnectionManager import ConnectionManager
+from db.Statements import execute_statement
+
+# T-SQL for the reservation batch: take one dose of @vaccine and set @taken to 1 if there was one
+SQLSERVER_TAKE = """
+UPDATE Vaccines SET Doses = Doses - 1 WHERE Name = @vaccine AND Doses > 0;
+SET @taken = @@ROWCOUNT;
+"""
+
+# the same spread over the shards: the shard picked by the caller first, then any shard that
+# is not locked by another booking, then the Vaccines row
+SQLSERVER_TAKE_SHARDED = """
+UPDATE DoseShards SET Doses = Doses - 1 WHERE Name = @vaccine AND Shard = @shard AND Doses > 0;
+SET @taken = @@ROWCOUNT;
+IF @taken = 0
+BEGIN
+    UPDATE DoseShards SET Doses = Doses - 1 WHERE Name = @vaccine AND Doses > 0 AND Shard = (
+        SELECT TOP 1 Shard FROM DoseShards WITH (READPAST) WHERE Name = @vaccine AND Doses > 0);
+    SET @taken = @@ROWCOUNT;
+END
+IF @taken = 0
+BEGIN
+    UPDATE Vaccines SET Doses = Doses - 1 WHERE Name = @vaccine AND Doses > 0;
+    SET @taken = @@ROWCOUNT;
+END
+"""
+
+
+class DoseCounter:
+    # Takes and returns doses inside the caller's transaction. With `shards` = 0 (DoseShards
+    # unset) every booking updates the vaccine's Vaccines row, as before. With N shards each
+    # booking decrements one of N DoseShards rows picked at random, so concurrent bookings
+    # for the same vaccine mostly lock different rows; a shard that has run dry falls back to
+    # any other shard and then to the Vaccines row. New stock always lands on the Vaccines
+    # row and rebalance() spreads it over the shards.
+    def __init__(self, backend, shards=None):
+        self.backend = backend
+        self.shards = shards if shards is not None else int(os.getenv("DoseShards", "0"))
+        self.fallbacks = 0
+        self.moved = 0
+        self.rebalancer = None
+
+    def sqlserver_take(self):
+        return SQLSERVER_TAKE_SHARDED if self.shards else SQLSERVER_TAKE
+
+    def pick_shard(self):
+        return random.randrange(self.shards) if self.shards else 0
+
+    def take(self, cursor, vaccine_name, shard=None):
+        # True if a dose was taken, False if the vaccine has none left
+        if self.shards:
+            execute_statement(cursor, "dose_shard.take",
+                              (vaccine_name, self.pick_shard() if shard is None else shard))
+            if cursor.rowcount:
+                return True
+            self.fallbacks += 1
+            execute_statement(cursor, "dose_shard.take_any", (vaccine_name, vaccine_name))
+            if cursor.rowcount:
+                return True
+        execute_statement(cursor, "doses.take", (vaccine_name,))
+        return cursor.rowcount > 0
+
+    def give(self, cursor, vaccine_name):
+        # a cancelled booking's dose goes back to a random shard, or the Vaccines row
+        if self.shards:
+            execute_statement(cursor, "dose_shard.give", (vaccine_name, self.pick_shard()))
+            if cursor.rowcount:
+                return
+        execute_statement(cursor, "doses.give", (vaccine_name,))
+
+    def rebalance(self, conn):
+        # Evens out each vaccine's shards, moving stock through its Vaccines row, in one
+        # transaction. Every move is a pair of relative updates guarded against going below
+        # zero, so bookings running meanwhile can only make a move smaller, never lose or
+        # create doses. Returns the number of doses moved.
+        if not self.shards:
+            return 0
+        cursor = conn.cursor()
+        moved = 0
+        with self.backend.write_lock or nullcontext():
+            moved = self._rebalance(conn, cursor)
+        self.moved += moved
+        return moved
+
+    def _rebalance(self, conn, cursor):
+        moved = 0
+        try:
+            self.backend.begin(cursor)
+            execute_statement(cursor, "vaccine.names")
+            names = [row[0] for row in cursor.fetchall()]
+            for name in names:
+                # shards that do not exist yet start out empty
+                rows = [(name, shard, 0) for shard in range(self.shards)]
+                cursor.execute(self.backend.insert_missing("DoseShards", ("Name", "Shard", "Doses"), len(rows),
+                                                           key=("Name", "Shard")),
+                               tuple(value for row in rows for value in row))
+                execute_statement(cursor, "dose_shards.of_vaccine", (name, self.shards))
+                shards = dict(cursor.fetchall())
+                execute_statement(cursor, "vaccine.spare", (name,))
+                spare = cursor.fetchone()[0]
+                target = (spare + sum(shards.values())) // self.shards
+                # drain the fullest shards first, then fill the emptiest from the Vaccines row
+                for shard, doses in sorted(shards.items(), key=lambda item: -item[1]):
+                    if doses > target:
+                        moved += self._move(cursor, name, shard, target - doses)
+                for shard, doses in sorted(shards.items(), key=lambda item: item[1]):
+                    if doses < target:
+                        moved += self._move(cursor, name, shard, target - doses)
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        return moved
+
+    def _move(self, cursor, name, shard, delta):
+        # delta > 0 moves stock from the Vaccines row into the shard, delta < 0 back again;
+        # the side that gives is updated first and only if it still has the doses
+        if delta > 0:
+            execute_statement(cursor, "doses.move_out", (delta, name, delta))
+            if not cursor.rowcount:
+                return 0
+            execute_statement(cursor, "dose_shard.move_in", (delta, name, shard))
+        else:
+            execute_statement(cursor, "dose_shard.move_out", (-delta, name, shard, -delta))
+            if not cursor.rowcount:
+                return 0
+            execute_statement(cursor, "doses.move_in", (-delta, name))
+        return abs(delta)
+
+
+class DoseRebalancer(threading.Thread):
+    # Calls DoseCounter.rebalance() every `interval` seconds until stop()
+    def __init__(self, counter, interval):
+        super().__init__(name="dose-rebalancer", daemon=True)
+        self.counter = counter
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.runs = 0
+        self.errors = 0
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            cm = ConnectionManager()
+            try:
+                self.counter.rebalance(cm.create_connection())
+                self.runs += 1
+            except DatabaseError:
+                # a busy database: try again next round
+                self.errors += 1
+            finally:
+                cm.close_connection()
+
+    def stop(self):
+        self.stopped.set()
+
+
+counters = weakref.WeakKeyDictionary()
+counters_lock = threading.Lock()
+
+
+def dose_counter(backend):
+    # the process-wide dose counter for `backend`; in sharded mode its rebalancer is started
+    # with it, every RebalanceInterval seconds (0 to leave rebalancing to the caller)
+    with counters_lock:
+        counter = counters.get(backend)
+        if counter is None:
+            counter = DoseCounter(backend)
+            interval = float(os.getenv("RebalanceInterval", "5"))
+            if counter.shards and interval > 0:
+                counter.rebalancer = DoseRebalancer(counter, interval)
+                counter.rebalancer.start()
+            counters[backend] = counter
+        return counter
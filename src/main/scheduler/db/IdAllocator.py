@@ -0,0 +1,93 @@
+import os
+import threading
+import weakref
+from db.Statements import execute_statement
+
+
+class IdAllocator:
+    # Hands out unique ids for one table in blocks: a round trip to the database reserves
+    # `block_size` ids at once and next_id() serves them from memory until the block runs out.
+    # Ids are unique across processes but not gap free; unused ids in a block are dropped when
+    # the process exits.
+    def __init__(self, backend, name, table, column, block_size):
+        if block_size <= 0:
+            raise ValueError("Block size must be positive!")
+        self.backend = backend
+        self.name = name
+        self.table = table
+        self.column = column
+        self.block_size = block_size
+        self.blocks = 0
+        self._next = 0
+        self._limit = 0
+        self._lock = threading.Lock()
+
+    def next_id(self, conn):
+        # `conn` must not be in the middle of a transaction: fetching a new block commits
+        # straight away so the block stays taken even if the caller later rolls back
+        with self._lock:
+            if self._next >= self._limit:
+                self._next = self.allocate_block(conn)
+                self._limit = self._next + self.block_size
+                self.blocks += 1
+            allocated = self._next
+            self._next += 1
+            return allocated
+
+    def allocate_block(self, conn):
+        # reserve block_size ids and return the first one
+        raise NotImplementedError
+
+
+class SequenceIdAllocator(IdAllocator):
+    # SQL Server: the AppointmentIds SEQUENCE from migration 0004, with sp_sequence_get_range
+    # reserving a whole block in one call
+    def allocate_block(self, conn):
+        cursor = conn.cursor()
+        cursor.execute("""
+SET NOCOUNT ON;
+DECLARE @first sql_variant;
+EXEC sp_sequence_get_range @sequence_name = N'{name}', @range_size = %d, @range_first_value = @first OUTPUT;
+SELECT CAST(@first AS int);
+""".format(name=self.name), (self.block_size,))
+        first = cursor.fetchone()[0]
+        conn.commit()
+        return first
+
+
+class HiLoIdAllocator(IdAllocator):
+    # Embedded backends: an IdBlocks row (migration 0004) per allocator holds the next unreserved id
+    def allocate_block(self, conn):
+        cursor = conn.cursor()
+        self.backend.begin(cursor)
+        try:
+            execute_statement(cursor, "id_block.get", (self.name,))
+            row = cursor.fetchone()
+            if row is None:
+                cursor.execute("SELECT max({column}) FROM {table}".format(column=self.column, table=self.table))
+                first = (cursor.fetchone()[0] or 0) + 1
+                execute_statement(cursor, "id_block.insert", (self.name, first + self.block_size))
+            else:
+                first = row[0]
+                execute_statement(cursor, "id_block.advance", (self.block_size, self.name))
+        except BaseException:
+            conn.rollback()
+            raise
+        conn.commit()
+        return first
+
+
+allocators = weakref.WeakKeyDictionary()
+allocators_lock = threading.Lock()
+
+
+def appointment_ids(backend):
+    # the process-wide allocator for Appointments.appointment_id on `backend`
+    with allocators_lock:
+        allocator = allocators.get(backend)
+        if allocator is None:
+            cls = SequenceIdAllocator if backend.name == "sqlserver" else HiLoIdAllocator
+            allocator = cls(backend, "AppointmentIds", "Appointments", "appointment_id",
+                            int(os.getenv("IdBlockSize", "50")))
+            allocators[backend] = allocator
+        return allocator
@@ -0,0 +1,102 @@
+import os
+import threading
+import time
+import weakref
+from db.ConnectionManager import ConnectionManager
+from db.Statements import run_statement
+
+
+class InventoryCache:
+    # An in-process copy of each vaccine's total stock (see DoseCounter). It is loaded once and then kept current
+    # write-through: every committed change to Doses made from this process is applied with
+    # apply(). Changes made by other processes are picked up when the copy is older than
+    # `ttl` seconds. A write that lands while a reload is reading the table bumps the version
+    # stamp, and the reload is then thrown away instead of installed, because it may or may
+    # not already include that write.
+    def __init__(self, ttl=None):
+        self.ttl = ttl if ttl is not None else float(os.getenv("InventoryTTL", "5"))
+        self._doses = None
+        self._loaded_at = 0.0
+        self._version = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.loads = 0
+        self.discarded = 0
+
+    def snapshot(self, conn=None):
+        # [(name, doses)] ordered by name
+        doses = self._current(conn)
+        return sorted(doses.items())
+
+    def doses(self, vaccine_name, conn=None):
+        # cached doses for one vaccine, None if there is no such vaccine
+        return self._current(conn).get(vaccine_name)
+
+    def apply(self, vaccine_name, delta):
+        # call after the change has been committed
+        with self._lock:
+            self._version += 1
+            if self._doses is None:
+                return
+            if vaccine_name in self._doses:
+                self._doses[vaccine_name] += delta
+            else:
+                # a vaccine this copy has not seen: its stock is whatever the table says
+                self._doses = None
+
+    def invalidate(self):
+        with self._lock:
+            self._version += 1
+            self._doses = None
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "loads": self.loads,
+                    "discarded": self.discarded, "vaccines": len(self._doses or ()),
+                    "age": time.monotonic() - self._loaded_at if self._doses is not None else None}
+
+    def _current(self, conn):
+        with self._lock:
+            if self._doses is not None and time.monotonic() - self._loaded_at <= self.ttl:
+                self.hits += 1
+                return self._doses
+            self.misses += 1
+        for _ in range(3):
+            with self._lock:
+                version = self._version
+            doses = self._load(conn)
+            with self._lock:
+                self.loads += 1
+                if version == self._version:
+                    self._doses = doses
+                    self._loaded_at = time.monotonic()
+                    return doses
+                self.discarded += 1
+        # still racing writers: answer this read from the fresh copy without keeping it
+        return doses
+
+    def _load(self, conn):
+        cm = None
+        if conn is None:
+            cm = ConnectionManager()
+            conn = cm.create_connection()
+        try:
+            return {name: doses for name, doses in run_statement(conn, "vaccine.all").fetchall()}
+        finally:
+            if cm is not None:
+                cm.close_connection()
+
+
+caches = weakref.WeakKeyDictionary()
+caches_lock = threading.Lock()
+
+
+def inventory(backend):
+    # the process-wide inventory cache for `backend`
+    with caches_lock:
+        cache = caches.get(backend)
+        if cache is None:
+            cache = InventoryCache()
+            caches[backend] = cache
+        return cache
@@ -0,0 +1,71 @@
+import os
+import re
+from db.Statements import execute_statement
+
+MIGRATIONS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "resources", "migrations")
+
+# NNNN_name.sql, or NNNN_name.<backend>.sql for a version that differs per backend
+MIGRATION_FILE = re.compile(r"^(\d+)_(\w+?)(?:\.(\w+))?\.sql$")
+
+
+class MigrationRunner:
+    # Owns the schema: applies the numbered scripts in resources/migrations in order, each in
+    # its own transaction, and records them in SchemaVersions. A version may ship one script
+    # for every backend or one per backend (e.g. 0003_x.sqlserver.sql and 0003_x.sqlite.sql).
+    def __init__(self, backend, directory=MIGRATIONS):
+        self.backend = backend
+        self.directory = directory
+
+    def migrations(self):
+        # [(version, name, path)] for this backend, in version order
+        found = {}
+        for file_name in os.listdir(self.directory):
+            match = MIGRATION_FILE.match(file_name)
+            if match is None:
+                continue
+            version, name, dialect = int(match.group(1)), match.group(2), match.group(3)
+            if dialect is not None and dialect != self.backend.name:
+                continue
+            # a backend-specific script wins over the shared one
+            if dialect is not None or version not in found:
+                found[version] = (version, name, os.path.join(self.directory, file_name))
+        return [found[version] for version in sorted(found)]
+
+    def applied(self, conn):
+        cursor = conn.cursor()
+        if not self.backend.has_table(cursor, "SchemaVersions"):
+            return set()
+        execute_statement(cursor, "schema_version.all")
+        return {row[0] for row in cursor.fetchall()}
+
+    def pending(self, conn):
+        applied = self.applied(conn)
+        return [migration for migration in self.migrations() if migration[0] not in applied]
+
+    def migrate(self, conn, target=None):
+        # apply every pending migration up to `target` (all by default); returns their names
+        cursor = conn.cursor()
+        if not self.backend.has_table(cursor, "SchemaVersions"):
+            cursor.execute("CREATE TABLE SchemaVersions (Version int, Name varchar(255), PRIMARY KEY (Version))")
+            # databases set up by hand from the original create.sql already have the tables
+            if self.backend.has_table(cursor, "Caregivers"):
+                execute_statement(cursor, "schema_version.insert", (1, "create_tables"))
+            conn.commit()
+
+        applied = []
+        for version, name, path in self.pending(conn):
+            if target is not None and version > target:
+                break
+            with open(path) as f:
+                script = f.read()
+            self.backend.begin(cursor)
+            try:
+                for statement in self.backend.split_script(script):
+                    cursor.execute(statement)
+                execute_statement(cursor, "schema_version.insert", (version, name))
+                conn.commit()
+            except BaseException:
+                conn.rollback()
+                raise
+            applied.append("%04d_%s" % (version, name))
+        return applied
@@ -0,0 +1,186 @@
+import os
+import textwrap
+from db.IdAllocator import appointment_ids
+from db.InventoryCache import inventory
+from db.AvailabilityIndex import availability_index
+from db.DoseCounter import dose_counter
+from db.Statements import execute_statement
+
+RESERVED = 0
+NO_CAREGIVER = 1
+NO_DOSES = 2
+
+# How a reservation picks among the caregivers free on its date:
+#   ordered      -- alphabetically, so concurrent reservers all go for the same first rows
+#   random       -- shuffled, so concurrent reservers spread over the free caregivers
+#   least_loaded -- fewest appointments first, which also evens out the caregivers' work
+STRATEGIES = ("ordered", "random", "least_loaded")
+
+# One batch: claim a caregiver slot, take a dose and write the appointment; the client rolls
+# the batch back unless it reports success, which puts a claimed slot back. The final SELECT
+# carries the outcome back in the same round trip.
+SQLSERVER_RESERVE = """
+SET NOCOUNT ON;
+DECLARE @time date = %s, @vaccine varchar(255) = %s, @patient varchar(255) = %s, @appointment_id int = %d;
+DECLARE @shard int = %d, @caregiver varchar(255), @candidate varchar(255), @taken int;
+
+{claim}
+IF @caregiver IS NULL
+BEGIN
+    SELECT 1, NULL, NULL;
+    RETURN;
+END
+
+{take_dose}
+IF @taken = 0
+BEGIN
+    SELECT 2, NULL, NULL;
+    RETURN;
+END
+
+INSERT INTO Appointments (appointment_id, vaccine_name, Time, CUsername, PUsername)
+    VALUES (@appointment_id, @vaccine, @time, @caregiver, @patient);
+SELECT 0, @appointment_id, @caregiver;
+"""
+
+# The first free slot in primary key (Time, Username) order. The TOP 1 is a seek on that key,
+# so UPDLOCK locks the one row it returns, and READPAST makes concurrent reservers skip slots
+# another transaction has already locked instead of queueing behind it.
+SQLSERVER_CLAIM_FIRST = """
+SELECT TOP 1 @caregiver = Username
+    FROM Availabilities WITH (UPDLOCK, READPAST, ROWLOCK)
+    WHERE Time = @time
+    ORDER BY Username;
+IF @caregiver IS NOT NULL
+    DELETE FROM Availabilities WHERE Time = @time AND Username = @caregiver;
+"""
+
+# Any other order has to read and sort every slot of the date, which must not happen under
+# UPDLOCK: it would lock them all and leave concurrent reservers nothing to READPAST to. The
+# candidate is picked without locks and claimed by a delete that skips a locked row; when
+# another reservation got to it first, the first free slot is taken instead.
+SQLSERVER_CLAIM_SPREAD = """
+SELECT TOP 1 @candidate = Username
+    FROM Availabilities WITH (READPAST)
+    WHERE Time = @time
+    ORDER BY {order};
+IF @candidate IS NOT NULL
+BEGIN
+    DELETE FROM Availabilities WITH (ROWLOCK, READPAST) WHERE Time = @time AND Username = @candidate;
+    IF @@ROWCOUNT = 1
+        SET @caregiver = @candidate;
+END
+IF @caregiver IS NULL
+BEGIN
+""" + textwrap.indent(SQLSERVER_CLAIM_FIRST.strip(), "    ") + """
+END
+"""
+
+# slots an embedded-backend reservation lines up before it takes the write lock
+CANDIDATES = 4
+
+
+def claim_order(backend, strategy):
+    # the ORDER BY expression for Availabilities rows under `strategy`
+    if strategy == "ordered":
+        return "Username"
+    if strategy == "random":
+        return backend.random_order()
+    if strategy == "least_loaded":
+        # counted through the Appointments (CUsername) index from migration 0003
+        return "(SELECT COUNT(*) FROM Appointments a WHERE a.CUsername = Availabilities.Username), Username"
+    raise ValueError("Unknown claim strategy: " + strategy)
+
+
+class ReservationEngine:
+    # Books an appointment atomically: either the slot, the dose and the appointment row
+    # all change together, or nothing does. reserve() returns (status, appointment_id, caregiver).
+    # Doses and slots taken are applied to the process-wide inventory cache and availability
+    # index once committed. `strategy` (ClaimStrategy, "ordered" by default) is one of
+    # STRATEGIES; whichever is used, no two reservations ever get the same slot.
+    def __init__(self, backend, strategy=None):
+        self.backend = backend
+        self.strategy = strategy or os.getenv("ClaimStrategy", "ordered")
+        self.order = claim_order(backend, self.strategy)
+        self.ids = appointment_ids(backend)
+        self.inventory = inventory(backend)
+        self.availability = availability_index(backend)
+        self.doses = dose_counter(backend)
+        claim = SQLSERVER_CLAIM_FIRST if self.strategy == "ordered" else SQLSERVER_CLAIM_SPREAD.format(order=self.order)
+        self.batch = SQLSERVER_RESERVE.format(claim=claim.strip(), take_dose=self.doses.sqlserver_take().strip())
+        self.claim = self.backend.first_rows(
+            "SELECT Username FROM Availabilities WHERE Time = %s ORDER BY " + self.order, CANDIDATES)
+        # candidates another reservation took first, a measure of how much claimers collide
+        self.conflicts = 0
+
+    def reserve(self, conn, d, vaccine, patient):
+        if not self.inventory.doses(vaccine, conn):
+            # out of stock as far as the cache knows, which is never older than its TTL;
+            # the booking transaction would only be rolled back
+            return NO_DOSES, None, None
+        # usually served from the in-process block; an id left unused by a failed attempt is a gap
+        appointment_id = self.ids.next_id(conn)
+        if self.backend.name == "sqlserver":
+            return self._finish(conn, d, vaccine, self._reserve_batch(conn, d, vaccine, patient, appointment_id))
+
+        # An embedded database has one writer at a time and no row locks to skip, so the
+        # candidates are read first, outside the write lock where readers do not block each other
+        cursor = conn.cursor()
+        cursor.execute(self.claim, (d,))
+        candidates = [row[0] for row in cursor.fetchall()]
+        if not candidates:
+            return NO_CAREGIVER, None, None
+        with self.backend.write_lock:
+            return self._finish(conn, d, vaccine,
+                                self._reserve_local(conn, d, vaccine, patient, appointment_id, candidates))
+
+    def _finish(self, conn, d, vaccine, result):
+        if result[0] == RESERVED:
+            conn.commit()
+            self.inventory.apply(vaccine, -1)
+            self.availability.remove(result[2], d)
+        else:
+            conn.rollback()
+        return result
+
+    def _reserve_batch(self, conn, d, vaccine, patient, appointment_id):
+        cursor = conn.cursor()
+        try:
+            cursor.execute(self.batch, (d, vaccine, patient, appointment_id, self.doses.pick_shard()))
+            status, appointment_id, caregiver = cursor.fetchone()
+        except BaseException:
+            conn.rollback()
+            raise
+        return status, appointment_id, caregiver
+
+    def _reserve_local(self, conn, d, vaccine, patient, appointment_id, candidates):
+        # Each candidate is claimed by deleting its row under the write lock: a delete that
+        # finds nothing means another reservation got there first, and the next one is tried.
+        cursor = conn.cursor()
+        cursor.execute("BEGIN IMMEDIATE")
+        try:
+            caregiver = None
+            for candidate in candidates:
+                execute_statement(cursor, "availability.claim", (d, candidate))
+                if cursor.rowcount:
+                    caregiver = candidate
+                    break
+                self.conflicts += 1
+            if caregiver is None:
+                # all of them went to other reservations meanwhile, take any slot that is left
+                cursor.execute(self.backend.first_rows(
+                    "SELECT Username FROM Availabilities WHERE Time = %s ORDER BY " + self.order, 1), (d,))
+                row = cursor.fetchone()
+                if row is None:
+                    return NO_CAREGIVER, None, None
+                caregiver = row[0]
+                execute_statement(cursor, "availability.claim", (d, caregiver))
+
+            if not self.doses.take(cursor, vaccine):
+                return NO_DOSES, None, None
+
+            execute_statement(cursor, "appointment.insert", (appointment_id, vaccine, d, caregiver, patient))
+        except BaseException:
+            conn.rollback()
+            raise
+        return RESERVED, appointment_id, caregiver
@@ -0,0 +1,65 @@
+import datetime
+import os
+
+# keyset pagination over the (Time, Username) primary key: each page starts right after the
+# last row of the one before, so no page costs more than its own rows however deep it is.
+# The plain range on Time is what lets the index seek straight to the start of the page;
+# the OR alone would have it scan from the first row every time.
+SEARCH_PAGE = """SELECT Time, Username FROM Availabilities
+WHERE Time BETWEEN %s AND %s AND (Time > %s OR (Time = %s AND Username > %s))
+ORDER BY Time, Username"""
+
+
+class ScheduleSearch:
+    # Streams the free caregivers between two dates, one page at a time. rows() reads the
+    # page in fetchmany() batches, so memory stays flat however many rows match. The page
+    # after it is resumed from a continuation token that carries the range and the last key.
+    def __init__(self, backend, page_size=None, batch_size=100):
+        self.backend = backend
+        self.page_size = page_size if page_size is not None else int(os.getenv("SearchPageSize", "200"))
+        self.batch_size = batch_size
+        self.next_token = None
+
+    def rows(self, conn, start, end, after=None):
+        # (date, username) rows from the page that starts after `after`, a (date, username)
+        # key, or at `start`; once exhausted, next_token is set if there is more to read
+        self.next_token = None
+        if after is None:
+            # every username sorts after "", so the page starts with the whole of `start`
+            after = (start, "")
+        cursor = conn.cursor()
+        try:
+            # one row past the page says whether there is a next one
+            cursor.execute(self.backend.first_rows(SEARCH_PAGE, self.page_size + 1),
+                           (after[0], end, after[0], after[0], after[1]))
+            returned = 0
+            while True:
+                batch = cursor.fetchmany(self.batch_size)
+                if not batch:
+                    return
+                for row in batch:
+                    if returned == self.page_size:
+                        self.next_token = encode_token(start, end, after)
+                        return
+                    d = row[0].date() if isinstance(row[0], datetime.datetime) else row[0]
+                    after = (d, row[1])
+                    returned += 1
+                    yield after
+        finally:
+            cursor.close()
+
+
+def encode_token(start, end, after):
+    # hex, so the token survives the CLI lowercasing its input
+    fields = [start.isoformat(), end.isoformat(), after[0].isoformat(), after[1]]
+    return ":".join(fields).encode("utf-8").hex()
+
+
+def decode_token(token):
+    # (start, end, (date, username)); ValueError if it is not a continuation token
+    try:
+        start, end, last_time, last_user = bytes.fromhex(token).decode("utf-8").split(":", 3)
+        return (datetime.date.fromisoformat(start), datetime.date.fromisoformat(end),
+                (datetime.date.fromisoformat(last_time), last_user))
+    except (UnicodeDecodeError, ValueError):
+        raise ValueError("Invalid continuation token: " + token)
@@ -0,0 +1,58 @@
+import pymssql
+import os
+import re
+from db.Backend import Backend
+
+
+class SqlServerBackend(Backend):
+    name = "sqlserver"
+    Error = pymssql.Error
+    DriverIntegrityError = pymssql.IntegrityError
+
+    def __init__(self, server=None, db_name=None, user=None, password=None):
+        self.server_name = server or os.getenv("Server") + ".database.windows.net"
+        self.db_name = db_name or os.getenv("DBName")
+        self.user = user or os.getenv("UserID")
+        self.password = password or os.getenv("Password")
+
+    def connect(self):
+        return pymssql.connect(server=self.server_name, user=self.user, password=self.password,
+                               database=self.db_name)
+
+    def raw_cursor(self, conn, as_dict):
+        return conn.cursor(as_dict=as_dict)
+
+    def has_table(self, cursor, name):
+        cursor.execute("SELECT 1 FROM INFORMATION_SCHEMA.TABLES WHERE TABLE_NAME = %s", (name,))
+        return cursor.fetchone() is not None
+
+    def split_script(self, script):
+        # batches are separated by GO lines, as in sqlcmd
+        batches = re.split(r"(?im)^\s*GO\s*$", script)
+        return [batch.strip() for batch in batches if strip_comments(batch)]
+
+    def first_rows(self, select, n):
+        return "SELECT TOP %d" % n + select.strip()[len("SELECT"):]
+
+    def random_order(self):
+        return "NEWID()"
+
+    def insert_missing(self, table, columns, rows, key=None):
+        values = ", ".join(["(" + ", ".join(["%s"] * len(columns)) + ")"] * rows)
+        matches = " AND ".join("t.{0} = v.{0}".format(column) for column in key or columns)
+        return ("INSERT INTO {table} ({columns}) SELECT {v_columns} FROM (VALUES {values}) AS v ({columns}) "
+                "WHERE NOT EXISTS (SELECT 1 FROM {table} t WITH (UPDLOCK, HOLDLOCK) WHERE {matches})").format(
+            table=table, columns=", ".join(columns), v_columns=", ".join("v." + c for c in columns),
+            values=values, matches=matches)
+
+    def upsert_increment(self, table, key, column, rows):
+        values = ", ".join(["(%s, %d)"] * rows)
+        return ("MERGE {table} WITH (HOLDLOCK) AS t USING (VALUES {values}) AS s ({key}, {column}) "
+                "ON t.{key} = s.{key} "
+                "WHEN MATCHED THEN UPDATE SET {column} = t.{column} + s.{column} "
+                "WHEN NOT MATCHED THEN INSERT ({key}, {column}) VALUES (s.{key}, s.{column});").format(
+            table=table, key=key, column=column, values=values)
+
+
+def strip_comments(sql):
+    return "\n".join(line for line in sql.splitlines() if not line.strip().startswith("--")).strip()
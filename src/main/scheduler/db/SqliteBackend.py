@@ -0,0 +1,120 @@
+import datetime
+import itertools
+import os
+import re
+import sqlite3
+import threading
+from db.Backend import Backend, Connection
+from db.MigrationRunner import MigrationRunner
+
+# pymssql-style placeholders, leaving escaped %% alone
+PLACEHOLDER = re.compile(r"%%|%[sd]")
+
+# the schema only declares DATE columns, so dates travel as ISO strings and come back as dates
+sqlite3.register_converter("date", lambda value: datetime.date.fromisoformat(value.decode()))
+
+memory_names = itertools.count(1)
+
+
+class SqliteBackend(Backend):
+    # Embedded engine for running without a database server. `path` is a file, or
+    # ":memory:" for a private in-process database that lives as long as this object.
+    # Pending migrations are applied when it is created unless `migrate` is False.
+    name = "sqlite"
+    Error = sqlite3.Error
+    DriverIntegrityError = sqlite3.IntegrityError
+
+    def __init__(self, path=":memory:", migrate=True):
+        self.path = path
+        self._statements = {}
+        self._anchor = None
+        # waiting here is cheaper than in SQLite's busy handler, which sleeps between retries
+        self.write_lock = threading.Lock()
+        if path == ":memory:":
+            # a shared-cache memory database disappears with its last connection, so keep one open;
+            # shared-cache connections lock whole tables, so use them one at a time
+            self._target = "file:scheduler-memory-%d-%d?mode=memory&cache=shared" % (os.getpid(), next(memory_names))
+            self.max_connections = 1
+            self._anchor = self.connect()
+        else:
+            self._target = path
+        if migrate:
+            conn = Connection(self, self._anchor) if self._anchor is not None else self.open()
+            MigrationRunner(self).migrate(conn)
+            if self._anchor is None:
+                conn.close()
+
+    def connect(self):
+        # room in the per-connection statement cache for every statement in db.Statements and
+        # the engine's own, so each is compiled once per connection
+        conn = sqlite3.connect(self._target, uri=self.path == ":memory:",
+                               detect_types=sqlite3.PARSE_DECLTYPES, check_same_thread=False, timeout=30,
+                               cached_statements=256)
+        conn.execute("PRAGMA foreign_keys = ON")
+        if self.path != ":memory:":
+            conn.execute("PRAGMA journal_mode = WAL")
+        return conn
+
+    def begin(self, cursor):
+        # sqlite3 leaves DDL outside of transactions unless one is opened explicitly
+        cursor.execute("BEGIN IMMEDIATE")
+
+    def has_table(self, cursor, name):
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = %s", (name,))
+        return cursor.fetchone() is not None
+
+    def split_script(self, script):
+        # sqlite3 runs one statement per execute; complete_statement knows where each one ends
+        statements = []
+        current = ""
+        for line in script.splitlines(keepends=True):
+            if not current and (not line.strip() or line.strip().startswith("--")):
+                continue
+            current += line
+            if sqlite3.complete_statement(current):
+                statements.append(current.strip())
+                current = ""
+        if current.strip():
+            statements.append(current.strip())
+        return statements
+
+    def sql(self, operation):
+        translated = self._statements.get(operation)
+        if translated is None:
+            translated = PLACEHOLDER.sub(lambda m: "%" if m.group() == "%%" else "?", operation)
+            self._statements[operation] = translated
+        return translated
+
+    def params(self, params):
+        # pymssql takes a bare value for a single parameter, sqlite3 wants a sequence
+        if not isinstance(params, (tuple, list, dict)):
+            params = (params,)
+        if isinstance(params, dict):
+            return {key: to_sqlite(value) for key, value in params.items()}
+        return tuple(to_sqlite(value) for value in params)
+
+    def first_rows(self, select, n):
+        return select.rstrip() + " LIMIT %d" % n
+
+    def random_order(self):
+        return "random()"
+
+    def insert_missing(self, table, columns, rows, key=None):
+        # OR IGNORE already skips a row that collides on any unique key
+        values = ", ".join(["(" + ", ".join(["%s"] * len(columns)) + ")"] * rows)
+        return "INSERT OR IGNORE INTO {table} ({columns}) VALUES {values}".format(
+            table=table, columns=", ".join(columns), values=values)
+
+    def upsert_increment(self, table, key, column, rows):
+        values = ", ".join(["(%s, %d)"] * rows)
+        return ("INSERT INTO {table} ({key}, {column}) VALUES {values} "
+                "ON CONFLICT ({key}) DO UPDATE SET {column} = {column} + excluded.{column}").format(
+            table=table, key=key, column=column, values=values)
+
+
+def to_sqlite(value):
+    if isinstance(value, datetime.datetime):
+        return value.date().isoformat()
+    if isinstance(value, datetime.date):
+        return value.isoformat()
+    return value
@@ -0,0 +1,154 @@
+import json
+import os
+import re
+import threading
+import time
+
+# literals a fingerprint leaves out: quoted strings, numbers and both placeholder styles
+LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b|%[sd]|\?")
+IN_LISTS = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+ROW_LISTS = re.compile(r"\(\?\)(?:\s*,\s*\(\?\))+")
+SPACES = re.compile(r"\s+")
+
+
+def fingerprint(operation):
+    # the statement with its literals replaced by ?, lists of them (and multi-row VALUES)
+    # collapsed into one and whitespace normalised, so every run of the same query has the
+    # same fingerprint
+    statement = LITERALS.sub("?", operation)
+    statement = ROW_LISTS.sub("(?)", IN_LISTS.sub("(?)", statement))
+    return SPACES.sub(" ", statement).strip()
+
+
+class StatementStats:
+    __slots__ = ("calls", "seconds", "max_seconds", "rows", "slow")
+
+    def __init__(self):
+        self.calls = 0
+        self.seconds = 0.0
+        self.max_seconds = 0.0
+        self.rows = 0
+        self.slow = 0
+
+
+class StatementTrace:
+    # Times every statement run through a TracingCursor, from execute() until its results
+    # are read or the cursor moves on. Statements slower than `threshold_ms` are written to
+    # a rotating log as one JSON object per line: fingerprint, parameter count, rows,
+    # duration, the command being run and the code that ran it. Every statement is also
+    # added up by fingerprint, and a reporter thread writes the top `top_n` by total time to
+    # the same log every `interval` seconds. Off unless SlowQueryMs is set.
+    def __init__(self, threshold_ms=None, path=None, max_bytes=None, backups=None, top_n=None, interval=None):
+        if threshold_ms is None and os.getenv("SlowQueryMs"):
+            threshold_ms = float(os.getenv("SlowQueryMs"))
+        self.enabled = threshold_ms is not None
+        self.threshold = (threshold_ms or 0.0) / 1000
+        self.path = path or os.getenv("SlowQueryLog", "slow_queries.log")
+        self.max_bytes = max_bytes if max_bytes is not None else int(os.getenv("SlowQueryLogBytes", "1048576"))
+        self.backups = backups if backups is not None else int(os.getenv("SlowQueryLogBackups", "5"))
+        self.top_n = top_n if top_n is not None else int(os.getenv("TraceTopN", "10"))
+        self.interval = interval if interval is not None else float(os.getenv("TraceReportInterval", "60"))
+        self._lock = threading.Lock()
+        # operation text -> fingerprint; bounded, statements with literals baked in are unique
+        self._fingerprints = {}
+        # fingerprint -> StatementStats
+        self.statements = {}
+        self.logged = 0
+        self._log = None
+        self.reporter = None
+
+    def fingerprint(self, operation):
+        cached = self._fingerprints.get(operation)
+        if cached is None:
+            cached = fingerprint(operation)
+            if len(self._fingerprints) >= 4096:
+                self._fingerprints.clear()
+            self._fingerprints[operation] = cached
+        return cached
+
+    def record(self, operation, params, rows, seconds, command, site):
+        statement = self.fingerprint(operation)
+        slow = seconds >= self.threshold
+        with self._lock:
+            stats = self.statements.get(statement)
+            if stats is None:
+                stats = self.statements[statement] = StatementStats()
+            stats.calls += 1
+            stats.seconds += seconds
+            stats.max_seconds = max(stats.max_seconds, seconds)
+            stats.rows += rows
+            if slow:
+                stats.slow += 1
+                self.logged += 1
+            if self.reporter is None and self.interval > 0:
+                self.reporter = TraceReporter(self, self.interval)
+                self.reporter.start()
+        if slow:
+            self.write({"event": "slow", "time": round(time.time(), 3), "ms": round(seconds * 1000, 3),
+                        "rows": rows, "params": params, "command": command, "site": site,
+                        "statement": statement})
+
+    def top(self, n=None):
+        # the n statements with the most total time, slowest first
+        with self._lock:
+            ranked = sorted(self.statements.items(), key=lambda item: item[1].seconds, reverse=True)
+        return [{"statement": statement, "calls": stats.calls, "total_ms": round(stats.seconds * 1000, 3),
+                 "mean_ms": round(stats.seconds / stats.calls * 1000, 3),
+                 "max_ms": round(stats.max_seconds * 1000, 3), "rows": stats.rows, "slow": stats.slow}
+                for statement, stats in ranked[:n or self.top_n]]
+
+    def report(self):
+        # the current top N, written to the log
+        top = self.top()
+        if top:
+            self.write({"event": "top", "time": round(time.time(), 3), "statements": top})
+        return top
+
+    def reset(self):
+        with self._lock:
+            self.statements = {}
+            self.logged = 0
+
+    def write(self, entry):
+        log = self._log
+        if log is None:
+            with self._lock:
+                if self._log is None:
+                    self._log = open_log(self.path, self.max_bytes, self.backups)
+                log = self._log
+        log.info(json.dumps(entry))
+
+
+def open_log(path, max_bytes, backups):
+    # logging is only imported once there is something to write
+    import logging
+    import logging.handlers
+    log = logging.getLogger("scheduler.statements." + os.path.abspath(path))
+    log.setLevel(logging.INFO)
+    log.propagate = False
+    if not log.handlers:
+        handler = logging.handlers.RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backups,
+                                                       encoding="utf-8")
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        log.addHandler(handler)
+    return log
+
+
+class TraceReporter(threading.Thread):
+    # Calls StatementTrace.report() every `interval` seconds until stop()
+    def __init__(self, trace, interval):
+        super().__init__(name="statement-trace", daemon=True)
+        self.trace = trace
+        self.interval = interval
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.trace.report()
+
+    def stop(self):
+        self.stopped.set()
+
+
+# the process-wide trace, shared by every connection
+trace = StatementTrace()
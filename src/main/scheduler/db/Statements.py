@@ -0,0 +1,162 @@
+import re
+import threading
+from db.Backend import DatabaseError
+
+PLACEHOLDER = re.compile(r"%%|%[sd]")
+
+# a vaccine's stock is its Vaccines row plus its DoseShards rows, whichever mode wrote them
+TOTALS = ("SELECT v.Name, v.Doses + COALESCE((SELECT SUM(s.Doses) FROM DoseShards s WHERE s.Name = v.Name), 0) "
+          "FROM Vaccines v")
+
+
+class Statement:
+    # One named statement, written once in pymssql's %s / %d style. `types` are the T-SQL
+    # types of its parameters in order; with them, SQL Server runs it through sp_executesql
+    # so the server caches one plan for the statement instead of one per set of values
+    # pymssql writes into the text. A backend whose dialect differs gets its own text as a
+    # keyword argument named after it, e.g. sqlite="...".
+    def __init__(self, name, sql, types=(), as_dict=False, **variants):
+        self.name = name
+        self.sql = sql
+        self.types = types
+        self.as_dict = as_dict
+        self.variants = variants
+        self._texts = {}
+        self.executions = 0
+        self.errors = 0
+
+    def text(self, backend):
+        text = self._texts.get(backend.name)
+        if text is None:
+            text = self.variants.get(backend.name)
+            if text is None:
+                text = self.sql
+                if backend.name == "sqlserver" and self.types:
+                    text = executesql(text, self.types)
+            self._texts[backend.name] = text
+        return text
+
+
+def executesql(sql, types):
+    # the statement as an sp_executesql call: the placeholders become @p0, @p1, ... in the
+    # statement text and are passed as that call's arguments instead
+    numbers = iter(range(len(types)))
+    body = PLACEHOLDER.sub(lambda m: "%" if m.group() == "%%" else "@p%d" % next(numbers), sql)
+    declarations = ", ".join("@p%d %s" % (i, t) for i, t in enumerate(types))
+    placeholders = ", ".join(PLACEHOLDER.findall(sql))
+    return "EXEC sp_executesql N'{}', N'{}', {}".format(
+        " ".join(body.split()).replace("'", "''").replace("%", "%%"), declarations, placeholders)
+
+
+STATEMENTS = {}
+counters_lock = threading.Lock()
+
+
+def register(name, sql, types=(), as_dict=False, **variants):
+    STATEMENTS[name] = Statement(name, sql, types, as_dict, **variants)
+
+
+# accounts
+register("patient.exists", "SELECT Username FROM Patients WHERE Username = %s", ("varchar(255)",), as_dict=True)
+register("patient.credentials", "SELECT Salt, Hash, KdfVersion FROM Patients WHERE Username = %s",
+         ("varchar(255)",), as_dict=True)
+register("patient.insert", "INSERT INTO Patients (Username, Salt, Hash, KdfVersion) VALUES (%s, %s, %s, %d)",
+         ("varchar(255)", "binary(16)", "binary(16)", "int"))
+register("caregiver.exists", "SELECT Username FROM Caregivers WHERE Username = %s", ("varchar(255)",), as_dict=True)
+register("caregiver.credentials", "SELECT Salt, Hash, KdfVersion FROM Caregivers WHERE Username = %s",
+         ("varchar(255)",), as_dict=True)
+register("caregiver.insert", "INSERT INTO Caregivers (Username, Salt, Hash, KdfVersion) VALUES (%s, %s, %s, %d)",
+         ("varchar(255)", "binary(16)", "binary(16)", "int"))
+
+# Statements whose rowcount the caller reads are registered without types: through
+# sp_executesql the count would be the EXEC's, not the statement's.
+
+# availability
+register("availability.insert", "INSERT INTO Availabilities (Time, Username) VALUES (%s, %s)",
+         ("date", "varchar(255)"))
+register("availability.all", "SELECT Username, Time FROM Availabilities")
+register("availability.claim", "DELETE FROM Availabilities WHERE Time = %s AND Username = %s")
+
+# vaccines
+register("vaccine.get", TOTALS + " WHERE v.Name = %s", ("varchar(255)",))
+register("vaccine.all", TOTALS)
+register("vaccine.insert", "INSERT INTO Vaccines (Name, Doses) VALUES (%s, %d)", ("varchar(255)", "int"))
+register("vaccine.add_doses", "UPDATE Vaccines SET Doses = Doses + %d WHERE Name = %s", ("int", "varchar(255)"))
+register("vaccine.names", "SELECT Name FROM Vaccines")
+register("vaccine.spare", "SELECT Doses FROM Vaccines WHERE Name = %s", ("varchar(255)",))
+
+# doses, see DoseCounter
+register("doses.take", "UPDATE Vaccines SET Doses = Doses - 1 WHERE Name = %s AND Doses > 0")
+register("doses.give", "UPDATE Vaccines SET Doses = Doses + 1 WHERE Name = %s", ("varchar(255)",))
+register("doses.move_out", "UPDATE Vaccines SET Doses = Doses - %d WHERE Name = %s AND Doses >= %d")
+register("doses.move_in", "UPDATE Vaccines SET Doses = Doses + %d WHERE Name = %s", ("int", "varchar(255)"))
+register("dose_shard.take", "UPDATE DoseShards SET Doses = Doses - 1 WHERE Name = %s AND Shard = %d AND Doses > 0")
+register("dose_shard.take_any",
+         "UPDATE DoseShards SET Doses = Doses - 1 WHERE Name = %s AND Doses > 0 AND Shard = ("
+         "SELECT TOP 1 Shard FROM DoseShards WHERE Name = %s AND Doses > 0)",
+         sqlite="UPDATE DoseShards SET Doses = Doses - 1 WHERE Name = %s AND Doses > 0 AND Shard = ("
+                "SELECT Shard FROM DoseShards WHERE Name = %s AND Doses > 0 LIMIT 1)")
+register("dose_shard.give", "UPDATE DoseShards SET Doses = Doses + 1 WHERE Name = %s AND Shard = %d")
+register("dose_shard.move_out",
+         "UPDATE DoseShards SET Doses = Doses - %d WHERE Name = %s AND Shard = %d AND Doses >= %d")
+register("dose_shard.move_in", "UPDATE DoseShards SET Doses = Doses + %d WHERE Name = %s AND Shard = %d",
+         ("int", "varchar(255)", "int"))
+register("dose_shards.of_vaccine", "SELECT Shard, Doses FROM DoseShards WHERE Name = %s AND Shard < %d",
+         ("varchar(255)", "int"))
+
+# appointments
+register("appointment.for_caregiver",
+         "SELECT appointment_id, Time, PUsername, vaccine_name FROM Appointments "
+         "WHERE CUsername = %s AND appointment_id = %s", ("varchar(255)", "int"))
+register("appointment.for_patient",
+         "SELECT appointment_id, Time, CUsername, vaccine_name FROM Appointments "
+         "WHERE PUsername = %s AND appointment_id = %s", ("varchar(255)", "int"))
+register("appointment.delete", "DELETE FROM Appointments WHERE appointment_id = %s", ("int",))
+register("appointment.insert",
+         "INSERT INTO Appointments (appointment_id, vaccine_name, Time, CUsername, PUsername) "
+         "VALUES (%s, %s, %s, %s, %s)", ("int", "varchar(255)", "date", "varchar(255)", "varchar(255)"))
+register("appointments.of_caregiver",
+         "SELECT appointment_id, vaccine_name, Time, PUsername FROM Appointments "
+         "WHERE CUsername = %s ORDER BY appointment_id", ("varchar(255)",))
+register("appointments.of_patient",
+         "SELECT appointment_id, vaccine_name, Time, CUsername FROM Appointments "
+         "WHERE PUsername = %s ORDER BY appointment_id", ("varchar(255)",))
+
+# ids, see HiLoIdAllocator
+register("id_block.get", "SELECT NextId FROM IdBlocks WHERE Name = %s", ("varchar(255)",))
+register("id_block.insert", "INSERT INTO IdBlocks VALUES (%s, %d)", ("varchar(255)", "int"))
+register("id_block.advance", "UPDATE IdBlocks SET NextId = NextId + %d WHERE Name = %s", ("int", "varchar(255)"))
+
+# migrations
+register("schema_version.all", "SELECT Version FROM SchemaVersions")
+register("schema_version.insert", "INSERT INTO SchemaVersions VALUES (%d, %s)", ("int", "varchar(255)"))
+
+
+def run_statement(conn, name, params=None):
+    # Runs the statement called `name` on `conn` and returns the cursor holding its results.
+    # Each connection keeps one cursor per statement, so a statement run again on the same
+    # connection reuses both its cursor and, on SQLite, the compiled statement the driver
+    # caches by text. The cursor belongs to the connection: read it, but do not close it.
+    return execute_statement(conn.statement_cursor(name, STATEMENTS[name].as_dict), name, params)
+
+
+def execute_statement(cursor, name, params=None):
+    # Runs the statement called `name` on a cursor of the caller's, for code that works through
+    # one cursor inside its own transaction; returns the cursor
+    statement = STATEMENTS[name]
+    try:
+        cursor.execute(statement.text(cursor.backend), params)
+    except DatabaseError:
+        with counters_lock:
+            statement.errors += 1
+        raise
+    with counters_lock:
+        statement.executions += 1
+    return cursor
+
+
+def statement_counters():
+    # {name: {"executions": n, "errors": n}} for every statement that has run
+    with counters_lock:
+        return {name: {"executions": s.executions, "errors": s.errors}
+                for name, s in sorted(STATEMENTS.items()) if s.executions or s.errors}
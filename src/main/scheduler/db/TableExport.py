@@ -0,0 +1,139 @@
+import csv
+import datetime
+import gzip
+import io
+import json
+import os
+
+# per table: output columns, the next chunk after a key, the key of a row and the key to start
+# from; chunks are keyset pages on the primary key, so each costs only its own rows
+EXPORT_TABLES = {
+    "appointments": (
+        ["appointment_id", "vaccine_name", "Time", "CUsername", "PUsername"],
+        """SELECT appointment_id, vaccine_name, Time, CUsername, PUsername FROM Appointments
+WHERE appointment_id > %d ORDER BY appointment_id""",
+        lambda row: [row[0]],
+        [-2 ** 31],
+    ),
+    "availabilities": (
+        ["Time", "Username"],
+        """SELECT Time, Username FROM Availabilities
+WHERE Time >= %s AND (Time > %s OR (Time = %s AND Username > %s)) ORDER BY Time, Username""",
+        lambda row: [to_text(row[0]), row[1]],
+        ["0001-01-01", ""],
+    ),
+}
+
+
+def to_text(value):
+    if isinstance(value, datetime.datetime):
+        value = value.date()
+    if isinstance(value, datetime.date):
+        return value.isoformat()
+    return value
+
+
+def key_params(table, key):
+    if table == "appointments":
+        return (key[0],)
+    d = datetime.date.fromisoformat(key[0])
+    return (d, d, d, key[1])
+
+
+class TableExport:
+    # Streams a whole table to `path` as CSV, or JSON lines when `fmt` is "jsonl", gzipped
+    # when the path ends in .gz. Rows are read `chunk_size` at a time in key order and each
+    # chunk is formatted in memory and written with one call, so memory stays at one chunk
+    # however big the table is. After every chunk the last key and the file length are saved
+    # to <path>.resume; run() on the same path carries on from there, cutting off anything
+    # written after the checkpoint, and removes it once the table is done. Gzip output is a
+    # new gzip member per chunk, so a resumed file is still one valid .gz file.
+    def __init__(self, backend, table, path, fmt=None, chunk_size=None):
+        if table not in EXPORT_TABLES:
+            raise ValueError("Unknown table: " + table)
+        self.backend = backend
+        self.table = table
+        self.path = path
+        self.compress = path.endswith(".gz")
+        if fmt is None:
+            fmt = "jsonl" if path[:-3 if self.compress else None].endswith(".jsonl") else "csv"
+        if fmt not in ("csv", "jsonl"):
+            raise ValueError("Unknown export format: " + fmt)
+        self.fmt = fmt
+        self.chunk_size = chunk_size if chunk_size is not None else int(os.getenv("ExportChunkSize", "10000"))
+        self.checkpoint_path = path + ".resume"
+        self.rows = 0
+        self.resumed = False
+
+    def run(self, conn):
+        columns, select, row_key, key = EXPORT_TABLES[self.table]
+        select = self.backend.first_rows(select, self.chunk_size)
+        checkpoint = self._load_checkpoint()
+        if checkpoint is not None:
+            out = open(self.path, "r+b")
+            out.truncate(checkpoint["offset"])
+            out.seek(checkpoint["offset"])
+            key = checkpoint["key"]
+            self.rows = checkpoint["rows"]
+            self.resumed = True
+        else:
+            out = open(self.path, "wb")
+            if self.fmt == "csv":
+                self._write(out, self._csv([columns]))
+        cursor = conn.cursor()
+        try:
+            while True:
+                cursor.execute(select, key_params(self.table, key))
+                chunk = cursor.fetchall()
+                if not chunk:
+                    break
+                if self.fmt == "csv":
+                    data = self._csv([to_text(value) for value in row] for row in chunk)
+                else:
+                    data = "".join(json.dumps(dict(zip(columns, map(to_text, row)))) + "\n" for row in chunk)
+                self._write(out, data)
+                key = row_key(chunk[-1])
+                self.rows += len(chunk)
+                out.flush()
+                self._save_checkpoint(key, out.tell())
+                if len(chunk) < self.chunk_size:
+                    break
+        finally:
+            cursor.close()
+            out.close()
+        try:
+            os.remove(self.checkpoint_path)
+        except FileNotFoundError:
+            # an empty table finishes before its first chunk, with no checkpoint written
+            pass
+        return self.rows
+
+    def _csv(self, rows):
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(rows)
+        return buffer.getvalue()
+
+    def _write(self, out, text):
+        data = text.encode("utf-8")
+        if self.compress:
+            data = gzip.compress(data, compresslevel=6)
+        out.write(data)
+
+    def _load_checkpoint(self):
+        try:
+            with open(self.checkpoint_path) as f:
+                checkpoint = json.load(f)
+        except FileNotFoundError:
+            return None
+        if checkpoint.get("table") != self.table or checkpoint.get("format") != self.fmt:
+            raise ValueError("{} belongs to a different export, remove it to start over".format(
+                self.checkpoint_path))
+        return checkpoint
+
+    def _save_checkpoint(self, key, offset):
+        # written aside and renamed over, so a crash leaves the old checkpoint or the new one
+        temp = self.checkpoint_path + ".tmp"
+        with open(temp, "w") as f:
+            json.dump({"table": self.table, "format": self.fmt, "key": key, "offset": offset,
+                       "rows": self.rows}, f)
+        os.replace(temp, self.checkpoint_path)
@@ -0,0 +1,141 @@
+import datetime
+from db.Statements import TOTALS
+
+# NumPy is only needed for reports, so it is imported on the first one and everything else
+# runs without it
+np = None
+
+
+def load_numpy():
+    global np
+    if np is None:
+        try:
+            import numpy
+        except ImportError:
+            raise RuntimeError("Reports need NumPy, install it with: pip install numpy")
+        np = numpy
+    return np
+
+LOAD_APPOINTMENTS = "SELECT vaccine_name, Time, CUsername FROM Appointments"
+LOAD_AVAILABILITIES = "SELECT Time, Username FROM Availabilities"
+
+
+def day_number(d):
+    if isinstance(d, datetime.datetime):
+        d = d.date()
+    return d.toordinal()
+
+
+class Codes:
+    # Gives each distinct name a small integer, in first-seen order
+    def __init__(self):
+        self.codes = {}
+        self.names = []
+
+    def code(self, name):
+        code = self.codes.get(name)
+        if code is None:
+            code = self.codes[name] = len(self.names)
+            self.names.append(name)
+        return code
+
+    def __len__(self):
+        return len(self.names)
+
+
+class UtilizationReport:
+    # Operations reports over the whole schedule, computed on columnar copies of the tables:
+    # appointments as (vaccine, day, caregiver) int32 columns, free slots as (day, caregiver)
+    # and stock as one int64 per vaccine, with days as date ordinals and names coded as
+    # integers. Rows are read `batch_size` at a time and only their codes are kept, so a
+    # load costs 12 bytes per appointment and 8 per free slot however long the names are.
+    # Every aggregate is then a bincount over a combined key instead of a loop over rows.
+    def __init__(self, backend, batch_size=50000):
+        load_numpy()
+        self.backend = backend
+        self.batch_size = batch_size
+        self.vaccines = Codes()
+        self.caregivers = Codes()
+        self.appointments = None
+        self.availabilities = None
+        self.stock = None
+
+    def load(self, conn):
+        vaccine, caregiver = self.vaccines.code, self.caregivers.code
+        # the vaccine list first, so vaccines nobody has booked still get a code and a stock
+        cursor = conn.cursor()
+        try:
+            stock = {vaccine(name): doses for name, doses in cursor.execute(TOTALS).fetchall()}
+        finally:
+            cursor.close()
+        # datetime.toordinal() is date's, so either type the drivers return gives the day
+        day = datetime.date.toordinal
+        self.appointments = self._columns(conn, LOAD_APPOINTMENTS, (vaccine, day, caregiver))
+        self.availabilities = self._columns(conn, LOAD_AVAILABILITIES, (day, caregiver))
+        self.stock = np.zeros(len(self.vaccines), dtype=np.int64)
+        self.stock[list(stock)] = list(stock.values())
+        return self
+
+    def _columns(self, conn, select, encoders):
+        # the rows of `select` as an int32 array with one column per encoder, each applied to
+        # the matching column of the result; built a batch at a time
+        cursor = conn.cursor()
+        chunks = []
+        try:
+            cursor.execute(select)
+            while True:
+                batch = cursor.fetchmany(self.batch_size)
+                if not batch:
+                    break
+                chunk = np.empty((len(batch), len(encoders)), dtype=np.int32)
+                for i, (encode, column) in enumerate(zip(encoders, zip(*batch))):
+                    chunk[:, i] = np.fromiter(map(encode, column), dtype=np.int32, count=len(batch))
+                chunks.append(chunk)
+        finally:
+            cursor.close()
+        if not chunks:
+            return np.empty((0, len(encoders)), dtype=np.int32)
+        return np.concatenate(chunks)
+
+    def doses_per_day(self, start, end):
+        # (dates, vaccine names, counts) where counts[v, d] is the appointments for vaccine v
+        # on dates[d], for every date from start to end inclusive
+        first, last = day_number(start), day_number(end)
+        days = max(0, last - first + 1)
+        vaccine, day = self.appointments[:, 0], self.appointments[:, 1]
+        in_range = (day >= first) & (day <= last)
+        key = vaccine[in_range].astype(np.int64) * days + (day[in_range] - first)
+        counts = np.bincount(key, minlength=len(self.vaccines) * days).reshape(len(self.vaccines), days)
+        dates = [datetime.date.fromordinal(first + d) for d in range(days)]
+        return dates, self.vaccines.names, counts
+
+    def utilization(self, start, end):
+        # [(caregiver, booked days, offered days, booked / offered)] from start to end, busiest
+        # first; a booked day was offered too, reserving it took it out of Availabilities
+        first, last = day_number(start), day_number(end)
+        booked = self._per_caregiver(self.appointments[:, 1], self.appointments[:, 2], first, last)
+        free = self._per_caregiver(self.availabilities[:, 0], self.availabilities[:, 1], first, last)
+        offered = booked + free
+        ratio = np.divide(booked, offered, out=np.zeros(len(offered)), where=offered > 0)
+        order = np.lexsort((-offered, -ratio))
+        return [(self.caregivers.names[c], int(booked[c]), int(offered[c]), float(ratio[c]))
+                for c in order if offered[c]]
+
+    def _per_caregiver(self, day, caregiver, first, last):
+        in_range = (day >= first) & (day <= last)
+        return np.bincount(caregiver[in_range], minlength=len(self.caregivers))
+
+    def stock_out(self, as_of, window=28):
+        # [(vaccine, doses left, booked per day, stock-out date or None)]: demand is the
+        # average appointments per day over the `window` days up to as_of, and stock burns
+        # down at that rate from as_of
+        today = day_number(as_of)
+        vaccine, day = self.appointments[:, 0], self.appointments[:, 1]
+        recent = (day > today - window) & (day <= today)
+        rate = np.bincount(vaccine[recent], minlength=len(self.vaccines)) / window
+        days_left = np.floor(np.divide(self.stock, rate, out=np.full(len(rate), np.inf), where=rate > 0))
+        # stock that outlasts the calendar never runs out
+        days_left[days_left > datetime.date.max.toordinal() - today] = np.inf
+        return [(name, int(self.stock[v]), float(rate[v]),
+                 datetime.date.fromordinal(today + int(days_left[v])) if np.isfinite(days_left[v]) else None)
+                for v, name in enumerate(self.vaccines.names)]
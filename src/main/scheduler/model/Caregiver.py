@@ -1,31 +1,32 @@
-import sys
-sys.path.append("../util/*")
-sys.path.append("../db/*")
 from util.Util import Util
 from db.ConnectionManager import ConnectionManager
-import pymssql
+from db.Backend import DatabaseError
+from db.Statements import run_statement
+from db.AvailabilityIndex import availability_index
+from db.AvailabilityJournal import availability_journal
 
 
 class Caregiver:
-    def __init__(self, username, password=None, salt=None, hash=None):
+    def __init__(self, username, password=None, salt=None, hash=None, kdf_version=None):
         self.username = username
         self.password = password
         self.salt = salt
         self.hash = hash
+        self.kdf_version = kdf_version
 
     # getters
     def get(self):
         cm = ConnectionManager()
         conn = cm.create_connection()
-        cursor = conn.cursor(as_dict=True)
 
-        get_caregiver_details = "SELECT Salt, Hash FROM Caregivers WHERE Username = %s"
         try:
-            cursor.execute(get_caregiver_details, self.username)
+            cursor = run_statement(conn, "caregiver.credentials", self.username)
             for row in cursor:
                 curr_salt = row['Salt']
                 curr_hash = row['Hash']
-                calculated_hash = Util.generate_hash(self.password, curr_salt)
+                # accounts created before KDF versioning have none recorded, they used version 1
+                curr_kdf_version = row['KdfVersion'] or 1
+                calculated_hash = Util.generate_hash(self.password, curr_salt, curr_kdf_version)
                 if not curr_hash == calculated_hash:
                     # print("Incorrect password")
                     cm.close_connection()
@@ -33,9 +34,10 @@ class Caregiver:
                 else:
                     self.salt = curr_salt
                     self.hash = calculated_hash
+                    self.kdf_version = curr_kdf_version
                     cm.close_connection()
                     return self
-        except pymssql.Error as e:
+        except DatabaseError as e:
             raise e
         finally:
             cm.close_connection()
@@ -50,34 +52,102 @@ class Caregiver:
     def get_hash(self):
         return self.hash
 
-    def save_to_db(self):
+    # Insert many already-hashed Caregivers in multi-row chunks and one commit. Usernames that
+    # are already taken, or repeated, are skipped. Returns how many were inserted.
+    @staticmethod
+    def save_all(caregivers, chunk_size=500):
+        # the first row per username: a repeat within one statement would break the primary key
+        # on backends that check NOT EXISTS against the table only; it counts as skipped
+        unique = {}
+        for caregiver in caregivers:
+            unique.setdefault(caregiver.username, (caregiver.username, caregiver.salt, caregiver.hash, caregiver.kdf_version or 1))
+        rows = list(unique.values())
         cm = ConnectionManager()
         conn = cm.create_connection()
         cursor = conn.cursor()
+        backend = ConnectionManager.get_backend()
+
+        inserted = 0
+        try:
+            for start in range(0, len(rows), chunk_size):
+                chunk = rows[start:start + chunk_size]
+                add_caregivers = backend.insert_missing("Caregivers", ("Username", "Salt", "Hash", "KdfVersion"),
+                                                   len(chunk), key=("Username",))
+                cursor.execute(add_caregivers, tuple(value for row in chunk for value in row))
+                inserted += cursor.rowcount
+            conn.commit()
+        except DatabaseError:
+            raise
+        finally:
+            cm.close_connection()
+        return inserted
+
+    def save_to_db(self):
+        cm = ConnectionManager()
+        conn = cm.create_connection()
 
-        add_caregivers = "INSERT INTO Caregivers VALUES (%s, %s, %s)"
         try:
-            cursor.execute(add_caregivers, (self.username, self.salt, self.hash))
+            run_statement(conn, "caregiver.insert", (self.username, self.salt, self.hash, self.kdf_version or 1))
             # you must call commit() to persist your data if you don't set autocommit to True
             conn.commit()
-        except pymssql.Error:
+        except DatabaseError:
             raise
         finally:
             cm.close_connection()
 
-    # Insert availability with parameter date d
+    # Insert availability with parameter date d. In write-behind mode (AvailabilityJournal is
+    # set) it is journaled instead and committed by the journal's flusher shortly after; a
+    # date that was already uploaded is then skipped rather than failing.
     def upload_availability(self, d):
+        journal = availability_journal(ConnectionManager.get_backend())
+        if journal is not None:
+            journal.append([(d, self.username)])
+            return
+
         cm = ConnectionManager()
         conn = cm.create_connection()
-        cursor = conn.cursor()
 
-        add_availability = "INSERT INTO Availabilities VALUES (%s , %s)"
         try:
-            cursor.execute(add_availability, (d, self.username))
+            run_statement(conn, "availability.insert", (d, self.username))
             # you must call commit() to persist your data if you don't set autocommit to True
             conn.commit()
-        except pymssql.Error:
+            availability_index(ConnectionManager.get_backend()).add(self.username, d)
+        except DatabaseError:
             # print("Error occurred when updating caregiver availability")
             raise
         finally:
             cm.close_connection()
+
+    # Insert availability for many dates at once; see insert_availabilities
+    def upload_availabilities(self, dates):
+        return Caregiver.insert_availabilities([(d, self.username) for d in dates])
+
+    # Insert (date, username) availability rows in one transaction, written in multi-row
+    # chunks. Rows that already exist are skipped rather than failing the upload.
+    # Returns (inserted, skipped).
+    @staticmethod
+    def insert_availabilities(rows, chunk_size=500):
+        rows = list(rows)
+        unique_rows = list(dict.fromkeys(rows))
+        cm = ConnectionManager()
+        conn = cm.create_connection()
+        cursor = conn.cursor()
+        backend = ConnectionManager.get_backend()
+
+        inserted = 0
+        try:
+            for start in range(0, len(unique_rows), chunk_size):
+                chunk = unique_rows[start:start + chunk_size]
+                add_availabilities = backend.insert_missing("Availabilities", ("Time", "Username"), len(chunk))
+                cursor.execute(add_availabilities, tuple(value for row in chunk for value in row))
+                inserted += cursor.rowcount
+            conn.commit()
+            # rows that were already there are already in the index, adding them again is a no-op
+            index = availability_index(backend)
+            for d, username in unique_rows:
+                index.add(username, d)
+        except DatabaseError:
+            raise
+        finally:
+            cm.close_connection()
+        return inserted, len(rows) - inserted
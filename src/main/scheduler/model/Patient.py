@@ -1,31 +1,30 @@
-import sys
-sys.path.append("../util/*")
-sys.path.append("../db/*")
 from util.Util import Util
 from db.ConnectionManager import ConnectionManager
-import pymssql
+from db.Backend import DatabaseError
+from db.Statements import run_statement
 
 
 class Patient:
-    def __init__(self, username, password=None, salt=None, hash=None):
+    def __init__(self, username, password=None, salt=None, hash=None, kdf_version=None):
         self.username = username
         self.password = password
         self.salt = salt
         self.hash = hash
+        self.kdf_version = kdf_version
 
     # getters
     def get(self):
         cm = ConnectionManager()
         conn = cm.create_connection()
-        cursor = conn.cursor(as_dict=True)
 
-        get_patient_details = "SELECT Salt, Hash FROM Patients WHERE Username = %s"
         try:
-            cursor.execute(get_patient_details, self.username)
+            cursor = run_statement(conn, "patient.credentials", self.username)
             for row in cursor:
                 curr_salt = row['Salt']
                 curr_hash = row['Hash']
-                calculated_hash = Util.generate_hash(self.password, curr_salt)
+                # accounts created before KDF versioning have none recorded, they used version 1
+                curr_kdf_version = row['KdfVersion'] or 1
+                calculated_hash = Util.generate_hash(self.password, curr_salt, curr_kdf_version)
                 if not curr_hash == calculated_hash:
                     # print("Incorrect password")
                     cm.close_connection()
@@ -33,9 +32,10 @@ class Patient:
                 else:
                     self.salt = curr_salt
                     self.hash = calculated_hash
+                    self.kdf_version = curr_kdf_version
                     cm.close_connection()
                     return self
-        except pymssql.Error as e:
+        except DatabaseError as e:
             raise e
         finally:
             cm.close_connection()
@@ -50,17 +50,45 @@ class Patient:
     def get_hash(self):
         return self.hash
 
-    def save_to_db(self):
+    # Insert many already-hashed Patients in multi-row chunks and one commit. Usernames that
+    # are already taken, or repeated, are skipped. Returns how many were inserted.
+    @staticmethod
+    def save_all(patients, chunk_size=500):
+        # the first row per username: a repeat within one statement would break the primary key
+        # on backends that check NOT EXISTS against the table only; it counts as skipped
+        unique = {}
+        for patient in patients:
+            unique.setdefault(patient.username, (patient.username, patient.salt, patient.hash, patient.kdf_version or 1))
+        rows = list(unique.values())
         cm = ConnectionManager()
         conn = cm.create_connection()
         cursor = conn.cursor()
+        backend = ConnectionManager.get_backend()
+
+        inserted = 0
+        try:
+            for start in range(0, len(rows), chunk_size):
+                chunk = rows[start:start + chunk_size]
+                add_patients = backend.insert_missing("Patients", ("Username", "Salt", "Hash", "KdfVersion"),
+                                                   len(chunk), key=("Username",))
+                cursor.execute(add_patients, tuple(value for row in chunk for value in row))
+                inserted += cursor.rowcount
+            conn.commit()
+        except DatabaseError:
+            raise
+        finally:
+            cm.close_connection()
+        return inserted
+
+    def save_to_db(self):
+        cm = ConnectionManager()
+        conn = cm.create_connection()
 
-        add_patients = "INSERT INTO Patients VALUES (%s, %s, %s)"
         try:
-            cursor.execute(add_patients, (self.username, self.salt, self.hash))
+            run_statement(conn, "patient.insert", (self.username, self.salt, self.hash, self.kdf_version or 1))
             # you must call commit() to persist your data if you don't set autocommit to True
             conn.commit()
-        except pymssql.Error:
+        except DatabaseError:
             raise
         finally:
             cm.close_connection()
@@ -1,7 +1,8 @@
-import sys
-sys.path.append("../db/*")
 from db.ConnectionManager import ConnectionManager
-import pymssql
+from db.Backend import DatabaseError
+from db.InventoryCache import inventory
+from db.DoseCounter import dose_counter
+from db.Statements import run_statement
 
 
 class Vaccine:
@@ -13,15 +14,13 @@ class Vaccine:
     def get(self):
         cm = ConnectionManager()
         conn = cm.create_connection()
-        cursor = conn.cursor()
 
-        get_vaccine = "SELECT Name, Doses FROM Vaccines WHERE Name = %s"
         try:
-            cursor.execute(get_vaccine, self.vaccine_name)
-            for row in cursor:
+            # the Vaccines row plus any DoseShards rows
+            for row in run_statement(conn, "vaccine.get", self.vaccine_name):
                 self.available_doses = row[1]
                 return self
-        except pymssql.Error:
+        except DatabaseError:
             # print("Error occurred when getting Vaccine")
             raise
         finally:
@@ -40,14 +39,13 @@ class Vaccine:
 
         cm = ConnectionManager()
         conn = cm.create_connection()
-        cursor = conn.cursor()
 
-        add_doses = "INSERT INTO VACCINES VALUES (%s, %d)"
         try:
-            cursor.execute(add_doses, (self.vaccine_name, self.available_doses))
+            run_statement(conn, "vaccine.insert", (self.vaccine_name, self.available_doses))
             # you must call commit() to persist your data if you don't set autocommit to True
             conn.commit()
-        except pymssql.Error:
+            inventory(ConnectionManager.get_backend()).apply(self.vaccine_name, self.available_doses)
+        except DatabaseError:
             # print("Error occurred when insert Vaccines")
             raise
         finally:
@@ -61,14 +59,14 @@ class Vaccine:
 
         cm = ConnectionManager()
         conn = cm.create_connection()
-        cursor = conn.cursor()
 
-        update_vaccine_availability = "UPDATE vaccines SET Doses = %d WHERE name = %s"
+        # relative update, so concurrent changes to the same vaccine are not overwritten
         try:
-            cursor.execute(update_vaccine_availability, (self.available_doses, self.vaccine_name))
+            run_statement(conn, "vaccine.add_doses", (num, self.vaccine_name))
             # you must call commit() to persist your data if you don't set autocommit to True
             conn.commit()
-        except pymssql.Error:
+            inventory(ConnectionManager.get_backend()).apply(self.vaccine_name, num)
+        except DatabaseError:
             # print("Error occurred when updating vaccine availability")
             raise
         finally:
@@ -77,23 +75,60 @@ class Vaccine:
     # Decrement the available doses
     def decrease_available_doses(self, num):
         if self.available_doses - num < 0:
-            ValueError("Not enough available doses!")
+            raise ValueError("Not enough available doses!")
         self.available_doses -= num
 
         cm = ConnectionManager()
         conn = cm.create_connection()
         cursor = conn.cursor()
 
-        update_vaccine_availability = "UPDATE vaccines SET Doses = %d WHERE name = %s"
+        # one dose at a time through the dose counter, which knows where the stock is kept
+        counter = dose_counter(ConnectionManager.get_backend())
         try:
-            cursor.execute(update_vaccine_availability, (self.available_doses, self.vaccine_name))
+            for _ in range(num):
+                if not counter.take(cursor, self.vaccine_name):
+                    conn.rollback()
+                    raise ValueError("Not enough available doses!")
             # you must call commit() to persist your data if you don't set autocommit to True
             conn.commit()
-        except pymssql.Error:
+            inventory(ConnectionManager.get_backend()).apply(self.vaccine_name, -num)
+        except DatabaseError:
             # print("Error occurred when updating vaccine availability")
             raise
         finally:
             cm.close_connection()
 
+    # Add a shipment manifest of (vaccine name, doses) rows in one transaction: lots for the
+    # same vaccine are summed, then each chunk is a single upsert that adds to existing stock
+    # or creates the vaccine. Returns the number of vaccines touched.
+    @staticmethod
+    def add_doses_bulk(manifest, chunk_size=500):
+        totals = {}
+        for vaccine_name, doses in manifest:
+            if doses is None or doses <= 0:
+                raise ValueError("Argument cannot be negative!")
+            totals[vaccine_name] = totals.get(vaccine_name, 0) + doses
+        rows = list(totals.items())
+
+        cm = ConnectionManager()
+        conn = cm.create_connection()
+        cursor = conn.cursor()
+        backend = ConnectionManager.get_backend()
+
+        try:
+            for start in range(0, len(rows), chunk_size):
+                chunk = rows[start:start + chunk_size]
+                add_doses = backend.upsert_increment("Vaccines", "Name", "Doses", len(chunk))
+                cursor.execute(add_doses, tuple(value for row in chunk for value in row))
+            conn.commit()
+            cache = inventory(backend)
+            for vaccine_name, doses in rows:
+                cache.apply(vaccine_name, doses)
+        except DatabaseError:
+            raise
+        finally:
+            cm.close_connection()
+        return len(rows)
+
     def __str__(self):
         return f"(Vaccine Name: {self.vaccine_name}, Available Doses: {self.available_doses})"
@@ -0,0 +1,244 @@
+import os
+import threading
+import time
+from bisect import bisect_left
+
+# histogram bucket upper bounds in seconds, the last bucket takes everything slower
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# the phases a command's time is broken down into
+PHASES = ("auth", "connect", "query", "fetch", "commit", "pause")
+
+
+class Histogram:
+    __slots__ = ("counts", "count", "sum")
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, seconds):
+        self.counts[bisect_left(BUCKETS, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+
+    def quantile(self, q):
+        # upper bound of the bucket holding the q-th observation, None past the last bound
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(BUCKETS, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return None
+
+    def to_dict(self):
+        return {"count": self.count, "sum": round(self.sum, 6),
+                "p50": self.quantile(0.50), "p95": self.quantile(0.95), "p99": self.quantile(0.99),
+                "buckets": dict(zip([str(b) for b in BUCKETS] + ["+Inf"], self.counts))}
+
+
+class NullTimer:
+    # stands in for a timer when metrics are off or nothing is being measured
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def __setattr__(self, name, value):
+        pass
+
+
+NULL_TIMER = NullTimer()
+
+
+class CommandTimer:
+    # Times one command on the thread running it. Phases entered while it is current add to
+    # `phases` (phase -> [times entered, seconds]); everything is handed to Metrics at the end.
+    __slots__ = ("metrics", "command", "status", "start", "phases", "in_phase")
+
+    def __init__(self, metrics, command):
+        self.metrics = metrics
+        self.command = command
+        self.status = "ok"
+        self.phases = {}
+        self.in_phase = False
+
+    def __enter__(self):
+        self.metrics._local.timer = self
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        elapsed = time.perf_counter() - self.start
+        self.metrics._local.timer = None
+        if exc_type is not None:
+            self.status = "error"
+        self.metrics._record(self, elapsed)
+        return False
+
+
+class PhaseTimer:
+    __slots__ = ("timer", "phase", "start")
+
+    def __init__(self, timer, phase):
+        self.timer = timer
+        self.phase = phase
+
+    def __enter__(self):
+        self.timer.in_phase = True
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter() - self.start
+        timer = self.timer
+        timer.in_phase = False
+        spent = timer.phases.get(self.phase)
+        if spent is None:
+            timer.phases[self.phase] = [1, elapsed]
+        else:
+            spent[0] += 1
+            spent[1] += elapsed
+        return False
+
+
+class Metrics:
+    # Per-command counters and latency histograms, with each command's time broken down by
+    # phase: password hashing (auth), borrowing a connection (connect), executing statements
+    # (query), reading their results (fetch), committing (commit) and the menu pause (pause).
+    # Statements executed and connections borrowed per command are the counts of the query
+    # and connect phases.
+    # Commands are timed with command(), phases with phase(); a phase outside of a command,
+    # or nested in another phase, is not measured. Metrics=0 in the environment turns it all
+    # off, which leaves each hook a single attribute check.
+    def __init__(self, enabled=None):
+        self.enabled = enabled if enabled is not None else os.getenv("Metrics", "1") != "0"
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.started = time.time()
+            # command -> {"ok": n, "failed": n, "error": n}
+            self.statuses = {}
+            # command -> Histogram of whole-command latency
+            self.latency = {}
+            # (command, phase) -> Histogram of the time a command spent in that phase
+            self.phase_latency = {}
+            # (command, phase) -> times the phase was entered
+            self.phase_counts = {}
+
+    def command(self, name):
+        if not self.enabled:
+            return NULL_TIMER
+        return CommandTimer(self, name)
+
+    def phase(self, name):
+        if not self.enabled:
+            return NULL_TIMER
+        timer = getattr(self._local, "timer", None)
+        if timer is None or timer.in_phase:
+            return NULL_TIMER
+        return PhaseTimer(timer, name)
+
+    def current_command(self):
+        # the command being timed on this thread, None outside of one or with metrics off
+        timer = getattr(self._local, "timer", None)
+        return timer.command if timer is not None else None
+
+    def _record(self, timer, elapsed):
+        command = timer.command
+        with self._lock:
+            statuses = self.statuses.get(command)
+            if statuses is None:
+                statuses = self.statuses[command] = {"ok": 0, "failed": 0, "error": 0}
+            statuses[timer.status] = statuses.get(timer.status, 0) + 1
+            histogram = self.latency.get(command)
+            if histogram is None:
+                histogram = self.latency[command] = Histogram()
+            histogram.observe(elapsed)
+            for phase, (count, seconds) in timer.phases.items():
+                key = (command, phase)
+                histogram = self.phase_latency.get(key)
+                if histogram is None:
+                    histogram = self.phase_latency[key] = Histogram()
+                histogram.observe(seconds)
+                self.phase_counts[key] = self.phase_counts.get(key, 0) + count
+
+    def snapshot(self, gauges=None):
+        # everything recorded so far as a JSON-ready dict; `gauges` is {group: {name: value}},
+        # e.g. pool statistics, and is passed through as is
+        with self._lock:
+            commands = {}
+            for command, histogram in sorted(self.latency.items()):
+                commands[command] = dict(
+                    self.statuses[command],
+                    statements=self.phase_counts.get((command, "query"), 0),
+                    connections=self.phase_counts.get((command, "connect"), 0),
+                    seconds=histogram.to_dict(),
+                    phases={phase: dict(self.phase_latency[(command, phase)].to_dict(),
+                                        entered=self.phase_counts[(command, phase)])
+                            for phase in PHASES if (command, phase) in self.phase_latency})
+            return {"enabled": self.enabled, "uptime_seconds": round(time.time() - self.started, 3),
+                    "commands": commands, **(gauges or {})}
+
+    def prometheus(self, gauges=None, counters=None):
+        # the same in the Prometheus text exposition format; `counters` is {name: {statement:
+        # count}}, counted elsewhere and written as scheduler_<name>_total{statement=...}
+        lines = []
+        with self._lock:
+            lines += ["# HELP scheduler_commands_total Commands run, by outcome.",
+                      "# TYPE scheduler_commands_total counter"]
+            for command, statuses in sorted(self.statuses.items()):
+                for status, count in statuses.items():
+                    lines.append('scheduler_commands_total{command="%s",status="%s"} %d' % (command, status, count))
+            lines += ["# HELP scheduler_command_seconds Command latency.",
+                      "# TYPE scheduler_command_seconds histogram"]
+            for command, histogram in sorted(self.latency.items()):
+                lines += histogram_lines("scheduler_command_seconds", 'command="%s"' % command, histogram)
+            lines += ["# HELP scheduler_phase_seconds Time a command spent in each phase.",
+                      "# TYPE scheduler_phase_seconds histogram"]
+            for (command, phase), histogram in sorted(self.phase_latency.items()):
+                lines += histogram_lines("scheduler_phase_seconds", 'command="%s",phase="%s"' % (command, phase),
+                                         histogram)
+            for name, phase, text in (("statements", "query", "Statements executed."),
+                                      ("connections", "connect", "Connections borrowed from the pool.")):
+                lines += ["# HELP scheduler_%s_total %s" % (name, text),
+                          "# TYPE scheduler_%s_total counter" % name]
+                for (command, counted), count in sorted(self.phase_counts.items()):
+                    if counted == phase:
+                        lines.append('scheduler_%s_total{command="%s"} %d' % (name, command, count))
+        for group, values in (gauges or {}).items():
+            for name, value in values.items():
+                if isinstance(value, (int, float)):
+                    lines += ["# TYPE scheduler_%s_%s gauge" % (group, name),
+                              "scheduler_%s_%s %s" % (group, name, value)]
+        for name, values in (counters or {}).items():
+            lines.append("# TYPE scheduler_%s_total counter" % name)
+            for statement, count in values.items():
+                lines.append('scheduler_%s_total{statement="%s"} %d' % (name, statement, count))
+        return "\n".join(lines) + "\n"
+
+
+def histogram_lines(name, labels, histogram):
+    lines = []
+    cumulative = 0
+    for bound, count in zip(BUCKETS, histogram.counts):
+        cumulative += count
+        lines.append('%s_bucket{%s,le="%s"} %d' % (name, labels, bound, cumulative))
+    lines.append('%s_bucket{%s,le="+Inf"} %d' % (name, labels, histogram.count))
+    lines.append("%s_sum{%s} %.6f" % (name, labels, histogram.sum))
+    lines.append("%s_count{%s} %d" % (name, labels, histogram.count))
+    return lines
+
+
+# the process-wide metrics, shared by every session and server worker
+metrics = Metrics()
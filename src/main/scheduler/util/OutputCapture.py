@@ -0,0 +1,50 @@
+import io
+import sys
+import threading
+from contextlib import contextmanager
+
+
+class ThreadLocalStdout:
+    # Stands in for sys.stdout and sends each thread's writes to that thread's capture
+    # buffer, or to the real stdout when it has none. contextlib.redirect_stdout swaps
+    # sys.stdout for the whole process, so concurrent commands would print into each
+    # other's output with it.
+    def __init__(self, stream):
+        self.stream = stream
+        self.local = threading.local()
+
+    def target(self):
+        buffer = getattr(self.local, "buffer", None)
+        return self.stream if buffer is None else buffer
+
+    def write(self, text):
+        return self.target().write(text)
+
+    def flush(self):
+        self.target().flush()
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+
+install_lock = threading.Lock()
+
+
+def thread_stdout():
+    with install_lock:
+        if not isinstance(sys.stdout, ThreadLocalStdout):
+            sys.stdout = ThreadLocalStdout(sys.stdout)
+        return sys.stdout
+
+
+@contextmanager
+def capture_output():
+    # collects what the current thread prints inside the block into a StringIO
+    stdout = thread_stdout()
+    previous = getattr(stdout.local, "buffer", None)
+    buffer = io.StringIO()
+    stdout.local.buffer = buffer
+    try:
+        yield buffer
+    finally:
+        stdout.local.buffer = previous
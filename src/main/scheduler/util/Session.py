@@ -0,0 +1,27 @@
+from db.ConnectionManager import ConnectionManager
+
+
+class Session:
+    # Who is logged in on one CLI, batch run or server connection, and the connection
+    # manager its commands borrow database connections through. Every command takes the
+    # session it runs for, so any number of them can be served from one process.
+    # At most one of patient and caregiver is set.
+    __slots__ = ("patient", "caregiver", "token", "cm")
+
+    def __init__(self):
+        self.patient = None
+        self.caregiver = None
+        self.token = None
+        self.cm = ConnectionManager()
+
+    def logged_in(self):
+        return self.patient is not None or self.caregiver is not None
+
+    def username(self):
+        user = self.patient if self.patient is not None else self.caregiver
+        return None if user is None else user.get_username()
+
+    def clear(self):
+        self.patient = None
+        self.caregiver = None
+        self.token = None
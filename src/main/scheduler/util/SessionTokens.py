@@ -0,0 +1,81 @@
+import hashlib
+import hmac
+import os
+import threading
+import time
+from collections import OrderedDict
+
+
+class SessionTokens:
+    # Issues signed, expiring session tokens after a full password check, so later logins
+    # only need an HMAC comparison and a dictionary lookup. Tokens are kept in a bounded
+    # in-memory store: revoke() and expiry remove them, and the oldest are evicted once
+    # `max_sessions` is reached. A token is "<payload>.<signature>", both hex so they survive
+    # the CLI lowercasing its input; the payload is role:expiry:id:username.
+    def __init__(self, secret=None, ttl=None, max_sessions=None):
+        if secret is None:
+            secret = os.getenv("SessionSecret")
+        self.secret = secret.encode("utf-8") if secret else os.urandom(32)
+        self.ttl = ttl if ttl is not None else float(os.getenv("SessionTTL", "28800"))
+        self.max_sessions = max_sessions if max_sessions is not None else int(os.getenv("SessionMax", "10000"))
+        # token id -> (role, username, expiry), in issue order, which is also expiry order
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def issue(self, role, username):
+        token_id = os.urandom(12).hex()
+        expiry = int(time.time() + self.ttl)
+        payload = "{}:{}:{}:{}".format(role, expiry, token_id, username).encode("utf-8").hex()
+        with self._lock:
+            self._evict(time.time())
+            while len(self._sessions) >= self.max_sessions:
+                self._sessions.popitem(last=False)
+            self._sessions[token_id] = (role, username, expiry)
+        return payload + "." + self._sign(payload)
+
+    def validate(self, token):
+        # (role, username) for a live token, otherwise None
+        parsed = self._parse(token)
+        if parsed is None:
+            return None
+        role, expiry, token_id, username = parsed
+        now = time.time()
+        if expiry < now:
+            return None
+        with self._lock:
+            if token_id not in self._sessions:
+                return None
+        return role, username
+
+    def revoke(self, token):
+        parsed = self._parse(token)
+        if parsed is not None:
+            with self._lock:
+                self._sessions.pop(parsed[2], None)
+
+    def __len__(self):
+        with self._lock:
+            self._evict(time.time())
+            return len(self._sessions)
+
+    def _parse(self, token):
+        payload, _, signature = token.partition(".")
+        # compared as bytes: compare_digest refuses str with anything but ASCII in it
+        if not signature or not hmac.compare_digest(signature.encode("utf-8"), self._sign(payload).encode("ascii")):
+            return None
+        try:
+            role, expiry, token_id, username = bytes.fromhex(payload).decode("utf-8").split(":", 3)
+            return role, int(expiry), token_id, username
+        except ValueError:
+            return None
+
+    def _sign(self, payload):
+        return hmac.new(self.secret, payload.encode("ascii", "replace"), hashlib.sha256).hexdigest()[:32]
+
+    def _evict(self, now):
+        # caller holds the lock
+        while self._sessions:
+            token_id, (_, _, expiry) = next(iter(self._sessions.items()))
+            if expiry >= now:
+                break
+            self._sessions.popitem(last=False)
@@ -1,17 +1,59 @@
 import hashlib
 import os
+from util.Metrics import metrics
+
+
+def hash_chunk(args):
+    # runs in a worker process: salt and hash a chunk of passwords
+    passwords, version = args
+    hashed = []
+    for password in passwords:
+        salt = Util.generate_salt()
+        hashed.append((salt, Util.generate_hash(password, salt, version)))
+    return hashed
 
 
 class Util:
+    # KDF cost by version: version -> (hash name, iterations). Each account stores the version
+    # it was hashed with next to its salt, so raising the cost for new accounts (KdfVersion)
+    # leaves existing accounts verifiable.
+    KDF_VERSIONS = {
+        1: ("sha256", 100000),
+        2: ("sha256", 600000),
+    }
+
     def generate_salt():
         return os.urandom(16)
 
-    def generate_hash(password, salt):
-        key = hashlib.pbkdf2_hmac(
-            'sha256',
-            password.encode('utf-8'),
-            salt,
-            100000,
-            dklen=16
-        )
+    def current_kdf_version():
+        version = int(os.getenv("KdfVersion", "1"))
+        if version not in Util.KDF_VERSIONS:
+            raise ValueError("Unknown KDF version: " + str(version))
+        return version
+
+    def generate_hash(password, salt, version=None):
+        if version is None:
+            version = Util.current_kdf_version()
+        hash_name, iterations = Util.KDF_VERSIONS[version]
+        with metrics.phase("auth"):
+            key = hashlib.pbkdf2_hmac(
+                hash_name,
+                password.encode('utf-8'),
+                salt,
+                iterations,
+                dklen=16
+            )
         return key
+
+    # Yields (salt, hash) for each password, in order, hashing chunks in parallel across
+    # `workers` processes (default: one per CPU).
+    def generate_hashes(passwords, version=None, workers=None, chunk_size=32):
+        # imported here, process pools are slow to import and only bulk imports need one
+        from concurrent.futures import ProcessPoolExecutor
+        if version is None:
+            version = Util.current_kdf_version()
+        passwords = list(passwords)
+        chunks = [(passwords[i:i + chunk_size], version) for i in range(0, len(passwords), chunk_size)]
+        with ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as executor:
+            for hashed in executor.map(hash_chunk, chunks):
+                yield from hashed